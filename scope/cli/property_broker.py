@@ -0,0 +1,30 @@
+# This code is licensed under the MIT License (see LICENSE file for details)
+
+import argparse
+import time
+
+from ..config import scope_configuration
+from ..simple_rpc import property_broker
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='relay microscope property updates to many local clients over a single connection')
+    parser.add_argument('host', nargs='?', default='127.0.0.1', help='microscope host to relay property updates from (default %(default)s)')
+    parser.add_argument('--port', help='local port to serve property updates on (default from scope configuration)')
+    parser.add_argument('--public', action='store_true', help='allow network connections to the broker [default: allow only local connections]')
+    args = parser.parse_args(argv)
+    config = scope_configuration.get_config()
+    # configurations from before the broker was added will lack a port for it
+    port = config.server.get('PROPERTY_BROKER_PORT', '6004') if args.port is None else args.port
+    local_host = config.server.PUBLICHOST if args.public else config.server.LOCALHOST
+    upstream_addr = scope_configuration.get_addresses(args.host, config)['property']
+    local_addr = scope_configuration.make_tcp_host(local_host, port)
+    broker = property_broker.PropertyBroker(upstream_addr, local_addr)
+    print('Relaying property updates from {} to {}'.format(upstream_addr, local_addr))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        broker.stop()
+
+if __name__ == '__main__':
+    main()
@@ -7,10 +7,14 @@ from ..gui import build_gui
 def main(argv=None):
     parser = argparse.ArgumentParser(description="remote microscope monitor")
     parser.add_argument('hosts', nargs="+", metavar='HOST', help='the hosts to monitor')
-    parser.add_argument('--downsample', default=3, type=int, help='image downsampling to reduce load (default %(default)s).')
+    parser.add_argument('--downsample', type=int, help='fixed image downsampling to reduce load (default: choose compression and downsampling automatically).')
     parser.add_argument('--fps-max', type=int, default=5, help='maximum image update FPS to reduce load')
+    parser.add_argument('--max-mbps', type=float, help='bandwidth budget per monitored host, in MB/s, for automatic compression and downsampling')
+    parser.add_argument('--delta-threshold', type=int, help='send only image tiles that changed by more than this many counts '
+        'since the previous frame (default: send whole frames); choose a value above the camera noise level')
     args = parser.parse_args(argv)
-    build_gui.monitor_main(args.hosts, args.downsample, args.fps_max)
+    max_bytes_per_sec = None if args.max_mbps is None else args.max_mbps * 1e6
+    build_gui.monitor_main(args.hosts, args.downsample, args.fps_max, max_bytes_per_sec, args.delta_threshold)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
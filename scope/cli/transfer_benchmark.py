@@ -0,0 +1,204 @@
+# This code is licensed under the MIT License (see LICENSE file for details)
+
+import argparse
+import csv
+import itertools
+import time
+
+import numpy
+
+from ..simple_rpc import rpc_client
+from ..simple_rpc import rpc_server
+from ..util import transfer_ism_buffer
+
+PATHS = ('local', 'remote', 'remote-unchunked')
+
+class _Namespace:
+    pass
+
+def make_test_image(shape=(2560, 2160), seed=0):
+    """Return a Fortran-ordered uint16 image with a smooth 12-bit background,
+    some bright spots, and shot noise, which compresses roughly like a real
+    brightfield image."""
+    rng = numpy.random.RandomState(seed)
+    x, y = numpy.ogrid[-1:1:shape[0]*1j, -1:1:shape[1]*1j]
+    background = 2000 + 1000 * numpy.cos(x * 2) * numpy.cos(y * 3)
+    for cx, cy in rng.uniform(-1, 1, size=(20, 2)):
+        background = background + 1000 * numpy.exp(-((x - cx)**2 + (y - cy)**2) / 0.001)
+    image = rng.poisson(background).clip(0, 4095).astype(numpy.uint16)
+    return numpy.asfortranarray(image)
+
+def compressor_settings(levels=(1, 5, 9)):
+    """Return a list of (compressor, compressor_args) pairs to benchmark,
+    including blosc only if it is installed."""
+    settings = [(None, {})]
+    settings += [('zlib', dict(level=level)) for level in levels]
+    try:
+        import blosc
+        settings += [('blosc', dict(cname=cname, clevel=level)) for cname, level in itertools.product(['lz4', 'zstd'], levels)]
+    except ImportError:
+        pass
+    return settings
+
+def _register_frames(image, frames, prefix='benchmark'):
+    names = []
+    for i in range(frames):
+        name, array = transfer_ism_buffer.create_pooled_array('{}@{}'.format(prefix, i), image.shape, image.dtype, 'Fortran')
+        array[:] = image
+        transfer_ism_buffer.register_array_for_transfer(name, array)
+        names.append(name)
+    return names
+
+def packed_bytes(image, compressor, compressor_args, downsample=None, packing=None):
+    """Return the number of bytes sent over the network to transfer the given
+    image with the given settings."""
+    name, = _register_frames(image, 1, prefix='benchmark-size')
+    transform = transfer_ism_buffer._binned_transform(None, downsample)
+    parts = transfer_ism_buffer._server_pack_many_data([name], compressor, transform=transform, packing=packing, **compressor_args)
+    nbytes = sum(memoryview(part).nbytes for part in parts)
+    transfer_ism_buffer._server_release_array(name)
+    return nbytes
+
+def benchmark(fetch, image, frames=20):
+    """Transfer the given number of copies of the image with fetch(name), and
+    return a dict of the mean and 95th-percentile latency per frame (in ms),
+    frames per second, and CPU time per frame (in ms, counting both client and
+    server, which share this process)."""
+    names = _register_frames(image, frames)
+    latencies = []
+    cpu0 = time.process_time()
+    t0 = time.perf_counter()
+    for name in names:
+        t = time.perf_counter()
+        fetch(name)
+        latencies.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - t0
+    cpu = time.process_time() - cpu0
+    return dict(
+        latency_ms=1000 * numpy.mean(latencies),
+        latency_p95_ms=1000 * numpy.percentile(latencies, 95),
+        fps=frames / elapsed,
+        cpu_ms=1000 * cpu / frames
+    )
+
+def run_matrix(addr='tcp://127.0.0.1:6099', frames=20, shapes=((2560, 2160),), settings=None,
+        downsamples=(None,), packings=(None, 'mono12'), paths=PATHS):
+    """Serve transfer_ism_buffer over RPC from this process with a
+    BackgroundBaseZMQServer, and measure end-to-end image delivery to a client
+    over loopback for every combination of frame shape, (compressor,
+    compressor_args) setting, downsampling factor, packing (None or 'mono12'),
+    and delivery path:
+        'local': shared memory, as used by clients on the server's host;
+        'remote': chunked, parallel compression, as used by remote clients;
+        'remote-unchunked': whole-image compression (no packing support).
+    Compression, downsampling and packing do not apply to the local path, so it
+    is measured only once per frame shape.
+
+    Yield a dict for each combination with keys path, shape, compressor,
+    compressor_args, downsample, packing, the measurements from benchmark(),
+    and mb_per_sec (image data delivered), wire_mb (bytes sent per frame) and
+    ratio (image bytes delivered / bytes sent; None for the local path)."""
+    if settings is None:
+        settings = compressor_settings()
+    namespace = _Namespace()
+    namespace._transfer_ism_buffer = transfer_ism_buffer
+    server = rpc_server.BackgroundBaseZMQServer(namespace, addr)
+    client = rpc_client.ZMQClient(addr)
+    try:
+        is_local, local_get_data = transfer_ism_buffer.client_get_data_getter(client)
+        is_local, remote_get_data = transfer_ism_buffer.client_get_data_getter(client, force_remote=True)
+        remote_paths = [path for path in PATHS[1:] if path in paths]
+        for shape in shapes:
+            image = make_test_image(shape)
+            if 'local' in paths:
+                result = dict(path='local', shape=shape, compressor=None, compressor_args={}, downsample=None, packing=None)
+                result.update(benchmark(local_get_data, image, frames))
+                local_get_data.flush_releases()
+                result.update(mb_per_sec=image.nbytes * result['fps'] / 1e6, wire_mb=0, ratio=None)
+                yield result
+            for (compressor, compressor_args), downsample, packing, path in itertools.product(settings, downsamples, packings, remote_paths):
+                if path == 'remote-unchunked' and packing is not None:
+                    continue
+                remote_get_data.set_network_compression(compressor, downsample, **compressor_args)
+                remote_get_data.set_packed12(packing == 'mono12')
+                fetch = remote_get_data if path == 'remote' else remote_get_data.get_unchunked
+                result = dict(path=path, shape=shape, compressor=compressor, compressor_args=compressor_args,
+                    downsample=downsample, packing=packing)
+                result.update(benchmark(fetch, image, frames))
+                delivered = image.nbytes / (downsample or 1)**2
+                sent = packed_bytes(image, compressor, compressor_args, downsample, packing)
+                result.update(mb_per_sec=delivered * result['fps'] / 1e6, wire_mb=sent / 1e6, ratio=delivered / sent)
+                yield result
+    finally:
+        server.stop()
+        client.socket.close()
+
+_COLUMNS = [
+    # (result key, heading, format)
+    ('path', 'path', '{:<16}'),
+    ('shape', 'shape', '{:<10}'),
+    ('compressor', 'method', '{:<6}'),
+    ('compressor_args', 'arguments', '{:<20}'),
+    ('downsample', 'ds', '{:>2}'),
+    ('packing', 'pixels', '{:<6}'),
+    ('latency_ms', 'ms', '{:>7.1f}'),
+    ('latency_p95_ms', 'p95 ms', '{:>7.1f}'),
+    ('fps', 'fps', '{:>7.1f}'),
+    ('mb_per_sec', 'MB/s', '{:>7.1f}'),
+    ('cpu_ms', 'CPU ms', '{:>7.1f}'),
+    ('wire_mb', 'MB sent', '{:>7.2f}'),
+    ('ratio', 'ratio', '{:>6}')
+]
+
+def _format_values(result):
+    values = dict(result)
+    values['shape'] = 'x'.join(map(str, result['shape']))
+    values['compressor'] = str(result['compressor'])
+    values['compressor_args'] = ','.join('{}={}'.format(k, v) for k, v in sorted(result['compressor_args'].items()))
+    values['downsample'] = result['downsample'] or 1
+    values['packing'] = 'mono12' if result['packing'] else 'mono16'
+    values['ratio'] = '-' if result['ratio'] is None else '{:.2f}'.format(result['ratio'])
+    return values
+
+def _heading_format(format):
+    return '{' + format[1:].split('.')[0].rstrip('}') + '}'
+
+def _int_list(text):
+    return [int(value) for value in text.split(',')]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='benchmark image delivery to local (shared-memory) and remote '
+        'clients across frame sizes, compressors, compression levels, downsampling factors and pixel packings')
+    parser.add_argument('--frames', type=int, default=20, help='frames to transfer per combination (default %(default)s)')
+    parser.add_argument('--shapes', default='2560x2160,1280x1080', help='comma-separated frame sizes (default %(default)s)')
+    parser.add_argument('--levels', type=_int_list, default='1,5,9', help='comma-separated compression levels (default %(default)s)')
+    parser.add_argument('--downsample', type=_int_list, default='1,2', help='comma-separated downsampling factors (default %(default)s)')
+    parser.add_argument('--paths', default=','.join(PATHS), help='comma-separated delivery paths (default %(default)s)')
+    parser.add_argument('--csv', help='also write the results to this CSV file')
+    parser.add_argument('--port', default='6099', help='loopback port to run the benchmark server on (default %(default)s)')
+    args = parser.parse_args(argv)
+    try:
+        shapes = [tuple(int(size) for size in shape.split('x')) for shape in args.shapes.split(',')]
+    except ValueError:
+        parser.error('frame sizes must be given as WIDTHxHEIGHT')
+    paths = args.paths.split(',')
+    for path in paths:
+        if path not in PATHS:
+            parser.error('unknown path "{}": choose from {}'.format(path, ', '.join(PATHS)))
+    downsamples = [None if downsample == 1 else downsample for downsample in args.downsample]
+    results = run_matrix('tcp://127.0.0.1:' + args.port, args.frames, shapes, compressor_settings(args.levels),
+        downsamples, paths=paths)
+    print(' '.join(_heading_format(format) for key, heading, format in _COLUMNS).format(*[heading for key, heading, format in _COLUMNS]))
+    rows = []
+    for result in results:
+        values = _format_values(result)
+        print(' '.join(format.format(values[key]) for key, heading, format in _COLUMNS), flush=True)
+        rows.append({heading: values[key] for key, heading, format in _COLUMNS})
+    if args.csv:
+        with open(args.csv, 'w', newline='') as f:
+            writer = csv.DictWriter(f, [heading for key, heading, format in _COLUMNS])
+            writer.writeheader()
+            writer.writerows(rows)
+
+if __name__ == '__main__':
+    main()
@@ -29,6 +29,10 @@ scope_configuration = dict(
         RPC_INTERRUPT_PORT = '6001',
         PROPERTY_PORT = '6002',
         IMAGE_TRANSFER_RPC_PORT = '6003',
+        PROPERTY_BROKER_PORT = '6004', # local port for scope_property_broker, if used
+        IMAGE_PUSH_PORT = '6005', # frames are pushed to subscribed clients from this port (see util/frame_push.py)
+        PROPERTY_JOURNAL_DIR = None, # set to a directory path to record all property updates (see simple_rpc/property_journal.py)
+        PROPERTY_ENCODING = 'json', # 'binary' sends numeric property values compactly, but only clients that know the format can read them
     ),
 
     stand = dict(
@@ -40,6 +44,7 @@ scope_configuration = dict(
 
     camera = dict(
         MODEL = 'ZYLA-5.5-USB3',
+        SIMULATED = False, # set to True to use a software-simulated camera (see device/andor/simulated_lowlevel.py)
         IOTOOL_PINS = dict(
             trigger = 'B0',
             arm = 'B1',
@@ -25,7 +25,9 @@ def get_addresses(host=None, config=None):
         rpc=make_tcp_host(host, config.server.RPC_PORT),
         interrupt=make_tcp_host(host, config.server.RPC_INTERRUPT_PORT),
         property=make_tcp_host(host, config.server.PROPERTY_PORT),
-        image_transfer_rpc=make_tcp_host(host, config.server.IMAGE_TRANSFER_RPC_PORT)
+        image_transfer_rpc=make_tcp_host(host, config.server.IMAGE_TRANSFER_RPC_PORT),
+        # configurations from before frame pushing was added will lack a port for it
+        image_push=make_tcp_host(host, config.server.get('IMAGE_PUSH_PORT', '6005'))
      )
 
 _CONFIG = None
@@ -56,21 +56,36 @@ to switch to an exposure time < read. This is probably an andor bug.
 TODO: check if the bug is still there in a future SDK release (date 2015-10)
 """
 
+import json
+import math
+import numbers
+import os
 import threading
 import time
 import ctypes
 import numpy
 import contextlib
 import collections
+import concurrent.futures
+import queue
 import atexit
-import itertools
 
-from . import lowlevel
 from ...util import transfer_ism_buffer
+from ...util import live_ring
+from ...util import packed12
 from ...util import enumerated_properties
 from ...util import property_device
 from ...config import scope_configuration
 
+if scope_configuration.get_config().camera.get('SIMULATED', False):
+    # emulate the camera in software, for running without the hardware (see simulated_lowlevel.py)
+    from . import simulated_lowlevel as lowlevel
+else:
+    from . import lowlevel
+from . import feature_cache
+# all SDK access goes through the cache, so that unchanged feature values are not re-read from the camera
+lowlevel = feature_cache.FeatureCache(lowlevel)
+
 
 from ...util import logging
 logger = logging.get_logger(__name__)
@@ -101,6 +116,13 @@ class AT_Enum(ReadOnly_AT_Enum, enumerated_properties.DictProperty):
 class Camera(property_device.PropertyDevice):
     _DESCRIPTION = 'Andor camera'
     _EXPECTED_INIT_ERRORS = (lowlevel.AndorError,)
+    _LIVE_RING_SLOTS = 4
+    _CONVERSION_WORKERS = 2 # threads converting live frames from the camera's pixel encoding
+    _STREAM_BUFFERS = 32 # raw buffers in flight when streaming to disk
+    # camera settings recorded in the metadata.json of a stream to disk
+    _STREAM_METADATA = ('exposure_time', 'readout_rate', 'sensor_gain', 'shutter_mode', 'overlap_enabled',
+        'binning', 'aoi_left', 'aoi_top', 'aoi_width', 'aoi_height', 'pixel_encoding')
+    _SEQUENCE_BUFFERS = 16 # raw buffers to keep queued for sequence acquisitions, which are drained continuously
 
     _CAMERA_DEFAULTS = [
         ('AOIBinning', lowlevel.SetEnumString, '1x1'),
@@ -159,12 +181,23 @@ class Camera(property_device.PropertyDevice):
         # is read-only. This information is useful for programmatically constructing
         # GUI widgets representing each property.
         self._andor_property_types = {}
+        # _property_features maps Python property names to the Andor features they set
+        self._property_features = {}
+        # state of settings transactions (see _set_state()): nesting depth, features whose
+        # change notifications are held back until the outermost transaction ends, and
+        # whether the frame rate range (and frame rate) must be updated at the end
+        self._transaction_lock = threading.Lock()
+        self._transaction_depth = 0
+        self._pending_features = set()
+        self._frame_rate_range_stale = False
+        self._maximize_frame_rate = False
 
         config = scope_configuration.get_config()
 
         lowlevel.initialize(config.camera.MODEL) # safe to call this multiple times
 
         self._live_mode = False
+        self._live_lock = threading.RLock()
         self.return_to_default_state()
 
         # Expose some certain camera properties presented by the Andor API more or less directly,
@@ -211,21 +244,30 @@ class Camera(property_device.PropertyDevice):
         self._add_property_data('ReadoutTime', 'Float', True, 'readout_time', self.get_readout_time)
         self._add_property_data('Overlap', 'Bool', False, 'overlap_enabled', self.get_overlap_enabled)
 
-        if property_server:
-            self._c_callback = lowlevel.FeatureCallback(self._andor_callback)
-            for at_feature in self._callback_properties.keys():
-                lowlevel.RegisterFeatureCallback(at_feature, self._c_callback, 0)
+        # register callbacks even without a property server, as they also keep the feature cache current
+        self._c_callback = lowlevel.FeatureCallback(self._andor_callback)
+        for at_feature in self._callback_properties.keys():
+            lowlevel.RegisterFeatureCallback(at_feature, self._c_callback, 0)
 
+        if property_server:
             self._sleep_time = 10
             self._timer_running = True
             self._timer_thread = threading.Thread(target=self._timer_update_temp, daemon=True)
             self._timer_thread.start()
 
         self._frame_number = -1
+        self._set_event_property('frame_number') # each new frame must be announced, and need not be compared to the last
         self._update_property('frame_number', self._frame_number)
         self._update_property('live_mode', self._live_mode)
+        self._live_ring = None
+        self._update_property('live_ring_name', None)
+        self._disk_stream = None
+        self._sequence_reader = None
+        self._last_sequence_stats = None
         self._maybe_update_frame_rate_and_range('ExposureTime') # pretend exposure time was updated, to force the frame rate range to get updated
         self._latest_data = None
+        # functions to call with (array, timestamp, frame_number) for each new frame, e.g. to push frames to clients
+        self._frame_listeners = []
 
     def _timer_update_temp(self):
         getter, updater = self._callback_properties['SensorTemperature']
@@ -251,6 +293,7 @@ class Camera(property_device.PropertyDevice):
         updater = self._add_property(py_name, getter())
         self._callback_properties[at_feature] = (getter, updater)
         self._andor_property_types[py_name] = at_type, readonly
+        self._property_features[py_name] = at_feature
 
     def _add_andor_enum(self, at_feature, py_name, readonly=False, custom_setter=False):
         """Expose a camera setting presented by the Andor API as an enum (via GetEnumIndex,
@@ -266,7 +309,7 @@ class Camera(property_device.PropertyDevice):
         setter_name = 'set_'+py_name
         if not readonly and not hasattr(self, setter_name):
             def setter(value):
-                with self.in_state(live_mode=False):
+                with self._live_change(at_feature):
                     enum.set_value(value)
                     self._maybe_update_frame_rate_and_range(at_feature)
             setattr(self, setter_name, setter)
@@ -305,12 +348,19 @@ class Camera(property_device.PropertyDevice):
         if not readonly:
             andor_setter = getattr(lowlevel, 'Set'+at_type)
             def setter(value):
-                with self.in_state(live_mode=False):
+                with self._live_change(at_feature):
                     andor_setter(at_feature, value)
                     self._maybe_update_frame_rate_and_range(at_feature)
             setattr(self, 'set_'+py_name, setter)
 
     def _andor_callback(self, camera_handle, at_feature, context):
+        # the cache's own callback for this feature may not have been called yet
+        lowlevel.invalidate(at_feature)
+        with self._transaction_lock:
+            if self._transaction_depth:
+                # publish the final value once the whole transaction is done
+                self._pending_features.add(at_feature)
+                return lowlevel.AT_CALLBACK_SUCCESS
         try:
             getter, update = self._callback_properties[at_feature]
             update(getter())
@@ -319,10 +369,16 @@ class Camera(property_device.PropertyDevice):
         return lowlevel.AT_CALLBACK_SUCCESS
 
     def __del__(self):
-        if self._property_server:
+        if hasattr(self, '_c_callback'):
             for at_feature in self._callback_properties.keys():
                 lowlevel.UnregisterFeatureCallback(at_feature, self._c_callback, 0)
 
+    def get_feature_cache_stats(self):
+        """Return statistics for the cache of camera feature values: hits (SDK
+        calls avoided), misses (reads that went to the camera), hit_rate,
+        callback_invalidations, write_invalidations and cached_values."""
+        return lowlevel.get_cache_stats()
+
     def get_andor_property_types(self):
         """Return a dict mapping the property names to a pair of:
         (andor_type, read_only), where andor_type is a one of 'Int', 'String',
@@ -331,13 +387,132 @@ class Camera(property_device.PropertyDevice):
 
     def _maybe_update_frame_rate_and_range(self, at_feature):
         """When setting a property, the frame rate range may change. If so,
-        update the range and set the frame rate to the max possible."""
+        update the range and set the frame rate to the max possible. Within a
+        settings transaction, this is deferred until all settings are written
+        (see _set_state())."""
+        with self._transaction_lock:
+            if self._transaction_depth:
+                if at_feature in self._PROPERTIES_THAT_CAN_CHANGE_FRAME_RATE_RANGE:
+                    self._frame_rate_range_stale = self._maximize_frame_rate = True
+                elif at_feature == 'FrameRate':
+                    # an explicitly-set frame rate should not be replaced by the max
+                    self._maximize_frame_rate = False
+                return
         if at_feature in self._PROPERTIES_THAT_CAN_CHANGE_FRAME_RATE_RANGE:
-            min, max = self.get_frame_rate_range()
-            self._update_property('frame_rate_range',  '[{:.5f}, {:.5f}]'.format(min, max))
-            if lowlevel.IsWritable('FrameRate'):
-                lowlevel.SetFloat('FrameRate', max)
-                self._update_property('frame_rate', max)
+            self._update_frame_rate_and_range()
+
+    def _update_frame_rate_and_range(self, maximize=True):
+        min, max = self.get_frame_rate_range()
+        self._update_property('frame_rate_range',  '[{:.5f}, {:.5f}]'.format(min, max))
+        if maximize and lowlevel.IsWritable('FrameRate'):
+            lowlevel.SetFloat('FrameRate', max)
+            self._update_property('frame_rate', max)
+
+    def _settle_frame_rate(self):
+        """Perform any frame rate range update deferred by the current settings
+        transaction, e.g. before the frame rate is used to time live mode."""
+        with self._transaction_lock:
+            stale, maximize = self._frame_rate_range_stale, self._maximize_frame_rate
+            self._frame_rate_range_stale = self._maximize_frame_rate = False
+        if stale:
+            self._update_frame_rate_and_range(maximize)
+
+    @contextlib.contextmanager
+    def _settings_transaction(self):
+        """Context manager for writing a number of settings as one change:
+        frame rate range updates are done once at the end, and change
+        notifications for the affected properties are held back and then
+        published together, with their final values, once the outermost
+        transaction ends."""
+        with self._transaction_lock:
+            self._transaction_depth += 1
+        try:
+            yield
+        finally:
+            try:
+                # even if a write failed, others may have changed the range
+                self._settle_frame_rate()
+            finally:
+                with self._transaction_lock:
+                    self._transaction_depth -= 1
+                    if self._transaction_depth:
+                        pending = ()
+                    else:
+                        pending, self._pending_features = self._pending_features, set()
+            for at_feature in sorted(pending):
+                getter, update = self._callback_properties[at_feature]
+                try:
+                    update(getter())
+                except:
+                    logger.log_exception('Error publishing camera property:')
+
+    def _set_state(self, properties_and_values):
+        """Set a number of camera properties, in the order specified, as a single
+        transaction (see _settings_transaction()). Unless live mode is among the
+        properties, live mode is paused (if necessary) once for the whole set of
+        changes, rather than for each."""
+        properties_and_values = list(properties_and_values)
+        properties = [p for p, v in properties_and_values]
+        with self._live_lock, contextlib.ExitStack() as stack:
+            if 'live_mode' not in properties:
+                # properties without a known Andor feature (e.g. 'aoi') always pause live mode
+                stack.enter_context(self._live_change(*[self._property_features.get(p) for p in properties]))
+            stack.enter_context(self._settings_transaction())
+            for p, v in properties_and_values:
+                getattr(self, 'set_'+p)(v)
+
+    def _validate_state(self, state):
+        """Raise a ValueError if any of the given properties cannot be set, or
+        any value is of the wrong type or not a recognized enum value. (Whether
+        numeric values are in range depends on the other settings, so is checked
+        only when each is written.)"""
+        for p, v in state.items():
+            if not hasattr(self, 'set_'+p):
+                raise ValueError('"{}" is not a settable camera property.'.format(p))
+            at_type, readonly = self._andor_property_types.get(p, (None, False))
+            if at_type == 'Enum':
+                values = getattr(self, 'get_'+p+'_values')()
+                if v not in values:
+                    raise ValueError('{} must be one of {}.'.format(p, sorted(values)))
+            elif at_type == 'Bool' or p == 'live_mode':
+                if not isinstance(v, (bool, numpy.bool_)):
+                    raise ValueError('{} must be True or False.'.format(p))
+            elif at_type in ('Int', 'Float'):
+                number_type = numbers.Integral if at_type == 'Int' else numbers.Real
+                if isinstance(v, (bool, numpy.bool_)) or not isinstance(v, number_type):
+                    raise ValueError('{} must be {}.'.format(p, 'an integer' if at_type == 'Int' else 'a number'))
+
+    def apply_state(self, state):
+        """Set a number of camera properties at once from a dict mapping property
+        names to values. The whole set is validated before anything is written;
+        properties are then written in an order that respects the camera's
+        dependencies (see the STATE-STACK HANDLING notes), each at most once,
+        with live mode paused at most once, the frame rate range recomputed
+        once, and the final values of all affected properties published
+        together at the end. Unlike push_state(), the previous values are not
+        saved."""
+        state = dict(state)
+        self._validate_state(state)
+        old_state = {p: getattr(self, 'get_'+p)() for p in state}
+        self._update_push_states(state, old_state)
+        if state:
+            self._set_state(self._order_state(state, self._get_push_weights(state)))
+
+    def _order_state(self, state, weights):
+        # AOI parameters must be changed in a particular order (see set_aoi())
+        aoi_items = sorted(((p, v) for p, v in state.items() if p.startswith('aoi_')), key=self._delta_sort_key)
+        ordered = dict(aoi_items)
+        ordered.update((p, v) for p, v in state.items() if p not in ordered)
+        return self._order(ordered, weights)
+
+    def push_state(self, **state):
+        """Set a number of camera properties at once using keyword arguments, while
+        saving the old values of those parameters. pop_state() will restore those
+        previous values. push_state/pop_state pairs can be nested arbitrarily.
+        As with apply_state(), the new values are validated before anything is
+        written, and are then applied as a single change."""
+        self._validate_state(state)
+        super().push_state(**state)
 
     # STATE-STACK HANDLING
     # there are complex dependencies here. When pushing, better to set frame_count AFTER cycle_mode,
@@ -398,8 +573,9 @@ class Camera(property_device.PropertyDevice):
             # Setting overlap mode in software trigger / rolling shutter is an error,
             # but trying to unset it in this mode should not be...
             return
-        lowlevel.SetBool('Overlap', enabled)
-        self._maybe_update_frame_rate_and_range('Overlap')
+        with self._live_change('Overlap'):
+            lowlevel.SetBool('Overlap', enabled)
+            self._maybe_update_frame_rate_and_range('Overlap')
 
     def get_exposure_time(self):
         """Return exposure time in ms"""
@@ -407,14 +583,9 @@ class Camera(property_device.PropertyDevice):
 
     def set_exposure_time(self, ms):
         """Set the exposure time in ms. If necessary, live imaging will be paused."""
-        lowlevel.SetFloat('ExposureTime', ms / 1000)
-        self._maybe_update_frame_rate_and_range('ExposureTime')
-        if self._live_mode:
-            trigger_interval = self._calculate_live_trigger_interval()
-            self._live_trigger.trigger_interval = trigger_interval
-            self._live_reader.set_timeout(trigger_interval)
-            # ... and clear recent FPS data
-            self._live_reader.latest_intervals.clear()
+        with self._live_change('ExposureTime'):
+            lowlevel.SetFloat('ExposureTime', ms / 1000)
+            self._maybe_update_frame_rate_and_range('ExposureTime')
 
     def get_exposure_time_range(self):
         """Return current exposure time minimum and maximum values in ms"""
@@ -422,7 +593,7 @@ class Camera(property_device.PropertyDevice):
                 1000 * lowlevel.GetFloatMax('ExposureTime'))
 
     def set_sensor_gain(self, value):
-        with self.in_state(live_mode=False):
+        with self._live_change('SimplePreAmpGainControl'):
             self._gain_enum.set_value(value)
             if value.startswith('12'):
                 # make sure we always use the packed encoding for 12-bit mode
@@ -459,7 +630,7 @@ class Camera(property_device.PropertyDevice):
         # Performing AOI updates in ascending order of signed parameter value change ensures that setting
         # a collection of AOI parameters that are together legal does not require transitioning through
         # an illegal state.
-        with self.in_state(live_mode=False):
+        with self._live_change('AOILeft'):
             for key, value in sorted(aoi_dict.items(), key=self._delta_sort_key):
                 getattr(self, 'set_' + key)(value)
 
@@ -512,12 +683,55 @@ class Camera(property_device.PropertyDevice):
         return self._live_mode
 
     def set_live_mode(self, enabled):
-        if enabled:
-            self._enable_live()
-        else:
-            self._disable_live()
+        with self._live_lock:
+            if enabled:
+                self._enable_live()
+            else:
+                self._disable_live()
         self._update_property('live_mode', enabled)
 
+    @contextlib.contextmanager
+    def _live_change(self, *at_features):
+        """Context manager for changing the given Andor features (and any others
+        that go with them) while live mode may be on. If the camera allows the
+        features to be written while acquiring, live mode keeps running, and the
+        live trigger interval is recalculated for the new settings. Otherwise,
+        live mode is stopped for the change and restarted before returning.
+        Nested changes (e.g. set_aoi() calling the individual AOI setters, or
+        the setters called by apply_state()) share a single restart, done at
+        the end of the outermost change. Restarting before returning also
+        keeps the live-mode settings entry on the state stack beneath any
+        entry that push_state() then adds for the change."""
+        with self._live_lock:
+            if self._live_mode and all(f is not None and lowlevel.IsWritable(f) for f in at_features):
+                yield
+                if not self._transaction_depth: # otherwise, done once the transaction has ended
+                    self._update_live_timing()
+                return
+            # if live mode was stopped by an enclosing change, that change will restart it
+            restart = self._live_mode
+            if restart:
+                self._disable_live()
+            try:
+                yield
+            finally:
+                if restart:
+                    try:
+                        self._enable_live()
+                    except:
+                        logger.log_exception('Could not restart live mode after changing camera settings:')
+                        self._update_property('live_mode', False)
+
+    def _update_live_timing(self):
+        """Recalculate the live trigger interval in place, after a change to
+        the camera settings."""
+        trigger_interval = self._calculate_live_trigger_interval()
+        self._live_trigger.set_trigger_interval(trigger_interval)
+        self._live_reader.set_timeout(trigger_interval)
+        # ... and clear recent FPS data
+        self._live_reader.latest_intervals.clear()
+        self._live_reader.read_times.clear()
+
     def latest_image(self):
         """Get the latest image that the camera retrieved, its timestamp, and
         its frame number."""
@@ -541,15 +755,27 @@ class Camera(property_device.PropertyDevice):
         self._latest_data = name, array, self._frame_number, timestamp
         self._update_property('frame_number', self._frame_number)
 
+    def _notify_frame_listeners(self, array, timestamp, frame_number):
+        """Pass a newly-acquired frame to the frame listeners. This is called
+        from the delivery thread of the ConversionPipeline, as soon as each
+        frame is converted, rather than when a client retrieves the frame."""
+        for listener in self._frame_listeners:
+            try:
+                listener(array, timestamp, frame_number)
+            except Exception:
+                logger.log_exception('Error in camera frame listener:')
+
     def _enable_live(self):
         """Turn on live-imaging mode. The basic strategy is to put the camera
         into software triggering mode with continuous cycling and then have a
         thread that simply executes a software trigger at the maximum possible
         rate given how fast the camera can operate (as determined by the logic
-        in _calculate_live_trigger_interval()). A single buffer is created and
-        repeatedly queued and waited on by a separate thread, which exists to
-        copy the result out to the output array via convert_buffer() as fast as
-        possible. Note that tight coupling between the trigger and the reader
+        in _calculate_live_trigger_interval()). A few buffers are created and
+        repeatedly queued and waited on by a separate reader thread, which hands
+        each filled buffer to a ConversionPipeline, where worker threads
+        convert it to an output array, to be delivered in order. Thus the reader
+        only ever waits for, dequeues and re-queues buffers, and conversion does
+        not eat into the time it has to keep up with the camera. Note that tight coupling between the trigger and the reader
         threads is not required, as the camera has some RAM in which images
         that have been acquired can be buffered before getting read out to the
         computer via the Andor queue / wait commands."""
@@ -559,18 +785,31 @@ class Camera(property_device.PropertyDevice):
         self.push_state(cycle_mode='Continuous', trigger_mode='Software', readout_rate='280 MHz')
         trigger_interval = self._calculate_live_trigger_interval()
         namebase = 'live@-'+str(time.time())
-        buffer_maker = BufferFactory(namebase, frame_count=1, cycle=True)
+        buffer_maker = BufferFactory(namebase, frame_count=None, cycle=True, queue_depth=self._CONVERSION_WORKERS + 2)
+        # local clients can read live frames straight from this ring, without any RPC calls
+        ring = self._live_ring = live_ring.LiveRing(namebase + '-ring', buffer_maker.buffer_shape, slots=self._LIVE_RING_SLOTS)
+        self._update_property('live_ring_name', ring.name)
         self._live_mode = True
         lowlevel.Command('AcquisitionStart')
+        def deliver(name, array, timestamp):
+            # write to the ring before announcing the new frame number
+            ring.write(array, self._frame_number + 1, timestamp)
+            self._update_image_data(name, array, timestamp)
+            self._notify_frame_listeners(array, timestamp, self._frame_number)
+        self._conversion_pipeline = ConversionPipeline(buffer_maker.convert, deliver, self._CONVERSION_WORKERS)
+        self._live_buffer_maker = buffer_maker
+        def queue_buffers():
+            buffer_maker.queue_free_buffers(timeout=1)
         def update():
-            self._update_image_data(*buffer_maker.convert_buffer())
-        self._live_reader = LiveReader(buffer_maker.queue_buffer, update, trigger_interval)
+            self._conversion_pipeline.submit(*buffer_maker.next_filled())
+        self._live_reader = LiveReader(queue_buffers, update, trigger_interval)
         self._live_trigger = LiveTrigger(trigger_interval, self._live_reader)
 
     def _calculate_live_trigger_interval(self):
         """Determine how long to wait between sending acquisition triggers in
         live mode, based on data from the andor API.
         Returns trigger interval in seconds."""
+        self._settle_frame_rate()
         sustainable_rate = min(self.get_frame_rate(), self.get_max_interface_fps())
         trigger_interval = 1/sustainable_rate * 1.05
         return trigger_interval
@@ -584,11 +823,68 @@ class Camera(property_device.PropertyDevice):
         # is still ongoing, then it can read one last frame quickly and stop.
         self._live_reader.stop()
         self._live_trigger.stop()
+        self._conversion_pipeline.stop()
         lowlevel.Command('AcquisitionStop')
         lowlevel.Flush()
         self._live_mode = False
+        self._live_ring = None
+        self._live_buffer_maker = None
+        self._update_property('live_ring_name', None)
         self.pop_state()
 
+    def get_live_ring_name(self):
+        """Return the name of the shared-memory ring that live frames are
+        written to (see util.live_ring), or None if not in live mode."""
+        return None if self._live_ring is None else self._live_ring.name
+
+    def get_conversion_stats(self):
+        """Return a dict of live-mode frame pipeline statistics, or None if not
+        in live mode. Keys are:
+            queued_with_camera: buffers queued with the camera, to be filled
+            free_buffers: buffers waiting to be re-queued
+            converting: frames waiting for or undergoing conversion
+            awaiting_delivery: converted frames waiting for earlier ones
+            delivered, failed: counts of frames
+            read_ms: mean recent time between frames read from the camera
+            convert_ms, deliver_ms: mean recent time per frame in each stage
+            latency_ms: mean recent time from reading to delivering a frame
+            conversion_path: how frames are converted from the camera's pixel
+                encoding: 'sdk' (the Andor utility library), 'copy' (directly,
+                for 16-bit encodings), or 'unpack' (numpy, for Mono12Packed),
+                whichever was measured to be fastest.
+        """
+        if not self._live_mode:
+            return
+        stats = self._conversion_pipeline.get_stats()
+        stats.update(queued_with_camera=len(self._live_buffer_maker.queued_buffers),
+            free_buffers=len(self._live_buffer_maker.free_buffers),
+            conversion_path=self._live_buffer_maker.conversion_path)
+        intervals = list(self._live_reader.latest_intervals)
+        stats['read_ms'] = 1000 * numpy.mean(intervals) if intervals else None
+        return stats
+
+    def get_live_timing_stats(self):
+        """Return a dict of live-mode trigger timing statistics, or None if not
+        in live mode. Times are in ms, and recent values are calculated over the
+        last few dozen frames. Keys are:
+            triggers, frames: counts of software triggers sent and frames read
+            outstanding: triggers sent whose frames have not yet been read
+            target_backlog: how many triggers are allowed to be outstanding
+            lost_triggers: triggers that never produced a frame
+            backlog_waits: triggers delayed because the camera was not keeping up
+            target_fps: the rate triggers are scheduled at
+            fps: recent achieved frame rate
+            frame_interval_ms, frame_jitter_ms: mean and standard deviation of
+                recent intervals between frames being read
+            latency_ms, latency_max_ms: mean and max recent time from sending
+                a trigger to reading the resulting frame
+            lateness_ms, lateness_max_ms: mean and max recent delay in sending
+                triggers after their scheduled times
+        """
+        if not self._live_mode:
+            return
+        return self._live_trigger.get_stats()
+
     def get_live_fps(self):
         if not self._live_mode:
             return
@@ -621,10 +917,12 @@ class Camera(property_device.PropertyDevice):
             frame_count: the number of images that will be obtained. If None,
                 the camera is placed into "continuous" acquisition mode. In this
                 case, if the camera is in "Internal" triggering mode, the camera
-                can easily fill its internal RAM with image data faster than the
-                user can retrieve images with next_image(), so care must be taken
-                to limit the frame rate or the amount of time that images are
-                acquired for.
+                can easily produce images faster than the user can retrieve them
+                with next_image(). Images are read from the camera as soon as
+                they are acquired, but no more than a gig or so of them are held
+                for retrieval: beyond that, the oldest are dropped (see
+                get_sequence_stats()). So care must be taken to limit the frame
+                rate or the amount of time that images are acquired for.
             trigger_mode: Must be a valid trigger_mode string ('Internal', 'Software',
                 'External', or 'ExternalExposure'). Most uses will use one of:
                  - 'Internal' triggering, in which the camera acquires images either
@@ -655,14 +953,18 @@ class Camera(property_device.PropertyDevice):
         self.push_state(live_mode=False) # turn off live mode first so that when we push the rest of the state, we don't get state parameters that are valid only for live mode
         self.push_state(cycle_mode=cycle_mode, trigger_mode=trigger_mode, **camera_params)
         lowlevel.Flush()
-        self._buffer_maker = BufferFactory(namebase, frame_count=frame_count, cycle=False)
-        if frame_count is not None:
-            # if we have a known number of images to acquire, create and queue buffers for them now.
-            # however, don't queue up more than a gig or so of images
-            max_queue = int(1024**3 / self.get_image_byte_count())
-            for i in range(min(max_queue, frame_count)):
-                self._buffer_maker.queue_buffer()
+        # Frames are drained from the camera as soon as they are acquired, so only a few buffers need
+        # be queued with it. But don't hold more than a gig or so of frames waiting to be retrieved.
+        max_queued = max(1, int(1024**3 / self.get_image_byte_count()))
+        buffer_maker = BufferFactory(namebase, frame_count=frame_count, cycle=False, queue_depth=self._SEQUENCE_BUFFERS)
+        buffer_maker.queue_all()
         lowlevel.Command('AcquisitionStart')
+        # frames are passed to the frame listeners as they are acquired, numbered as they will be
+        # when retrieved with next_image(), unless the client falls so far behind that frames are dropped
+        first_frame_number = self._frame_number + 1
+        def on_frame(array, timestamp, index):
+            self._notify_frame_listeners(array, timestamp, first_frame_number + index)
+        self._sequence_reader = SequenceReader(buffer_maker, frame_count, max_queued, self._CONVERSION_WORKERS, on_frame)
 
     def next_image_and_metadata(self, read_timeout_ms=None):
         """Retrieve the next image from the image acquisition sequence. Will block
@@ -671,15 +973,14 @@ class Camera(property_device.PropertyDevice):
         or an AndorError of TIMEDOUT will be raised. If the timeout is None,
         then the call will block until an image becomes available.
 
+        Frames are read from the camera in the background as soon as they are
+        acquired, so this just takes the next frame from the server-side queue
+        (see get_sequence_stats()).
+
         Returns the image, timestamp, and frame number.
         """
-        if read_timeout_ms is None:
-            read_timeout_ms = lowlevel.ANDOR_INFINITE
-        else:
-            read_timeout_ms = int(round(read_timeout_ms))
-        self._buffer_maker.queue_if_needed()
-        lowlevel.WaitBuffer(read_timeout_ms)
-        self._update_image_data(*self._buffer_maker.convert_buffer())
+        timeout = None if read_timeout_ms is None else read_timeout_ms / 1000
+        self._update_image_data(*self._sequence_reader.next_frame(timeout))
         return self.latest_image()
 
     def next_image(self, read_timeout_ms=None):
@@ -693,13 +994,36 @@ class Camera(property_device.PropertyDevice):
         """
         return self.next_image_and_metadata(read_timeout_ms)[0] # return just the ism_buffer name
 
+    def get_sequence_stats(self):
+        """Return a dict of statistics for the current image sequence acquisition
+        (or the last one, if none is running), or None if there has been none.
+        Keys are:
+            read: frames read from the camera
+            retrieved: frames retrieved with next_image_and_metadata()
+            queued: frames waiting to be retrieved
+            dropped: frames discarded because too many were waiting
+            late: frames that were already waiting when retrieved, i.e. that
+                the client had fallen behind on
+        and the ConversionPipeline statistics (see get_conversion_stats()).
+        """
+        if self._sequence_reader is None:
+            return self._last_sequence_stats
+        return self._sequence_reader.get_stats()
+
     def end_image_sequence_acquisition(self):
         """Stop an image-acquisition sequence and perform necessary cleanup."""
-        lowlevel.Command('AcquisitionStop')
-        lowlevel.Flush()
-        self.pop_state() # need to pop twice because we pushed twice in start_image_sequence_acquisition() (see above)
-        self.pop_state()
-        del self._buffer_maker
+        reader = self._sequence_reader
+        try:
+            reader.stop()
+            lowlevel.Command('AcquisitionStop')
+            lowlevel.Flush()
+        finally:
+            self.pop_state() # need to pop twice because we pushed twice in start_image_sequence_acquisition() (see above)
+            self.pop_state()
+            self._sequence_reader = None
+        self._last_sequence_stats = stats = reader.get_stats()
+        if stats['dropped']:
+            logger.warning('{} frames of the image sequence were dropped because they were not retrieved in time', stats['dropped'])
 
     @contextlib.contextmanager
     def image_sequence_acquisition(self, frame_count=1, trigger_mode='Internal', **camera_params):
@@ -797,34 +1121,137 @@ class Camera(property_device.PropertyDevice):
                 timestamps.append(timestamp)
         return image_names, timestamps, frame_rate
 
+    def start_stream_to_disk(self, path, frame_count, frame_rate, **camera_params):
+        """Start acquiring a given number of images at the specified frame rate
+        (or as fast as possible, as with stream_acquire()), writing them to
+        disk as they arrive rather than keeping them in memory.
+
+        Only a bounded number of frames are ever in memory at once, so bursts
+        are limited by disk bandwidth and space, not RAM. Progress is reported
+        via the properties stream_frames_written, stream_backlog (frames read
+        from the camera but not yet written) and stream_write_mb_per_sec.
+
+        Files written in the directory path (which will be created if needed):
+            images.npy: a (width, height, frame_count) Fortran-ordered uint16
+                array; use numpy.load(filename, mmap_mode='r') to get at the
+                images without reading the whole file, and [:, :, i] for the
+                i-th image.
+            timestamps.npy: the camera timestamp of each image.
+            metadata.json: written by end_stream_to_disk().
+
+        Parameters:
+            path: directory to write to.
+            frame_count: number of frames to acquire
+            frame_rate: frames per second to acquire at (if possible)
+            All other keyword arguments will be used to set the camera state (e.g.
+            exposure_time, readout_rate, etc.)
+
+        Returns: attempted_frame_rate
+        """
+        if self._disk_stream is not None:
+            raise RuntimeError('A stream to disk is already running.')
+        frame_rate, overlap = self.calculate_streaming_mode(frame_count, frame_rate,
+            trigger_mode='Internal', **camera_params)
+        self.push_state(live_mode=False)
+        self.push_state(cycle_mode='Fixed', trigger_mode='Internal', frame_count=frame_count, frame_rate=frame_rate,
+            overlap_enabled=overlap, **camera_params)
+        try:
+            lowlevel.Flush()
+            buffer_maker = BufferFactory('stream@', frame_count=frame_count, cycle=False, queue_depth=self._STREAM_BUFFERS)
+            metadata = dict(frame_rate=frame_rate, timestamp_hz=self.get_timestamp_hz(),
+                **{p: getattr(self, 'get_'+p)() for p in self._STREAM_METADATA})
+            self._disk_stream = DiskStream(path, buffer_maker, frame_count, self._CONVERSION_WORKERS, metadata,
+                self._update_stream_progress)
+        except:
+            self.pop_state()
+            self.pop_state()
+            raise
+        self._update_stream_progress(0, 0, 0)
+        buffer_maker.queue_all()
+        lowlevel.Command('AcquisitionStart')
+        self._disk_stream_reader = LiveReader(lambda: buffer_maker.queue_free_buffers(timeout=1),
+            self._disk_stream.read_frame, 1/frame_rate, max_images=frame_count)
+        return frame_rate
+
+    def _update_stream_progress(self, frames_written, backlog, mb_per_sec):
+        self._update_property('stream_frames_written', frames_written)
+        self._update_property('stream_backlog', backlog)
+        self._update_property('stream_write_mb_per_sec', round(mb_per_sec, 1))
+
+    def end_stream_to_disk(self, timeout=None):
+        """Wait up to timeout seconds (forever if None) for a stream started by
+        start_stream_to_disk() to finish, then stop it, write its metadata.json
+        file, and return the metadata as a dict, including the frame_count
+        requested and the number of frames_written."""
+        stream = self._disk_stream
+        if stream is None:
+            raise RuntimeError('No stream to disk is running.')
+        try:
+            # the reader stops by itself once all frames have been read (or if the camera fails)
+            self._disk_stream_reader.join(timeout)
+            self._disk_stream_reader.stop()
+            lowlevel.Command('AcquisitionStop')
+            lowlevel.Flush()
+            metadata = stream.close()
+        finally:
+            self._disk_stream = None
+            self._disk_stream_reader = None
+            self.pop_state()
+            self.pop_state()
+        if metadata['frames_written'] < metadata['frame_count']:
+            logger.warning('Only {} of {} frames were streamed to {}', metadata['frames_written'],
+                metadata['frame_count'], stream.path)
+        return metadata
+
+    def stream_to_disk(self, path, frame_count, frame_rate, **camera_params):
+        """Acquire images to disk with start_stream_to_disk(), wait for them
+        all to be written, and return the metadata from end_stream_to_disk()."""
+        self.start_stream_to_disk(path, frame_count, frame_rate, **camera_params)
+        return self.end_stream_to_disk()
+
 
 UINT8_P = ctypes.POINTER(ctypes.c_uint8)
 
 class BufferFactory:
-    def __init__(self, namebase, frame_count=1, cycle=False):
+    def __init__(self, namebase, frame_count=1, cycle=False, queue_depth=None):
+        """Provide buffers to queue with the Andor API, and convert filled
+        buffers into named, shared-memory output images.
+
+        Buffers are allocated once, up front, and recycled: as soon as a buffer
+        has been converted to an output image by convert() or convert_into(),
+        it is returned to the pool, to be re-queued with the camera by the next
+        queue_free_buffers() call, so that steady-state streaming performs no
+        allocation at all.
+
+        Parameters:
+            namebase: base for the output image names.
+            frame_count: number of frames to acquire, or None if unlimited.
+            cycle: if True, buffers may be queued indefinitely (as in live
+                mode); otherwise no more than frame_count will be queued.
+            queue_depth: number of buffers to allocate (and keep queued) at
+                most. If None, allocate frame_count buffers (or one, if
+                frame_count is None).
+        """
         width, height, stride = map(lowlevel.GetInt, ('AOIWidth', 'AOIHeight', 'AOIStride'))
         self.buffer_shape = (width, height)
         input_encoding = lowlevel.GetEnumStringByIndex('PixelEncoding', lowlevel.GetEnumIndex('PixelEncoding'))
-        self.convert_buffer_args = (width, height, stride, input_encoding, 'Mono16')
+        self.conversion_args = (width, height, stride, input_encoding)
         image_bytes = lowlevel.GetInt('ImageSizeBytes')
+        self.conversion_path, self.converter = _choose_converter(image_bytes, *self.conversion_args)
+        pool_size = 1 if frame_count is None else frame_count
+        if queue_depth is not None:
+            pool_size = min(pool_size, queue_depth) if frame_count is not None else queue_depth
+        self.cycle = cycle
+        # number of frames still to be queued; None if unlimited
+        self.frames_to_queue = None if cycle else frame_count
         self.queued_buffers = collections.deque()
-        if cycle:
-            self.buffers = itertools.cycle([numpy.empty(image_bytes, dtype=numpy.uint8) for i in range(frame_count)])
-        else:
-            self.buffers = self._new_buffer_iter(image_bytes, frame_count)
+        self.free_buffers = collections.deque(_aligned_buffer(image_bytes) for i in range(pool_size))
+        self._freed = threading.Condition()
         if frame_count == 1 and not cycle:
             self.names = iter([namebase])
         else:
             self.names = self._name_iter(namebase)
 
-    def _new_buffer_iter(self, image_bytes, frame_count):
-        i = 0
-        while True:
-            i += 1
-            yield numpy.empty(image_bytes, dtype=numpy.uint8)
-            if frame_count is not None and i == frame_count:
-                return
-
     def _name_iter(self, namebase):
         i = 0
         while True:
@@ -832,26 +1259,126 @@ class BufferFactory:
             i += 1
 
     def queue_buffer(self):
-        buffer = next(self.buffers)
+        if self.frames_to_queue == 0:
+            raise RuntimeError('All frames of the acquisition sequence have already been queued.')
+        buffer = self.free_buffers.popleft()
         lowlevel.QueueBuffer(buffer.ctypes.data_as(UINT8_P), len(buffer))
         self.queued_buffers.append(buffer)
+        if self.frames_to_queue is not None:
+            self.frames_to_queue -= 1
 
-    def queue_if_needed(self):
-        if not self.queued_buffers:
+    def queue_all(self):
+        """Queue every free buffer (up to the number of frames remaining)."""
+        while self.free_buffers and self.frames_to_queue != 0:
             self.queue_buffer()
 
-    def convert_buffer(self):
-        name = next(self.names)
-        output_array = transfer_ism_buffer.create_array(name, shape=self.buffer_shape,
-            dtype=numpy.uint16, order='Fortran')
-        buffer = self.queued_buffers.popleft()
-        timestamp = parse_buffer_metadata(buffer, 1) # timestamp is metadata CID 1
-        if timestamp is not None:
-            timestamp = timestamp.view('<u8')[0] # timestamp is 8 bytes of little-endian unsigned int
-        lowlevel.ConvertBuffer(buffer.ctypes.data_as(UINT8_P), output_array.ctypes.data_as(UINT8_P),
-            *self.convert_buffer_args)
+    def queue_free_buffers(self, timeout=None):
+        """Queue every free buffer. If no buffer is queued or free (because all
+        are still being converted in other threads), first wait up to timeout
+        seconds for one to be released."""
+        with self._freed:
+            if not self.queued_buffers:
+                self._freed.wait_for(lambda: self.free_buffers, timeout)
+            self.queue_all()
+
+    def next_filled(self):
+        """Return the name for the next output image and the raw buffer that
+        the camera has just filled (i.e. after a successful WaitBuffer call)."""
+        return next(self.names), self.queued_buffers.popleft()
+
+    def convert(self, name, buffer):
+        """Convert a filled raw buffer to a named, shared-memory output image,
+        and return the raw buffer to the pool of free buffers. This may be
+        called from any thread.
+        Returns name, output_array, timestamp"""
+        try:
+            name, output_array = transfer_ism_buffer.create_pooled_array(name,
+                shape=self.buffer_shape, dtype=numpy.uint16, order='Fortran')
+        except:
+            self._release(buffer)
+            raise
+        timestamp = self.convert_into(buffer, output_array)
         return name, output_array, timestamp
 
+    def convert_into(self, buffer, output_array):
+        """Convert a filled raw buffer into the given Fortran-ordered uint16
+        array of shape buffer_shape, return the raw buffer to the pool of free
+        buffers, and return the frame's timestamp (or None). This may be called
+        from any thread. The raw buffer is returned to the pool even if the
+        conversion fails."""
+        try:
+            timestamp = parse_buffer_metadata(buffer, 1) # timestamp is metadata CID 1
+            if timestamp is not None:
+                timestamp = timestamp.view('<u8')[0] # timestamp is 8 bytes of little-endian unsigned int
+            self.converter(buffer, output_array, *self.conversion_args)
+        finally:
+            self._release(buffer)
+        return timestamp
+
+    def _release(self, buffer):
+        with self._freed:
+            self.free_buffers.append(buffer)
+            self._freed.notify()
+
+def _sdk_convert(buffer, output_array, width, height, stride, encoding):
+    lowlevel.ConvertBuffer(buffer.ctypes.data_as(UINT8_P), output_array.ctypes.data_as(UINT8_P),
+        width, height, stride, encoding, 'Mono16')
+
+def _raw_rows(buffer, height, stride):
+    return buffer[:height*stride].reshape(height, stride)
+
+def _copy_convert(buffer, output_array, width, height, stride, encoding):
+    # Mono12 and Mono16 pixels are already 16-bit: copy the rows straight into the
+    # (width, height) Fortran-ordered output, which is a single memcpy if the rows are unpadded
+    output_array.T[:] = _raw_rows(buffer, height, stride)[:, :2*width].view('<u2')
+
+def _unpack_convert(buffer, output_array, width, height, stride, encoding):
+    packed12.unpack_rows(_raw_rows(buffer, height, stride), width, out=output_array.T)
+
+# ways to convert each encoding to a Mono16 output image: the fastest is chosen by _choose_converter()
+_CONVERTERS = {
+    'Mono12': dict(copy=_copy_convert, sdk=_sdk_convert),
+    'Mono16': dict(copy=_copy_convert, sdk=_sdk_convert),
+    'Mono12Packed': dict(unpack=_unpack_convert, sdk=_sdk_convert),
+}
+_BENCHMARK_REPEATS = 3
+_chosen_converters = {}
+
+def _choose_converter(image_bytes, width, height, stride, encoding):
+    """Return the name of and function for the fastest way to convert images
+    of the given layout and encoding, timing each on first use."""
+    key = width, height, stride, encoding
+    if key not in _chosen_converters:
+        converters = _CONVERTERS.get(encoding, dict(sdk=_sdk_convert))
+        if len(converters) == 1:
+            _chosen_converters[key] = next(iter(converters.items()))
+        else:
+            buffer = _aligned_buffer(image_bytes)
+            buffer[:] = 0
+            output_array = numpy.empty((width, height), dtype=numpy.uint16, order='F')
+            times = {}
+            for name, converter in converters.items():
+                converter(buffer, output_array, width, height, stride, encoding) # warm up
+                t = time.perf_counter()
+                for i in range(_BENCHMARK_REPEATS):
+                    converter(buffer, output_array, width, height, stride, encoding)
+                times[name] = time.perf_counter() - t
+            name = min(times, key=times.get)
+            logger.debug('Converting {} {}x{} images with {} path ({})', encoding, width, height, name,
+                ', '.join('{}: {:.1f} ms'.format(n, 1000 * t / _BENCHMARK_REPEATS) for n, t in times.items()))
+            _chosen_converters[key] = name, converters[name]
+    return _chosen_converters[key]
+
+def _aligned_buffer(nbytes, alignment=64):
+    """Return a uint8 array of nbytes, aligned in memory to the given number of
+    bytes (the Andor API requires at least 8-byte alignment), with its pages
+    already faulted in so that the first acquisition into it is not slowed."""
+    raw = numpy.empty(nbytes + alignment, dtype=numpy.uint8)
+    offset = -raw.ctypes.data % alignment
+    buffer = raw[offset:offset+nbytes]
+    buffer[::4096] = 0
+    return buffer
+
 def parse_buffer_metadata(buffer, desired_id):
     offset = len(buffer)
     while offset > 0:
@@ -867,6 +1394,172 @@ def parse_buffer_metadata(buffer, desired_id):
         offset = chunk_start
     return None
 
+class ConversionPipeline:
+    def __init__(self, convert, deliver, workers=2):
+        """Run convert() on a small pool of worker threads, and pass each result
+        to deliver() from a single delivery thread, in the order the work was
+        submitted. This keeps slow frame conversion out of the thread that must
+        keep the camera's buffer queue serviced.
+
+        Parameters:
+            convert: function to call (in a worker thread) with the arguments
+                given to submit(). Must be thread-safe.
+            deliver: function to call (in the delivery thread) with the
+                elements of convert()'s return value.
+            workers: number of worker threads.
+        """
+        self.convert = convert
+        self.deliver = deliver
+        self._executor = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix='CameraConvert')
+        self._pending = queue.Queue() # (future, submit time) pairs, in submission order
+        self._counts_lock = threading.Lock()
+        self._counts = collections.Counter()
+        # recent per-frame times for each stage, in seconds
+        self._timings = {stage: collections.deque(maxlen=50) for stage in ('convert', 'deliver', 'latency')}
+        self._delivery_thread = threading.Thread(target=self._deliver_loop, name='CameraDeliver', daemon=True)
+        self._delivery_thread.start()
+        # as for LiveModeThread, make sure frames stop being delivered before ISM_Buffers are torn down at exit
+        atexit.register(self.stop)
+
+    def submit(self, *args):
+        """Queue convert(*args) to be run, and its result delivered."""
+        with self._counts_lock:
+            self._counts['submitted'] += 1
+        future = self._executor.submit(self._convert, args)
+        self._pending.put((future, time.perf_counter()))
+
+    def _convert(self, args):
+        t = time.perf_counter()
+        try:
+            return self.convert(*args)
+        finally:
+            self._timings['convert'].append(time.perf_counter() - t)
+            with self._counts_lock:
+                self._counts['converted'] += 1
+
+    def _deliver_loop(self):
+        while True:
+            item = self._pending.get()
+            if item is None:
+                return
+            future, submitted = item
+            try:
+                result = future.result()
+                t = time.perf_counter()
+                self.deliver(*result)
+                self._timings['deliver'].append(time.perf_counter() - t)
+                self._timings['latency'].append(time.perf_counter() - submitted)
+            except:
+                logger.log_exception('Could not convert or deliver camera frame:')
+                key = 'failed'
+            else:
+                key = 'delivered'
+            with self._counts_lock:
+                self._counts[key] += 1
+
+    def get_stats(self):
+        """Return a dict with the number of frames waiting for or undergoing
+        conversion ('converting'), converted but not yet delivered
+        ('awaiting_delivery'), delivered and failed; and the mean recent time
+        in ms for conversion, delivery, and the whole pipeline ('latency_ms')."""
+        with self._counts_lock:
+            counts = dict(self._counts)
+        submitted, converted, finished = [counts.get(key, 0) for key in ('submitted', 'converted', 'delivered')]
+        finished += counts.get('failed', 0)
+        stats = dict(converting=submitted - converted, awaiting_delivery=converted - finished,
+            delivered=counts.get('delivered', 0), failed=counts.get('failed', 0))
+        for stage, times in self._timings.items():
+            times = list(times)
+            stats[stage + '_ms'] = 1000 * numpy.mean(times) if times else None
+        return stats
+
+    def stop(self):
+        """Finish converting and delivering all submitted frames, then stop."""
+        atexit.unregister(self.stop)
+        self._pending.put(None)
+        self._delivery_thread.join()
+        self._executor.shutdown()
+
+class DiskStream:
+    _PROGRESS_INTERVAL = 0.25 # seconds
+
+    def __init__(self, path, buffer_maker, frame_count, workers, metadata, update_progress):
+        """Write frames from the camera into preallocated, memory-mapped files
+        in the directory path (see Camera.start_stream_to_disk()), converting
+        each raw buffer straight into its place in the file.
+
+        metadata is a dict to be saved, along with the number of frames
+        written, to metadata.json when the stream is closed.
+
+        update_progress(frames_written, backlog, mb_per_sec) is called from
+        the delivery thread as frames are written, at most a few times per
+        second, and once more when the stream is closed."""
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.buffer_maker = buffer_maker
+        self.frame_count = frame_count
+        self.metadata = metadata
+        self.update_progress = update_progress
+        width, height = buffer_maker.buffer_shape
+        self.images = _open_preallocated_memmap(os.path.join(path, 'images.npy'), numpy.uint16,
+            (width, height, frame_count), fortran_order=True)
+        self.timestamps = _open_preallocated_memmap(os.path.join(path, 'timestamps.npy'), numpy.uint64, (frame_count,))
+        self.frame_bytes = width * height * 2
+        self.frames_read = 0
+        self.frames_written = 0
+        self._last_progress = (time.time(), 0) # time, frames_written
+        self.mb_per_sec = 0
+        self.pipeline = ConversionPipeline(self._write_frame, self._frame_written, workers)
+
+    def read_frame(self):
+        """Hand the buffer the camera has just filled off to be written. Called
+        from the reader thread."""
+        name, buffer = self.buffer_maker.next_filled()
+        self.pipeline.submit(self.frames_read, buffer)
+        self.frames_read += 1
+
+    def _write_frame(self, index, buffer):
+        timestamp = self.buffer_maker.convert_into(buffer, self.images[:, :, index])
+        self.timestamps[index] = 0 if timestamp is None else timestamp
+        return ()
+
+    def _frame_written(self):
+        self.frames_written += 1
+        now = time.time()
+        last_time, last_written = self._last_progress
+        if now - last_time > self._PROGRESS_INTERVAL:
+            self.mb_per_sec = (self.frames_written - last_written) * self.frame_bytes / 1e6 / (now - last_time)
+            self._last_progress = now, self.frames_written
+            self.update_progress(self.frames_written, self.get_backlog(), self.mb_per_sec)
+
+    def get_backlog(self):
+        """Return the number of frames read from the camera but not yet written."""
+        return self.frames_read - self.frames_written
+
+    def close(self):
+        """Finish writing the frames read so far, flush the files to disk, and
+        save the metadata to metadata.json. Returns the metadata, with the
+        frame_count requested and number of frames_written added."""
+        self.pipeline.stop()
+        self.update_progress(self.frames_written, self.get_backlog(), self.mb_per_sec)
+        self.images.flush()
+        self.timestamps.flush()
+        del self.images, self.timestamps
+        metadata = dict(self.metadata, frame_count=self.frame_count, frames_written=self.frames_written)
+        with open(os.path.join(self.path, 'metadata.json'), 'w') as f:
+            json.dump(metadata, f, indent=4, sort_keys=True)
+        return metadata
+
+def _open_preallocated_memmap(filename, dtype, shape, fortran_order=False):
+    """Create a .npy file and return it as a writable memmap, making sure first
+    that the disk space for it is actually allocated, so that a long stream
+    cannot run out of space midway."""
+    array = numpy.lib.format.open_memmap(filename, mode='w+', dtype=dtype, shape=shape, fortran_order=fortran_order)
+    if hasattr(os, 'posix_fallocate'):
+        with open(filename, 'r+b') as f:
+            os.posix_fallocate(f.fileno(), 0, os.path.getsize(filename))
+    return array
+
 class LiveModeThread(threading.Thread):
     """Superclass for the threads that are used to run live camera acquisition,
     providing a basic API whereby the threads can be stopped manually, or if
@@ -906,40 +1599,127 @@ class LiveModeThread(threading.Thread):
         raise NotImplementedError()
 
 class LiveTrigger(LiveModeThread):
-    def __init__(self, trigger_interval, live_reader):
+    _STATS_FRAMES = 50 # number of recent triggers and frames to calculate statistics from
+
+    def __init__(self, trigger_interval, live_reader, min_backlog=2, max_backlog=10):
+        """Send software triggers on a fixed schedule of absolute deadlines,
+        trigger_interval seconds apart, so that scheduling delays in sending
+        one trigger do not push back all later ones.
+
+        The number of triggers allowed to be outstanding (i.e. sent, but without
+        a frame yet read by live_reader) is kept to a target backlog: enough to
+        cover the shortest recent time from trigger to frame read (the time
+        the camera takes to expose, read out and transfer a frame), plus one,
+        within [min_backlog, max_backlog]. If the camera cannot keep up, the
+        next trigger is instead sent as soon as the reader reports a frame
+        read, and the schedule restarts from there."""
         self.trigger_interval = trigger_interval
+        self.min_backlog = min_backlog
+        self.max_backlog = max_backlog
+        self.target_backlog = min_backlog
         self.trigger_count = 0 # number of triggers
+        self.lost_triggers = 0 # triggers that never produced a frame (e.g. ignored by a busy camera)
         self.live_reader = live_reader
+        self.trigger_times = collections.deque(maxlen=self._STATS_FRAMES) # (trigger number, time) pairs
+        self.lateness = collections.deque(maxlen=self._STATS_FRAMES) # seconds each scheduled trigger was late
+        self.backlog_waits = 0 # number of triggers held back to keep the backlog down
+        self._deadline = time.monotonic()
         super().__init__() # do this last b/c superclass auto-starts the thread on init
 
+    def set_trigger_interval(self, trigger_interval):
+        """Change the interval at which triggers are scheduled."""
+        self.trigger_interval = trigger_interval
+        self.trigger_times.clear()
+        self.lateness.clear()
+
+    def _outstanding(self):
+        return self.trigger_count - self.lost_triggers - self.live_reader.image_count
+
     def loop(self):
-        """Sleep the prescribed sleep time and then send a software trigger.
-        If the triggering gets too far ahead of image reading, stop sending
-        triggers until the situation improves."""
-        time.sleep(self.trigger_interval)
-        if self.trigger_count - self.live_reader.image_count > 10:
-            while self.trigger_count - self.live_reader.image_count > 1:
-                # make sure that we break out of the loop if the thread is
-                # asked to stop while we're waiting here:
-                if not self.running:
-                    return
-                time.sleep(self.trigger_interval)
+        """Wait for the next deadline and send a software trigger, unless
+        too many triggers are outstanding, in which case wait for a frame to
+        be read first."""
+        deadline = self._deadline
+        while self.running:
+            wait = deadline - time.monotonic()
+            if wait <= 0:
+                break
+            time.sleep(min(wait, 0.1)) # wake up periodically to see if the thread should stop
+        held = False
+        wait_start = time.monotonic()
+        latencies = self._recent_latencies()
+        if latencies:
+            backlog = math.ceil(min(latencies) / self.trigger_interval) + 1
+            self.target_backlog = min(max(backlog, self.min_backlog), self.max_backlog)
+        while self._outstanding() >= self.target_backlog:
+            if not self.running:
+                return
+            held = True
+            if not self.live_reader.wait_for_frame(self.live_reader.image_count, timeout=0.1):
+                if time.monotonic() - wait_start > 4 * self.trigger_interval + 0.25:
+                    # no frame in far longer than it could take: assume the outstanding triggers were lost
+                    self.lost_triggers += self._outstanding()
+        if not self.running:
+            return
         lowlevel.Command('SoftwareTrigger')
+        now = time.monotonic()
         self.trigger_count += 1
+        self.trigger_times.append((self.trigger_count, now))
+        if held:
+            # the camera set the pace: schedule the next trigger from now
+            self.backlog_waits += 1
+            self._deadline = now + self.trigger_interval
+        else:
+            self.lateness.append(now - deadline)
+            self._deadline = deadline + self.trigger_interval
+            if self._deadline < now:
+                # more than a whole interval late: skip ahead, rather than sending a burst of triggers
+                self._deadline = now + self.trigger_interval
+
+    def _recent_latencies(self):
+        """Return a list of recent times from trigger to frame read."""
+        read_times = dict(self.live_reader.read_times)
+        # frames arrive in the order triggered, so (allowing for lost triggers) frame n is from trigger n
+        return [read_times[n - self.lost_triggers] - t for n, t in list(self.trigger_times)
+            if n - self.lost_triggers in read_times]
+
+    def get_stats(self):
+        """Return a dict of recent trigger timing statistics (see
+        Camera.get_live_timing_stats())."""
+        frame_times = [t for n, t in list(self.live_reader.read_times)]
+        stats = dict(triggers=self.trigger_count, frames=self.live_reader.image_count,
+            outstanding=self._outstanding(), target_backlog=self.target_backlog, lost_triggers=self.lost_triggers,
+            backlog_waits=self.backlog_waits, target_fps=1/self.trigger_interval, fps=None, frame_interval_ms=None,
+            frame_jitter_ms=None, latency_ms=None, latency_max_ms=None, lateness_ms=None, lateness_max_ms=None)
+        if len(frame_times) > 1:
+            intervals = numpy.diff(frame_times)
+            stats.update(fps=1/intervals.mean(), frame_interval_ms=1000*intervals.mean(),
+                frame_jitter_ms=1000*intervals.std())
+        latencies = self._recent_latencies()
+        if latencies:
+            stats.update(latency_ms=1000*numpy.mean(latencies), latency_max_ms=1000*max(latencies))
+        lateness = list(self.lateness)
+        if lateness:
+            stats.update(lateness_ms=1000*numpy.mean(lateness), lateness_max_ms=1000*max(lateness))
+        return stats
 
 
 class LiveReader(LiveModeThread):
-    def __init__(self, queue_buffer, update, trigger_interval):
+    def __init__(self, queue_buffer, update, trigger_interval, max_images=None):
         """Repeatedly queue a buffer with the given queue_buffer() function,
         wait for it to be filled via the Andor API, then call
         update() which (presumably) will deal with the buffer
         contents. The argument image_count is the index of the frame retrieved
-        since the start of this round of live imaging.
+        since the start of this round of live imaging. If max_images is not
+        None, the thread stops by itself after retrieving that many images.
         NB: update() is called in this background thread, so any operations
         therein must be thread-safe."""
         self.queue_buffer = queue_buffer
         self.update = update
+        self.max_images = max_images
         self.latest_intervals = collections.deque(maxlen=10) # cyclic buffer containing intervals between recent image reads (for FPS calculations)
+        self.read_times = collections.deque(maxlen=LiveTrigger._STATS_FRAMES) # (frame number, time.monotonic()) as each frame is read
+        self.frame_read = threading.Condition()
         self.image_count = 0 # number of frames retrieved
         self.ready = threading.Event()
         self.set_timeout(trigger_interval)
@@ -959,6 +1739,7 @@ class LiveReader(LiveModeThread):
             # the trigger thread -- otherwise the reader would just block forever waiting
             # for a trigger to come. So set a reasonably-long timeout.
             lowlevel.WaitBuffer(self.timeout)
+            read_time = time.monotonic()
             self.timeout_count = 0
         except lowlevel.AndorError as e:
             # one danger: if WaitBuffer starts timing out because of some error state other than
@@ -975,6 +1756,105 @@ class LiveReader(LiveModeThread):
             else:
                 raise
         self.update()
-        self.image_count += 1
+        with self.frame_read:
+            self.image_count += 1
+            self.read_times.append((self.image_count, read_time))
+            self.frame_read.notify_all()
         self.latest_intervals.append(time.time() - t)
+        if self.image_count == self.max_images:
+            self.running = False
+
+    def wait_for_frame(self, image_count, timeout=None):
+        """Wait until more than image_count frames have been retrieved, and
+        return whether that happened before the timeout."""
+        with self.frame_read:
+            return self.frame_read.wait_for(lambda: self.image_count > image_count, timeout)
+
 
+class SequenceReader(LiveModeThread):
+    _POLL_MS = 100 # how long to wait for each frame before checking whether to stop
+
+    def __init__(self, buffer_maker, frame_count, max_queued, workers, on_frame=None):
+        """Drain the frames of an image sequence from the camera as soon as they
+        are acquired, converting them with a ConversionPipeline into a queue
+        for next_frame() to take them from. This way, the camera never waits
+        on a slow client.
+
+        Parameters:
+            buffer_maker: BufferFactory whose buffers are queued for the sequence.
+            frame_count: number of frames in the sequence, or None if unlimited.
+            max_queued: maximum number of frames to hold for the client; if
+                more arrive, the oldest are dropped (and counted).
+            workers: number of frame-conversion threads.
+            on_frame: if not None, function to call with (array, timestamp,
+                index) for each frame as soon as it has been converted, where
+                index counts the frames of the sequence from zero.
+        """
+        self.buffer_maker = buffer_maker
+        self.on_frame = on_frame
+        self.converted = 0
+        self.frame_count = frame_count
+        self.frames = collections.deque()
+        self.max_queued = max_queued
+        self.frames_changed = threading.Condition()
+        self.read = 0
+        self.retrieved = 0
+        self.dropped = 0
+        self.late = 0
+        self.error = None
+        self.pipeline = ConversionPipeline(buffer_maker.convert, self._enqueue, workers)
+        super().__init__()
+
+    def loop(self):
+        self.buffer_maker.queue_free_buffers(timeout=self._POLL_MS / 1000)
+        try:
+            lowlevel.WaitBuffer(self._POLL_MS)
+        except lowlevel.AndorError as e:
+            if e.args[0].startswith('TIMEDOUT'):
+                return
+            # pass the error on to the client, once it has retrieved all the frames read so far
+            with self.frames_changed:
+                self.error = e
+                self.frames_changed.notify_all()
+            self.running = False
+            return
+        self.pipeline.submit(*self.buffer_maker.next_filled())
+        self.read += 1
+        if self.read == self.frame_count:
+            self.running = False
+
+    def _enqueue(self, name, array, timestamp):
+        with self.frames_changed:
+            if len(self.frames) == self.max_queued:
+                self.frames.popleft()
+                self.dropped += 1
+            self.frames.append((name, array, timestamp))
+            self.frames_changed.notify_all()
+        index = self.converted
+        self.converted += 1
+        if self.on_frame is not None:
+            self.on_frame(array, timestamp, index)
+
+    def next_frame(self, timeout=None):
+        """Return the next frame as (name, array, timestamp), waiting up to
+        timeout seconds (or forever, if None) for it to arrive."""
+        with self.frames_changed:
+            if self.frames:
+                self.late += 1
+            elif not self.frames_changed.wait_for(lambda: self.frames or self.error is not None, timeout):
+                raise lowlevel.AndorError('TIMEDOUT: no image received in {} ms'.format(round(timeout * 1000)))
+            if not self.frames:
+                raise self.error
+            self.retrieved += 1
+            return self.frames.popleft()
+
+    def get_stats(self):
+        stats = self.pipeline.get_stats()
+        with self.frames_changed:
+            stats.update(read=self.read, retrieved=self.retrieved, queued=len(self.frames),
+                dropped=self.dropped, late=self.late)
+        return stats
+
+    def stop(self):
+        super().stop()
+        self.pipeline.stop()
@@ -0,0 +1,174 @@
+# This code is licensed under the MIT License (see LICENSE file for details)
+
+"""Cache Andor feature values, to avoid repeated calls into the SDK.
+
+FeatureCache wraps a lowlevel module (lowlevel or simulated_lowlevel) and
+provides all of its functions. The value getters (GetInt, GetFloat, GetBool,
+GetEnumIndex, GetString, and the Min/Max range getters) are cached: the first
+read of a feature goes to the SDK, and later reads return the cached value
+until it is invalidated. Values are invalidated:
+    - when the SDK reports, via a feature callback, that the feature changed;
+    - when the feature is written via this module, along with any features
+      that writing it is known to affect (see _WRITE_INVALIDATES); writes to
+      features not listed there invalidate the whole cache.
+Features that change on their own without reliable callbacks (e.g. the
+sensor temperature and timestamp clock) are never cached.
+"""
+
+import threading
+
+# Features never to cache.
+_UNCACHED = {'CameraAcquiring', 'SensorTemperature', 'TemperatureStatus', 'TimestampClock'}
+
+_AOI_DEPENDENTS = {'AOIHeight', 'AOILeft', 'AOIStride', 'AOITop', 'AOIWidth', 'ExposureTime', 'FrameRate',
+    'ImageSizeBytes', 'MaxInterfaceTransferRate', 'ReadoutTime'}
+_TIMING_DEPENDENTS = {'ExposureTime', 'FrameRate', 'MaxInterfaceTransferRate', 'Overlap', 'ReadoutTime'}
+_ENCODING_DEPENDENTS = {'AOIStride', 'BitDepth', 'ImageSizeBytes', 'MaxInterfaceTransferRate', 'PixelEncoding'}
+
+# Features whose values or ranges may change when the given feature is written
+# (or command is run), beyond the feature itself.
+_WRITE_INVALIDATES = {
+    'AccumulateCount': set(),
+    'AcquisitionStart': set(),
+    'AcquisitionStop': set(),
+    'AOIBinning': _AOI_DEPENDENTS | {'AOIHBin', 'AOIVBin'},
+    'AOIHeight': _AOI_DEPENDENTS,
+    'AOILeft': _AOI_DEPENDENTS,
+    'AOITop': _AOI_DEPENDENTS,
+    'AOIWidth': _AOI_DEPENDENTS,
+    'AuxiliaryOutSource': set(),
+    'CycleMode': {'FrameCount'},
+    'ElectronicShutteringMode': _TIMING_DEPENDENTS,
+    'ExposureTime': _TIMING_DEPENDENTS,
+    'FanSpeed': set(),
+    'FrameCount': set(),
+    'FrameRate': _TIMING_DEPENDENTS,
+    'IOInvert': set(),
+    'IOSelector': {'IOInvert'},
+    'MetadataEnable': {'ImageSizeBytes', 'MaxInterfaceTransferRate'},
+    'MetadataFrame': {'ImageSizeBytes', 'MaxInterfaceTransferRate'},
+    'MetadataTimestamp': {'ImageSizeBytes', 'MaxInterfaceTransferRate'},
+    'Overlap': _TIMING_DEPENDENTS,
+    'PixelEncoding': _ENCODING_DEPENDENTS,
+    'PixelReadoutRate': _TIMING_DEPENDENTS,
+    'SensorCooling': set(),
+    'SimplePreAmpGainControl': _ENCODING_DEPENDENTS,
+    'SoftwareTrigger': set(),
+    'SpuriousNoiseFilter': set(),
+    'StaticBlemishCorrection': set(),
+    'TimestampClockReset': set(),
+    'TriggerMode': _TIMING_DEPENDENTS,
+}
+
+_GETTERS = ('GetInt', 'GetIntMin', 'GetIntMax', 'GetFloat', 'GetFloatMin', 'GetFloatMax', 'GetBool',
+    'GetEnumIndex', 'GetString')
+_SETTERS = ('SetInt', 'SetFloat', 'SetBool', 'SetEnumIndex', 'SetEnumString', 'SetString', 'Command')
+
+class FeatureCache:
+    def __init__(self, lowlevel):
+        self._lowlevel = lowlevel
+        # provide everything else in the lowlevel module unchanged
+        for name in dir(lowlevel):
+            if not name.startswith('_') and not hasattr(self, name):
+                setattr(self, name, getattr(lowlevel, name))
+        for name in _GETTERS:
+            setattr(self, name, self._make_getter(name))
+        for name in _SETTERS:
+            setattr(self, name, self._make_setter(name))
+        self._lock = threading.Lock()
+        self._values = {} # maps (getter name, feature) to value
+        # per-feature count of invalidations, so that a value read from the SDK
+        # is not cached if the feature was invalidated during the read
+        self._generations = {}
+        self._epoch = 0 # likewise, for invalidation of the whole cache
+        self._watched = set() # features with a callback registered
+        self._unwatchable = set() # features for which callback registration failed
+        self._c_callback = lowlevel.FeatureCallback(self._callback)
+        self._stats = dict(hits=0, misses=0, callback_invalidations=0, write_invalidations=0)
+
+    def _make_getter(self, name):
+        sdk_getter = getattr(self._lowlevel, name)
+        def getter(feature):
+            return self._get(name, sdk_getter, feature)
+        getter.__name__ = name
+        getter.__doc__ = sdk_getter.__doc__
+        return getter
+
+    def _make_setter(self, name):
+        sdk_setter = getattr(self._lowlevel, name)
+        def setter(feature, *args):
+            try:
+                return sdk_setter(feature, *args)
+            finally:
+                self._invalidate_for_write(feature)
+        setter.__name__ = name
+        setter.__doc__ = sdk_setter.__doc__
+        return setter
+
+    def _get(self, name, sdk_getter, feature):
+        key = name, feature
+        with self._lock:
+            if key in self._values:
+                self._stats['hits'] += 1
+                return self._values[key]
+            self._stats['misses'] += 1
+            cacheable = feature not in _UNCACHED and feature not in self._unwatchable
+            need_watch = cacheable and feature not in self._watched
+        if need_watch:
+            # register first: registration itself triggers a callback, which would invalidate the value
+            cacheable = self._watch(feature)
+        generation = self._epoch, self._generations.get(feature, 0)
+        value = sdk_getter(feature)
+        if cacheable:
+            with self._lock:
+                if (self._epoch, self._generations.get(feature, 0)) == generation:
+                    self._values[key] = value
+        return value
+
+    def _watch(self, feature):
+        try:
+            self._lowlevel.RegisterFeatureCallback(feature, self._c_callback, 0)
+        except self._lowlevel.AndorError:
+            with self._lock:
+                self._unwatchable.add(feature)
+            return False
+        with self._lock:
+            self._watched.add(feature)
+        return True
+
+    def _callback(self, camera_handle, feature, context):
+        self.invalidate(feature)
+        return self._lowlevel.AT_CALLBACK_SUCCESS
+
+    def invalidate(self, feature, _stat='callback_invalidations'):
+        """Drop any cached values for the given feature."""
+        with self._lock:
+            self._generations[feature] = self._generations.get(feature, 0) + 1
+            for name in _GETTERS:
+                self._values.pop((name, feature), None)
+            self._stats[_stat] += 1
+
+    def _invalidate_for_write(self, feature):
+        affected = _WRITE_INVALIDATES.get(feature)
+        if affected is None:
+            self.invalidate_all()
+        else:
+            for affected_feature in {feature} | affected:
+                self.invalidate(affected_feature, 'write_invalidations')
+
+    def invalidate_all(self):
+        """Drop all cached values."""
+        with self._lock:
+            self._epoch += 1
+            self._values.clear()
+            self._stats['write_invalidations'] += 1
+
+    def get_cache_stats(self):
+        """Return a dict of cache statistics: hits (SDK calls avoided), misses
+        (reads that went to the SDK), hit_rate, callback_invalidations,
+        write_invalidations, and cached_values (number currently cached)."""
+        with self._lock:
+            stats = dict(self._stats, cached_values=len(self._values))
+        reads = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / reads if reads else None
+        return stats
@@ -0,0 +1,780 @@
+# This code is licensed under the MIT License (see LICENSE file for details)
+
+"""Simulated stand-in for lowlevel, emulating an Andor Zyla camera without the
+Andor SDK3 libraries or any hardware, so that the camera code (and everything
+built on it) can be run, profiled and load-tested on any machine.
+
+Set SIMULATED = True in the camera section of the scope configuration to use
+this module in place of lowlevel. It provides the same functions, with the
+same semantics and AndorError messages, including:
+  - Int, Float, Bool, Enum and String features, with ranges, enum index
+    availability, read-only features, and features that may not be written
+    while acquiring.
+  - Derived features that track the camera settings: ReadoutTime, frame-rate
+    ranges, ImageSizeBytes, AOIStride, BitDepth, MaxInterfaceTransferRate, etc.
+  - Feature callbacks, called on registration and whenever a feature's value
+    changes (including derived features).
+  - Internal and Software triggering, in Fixed or Continuous cycle mode, with
+    frames completing after the exposure and readout times, software triggers
+    ignored when faster than the maximum frame rate, delivery to queued
+    buffers limited by the interface transfer rate, and a HARDWARE_OVERFLOW
+    error when more frames complete than the camera RAM can hold.
+  - Buffers filled with synthetic images in the Mono12, Mono12Packed, Mono16
+    or Mono32 encoding, with row padding, followed by timestamp and frame-info
+    metadata chunks; and ConvertBuffer() to decode them.
+
+Use configure() to change the simulated interface bandwidth, camera RAM size,
+or the source of the synthetic images, and get_stats() to see how many frames
+have been delivered, triggers ignored, and overflows hit.
+"""
+
+import collections
+import ctypes
+import threading
+import time
+
+import numpy
+
+from .common import *
+from .lowlevel import FeatureStrings
+from ...util import packed12
+
+_SENSOR_WIDTH = 2560
+_SENSOR_HEIGHT = 2160
+_TIMESTAMP_HZ = 100000000
+
+_BINNINGS = ['1x1', '2x2', '3x3', '4x4', '8x8']
+_GAINS = ['12-bit (high well capacity)', '12-bit (low noise)', '16-bit (low noise & high well capacity)']
+_ENCODINGS = ['Mono12', 'Mono12Packed', 'Mono16', 'Mono32']
+_READOUT_RATES = ['100 MHz', '280 MHz']
+
+_ENUMS = dict(
+    AOIBinning=_BINNINGS,
+    AuxiliaryOutSource=['FireRow1', 'FireRowN', 'FireAll', 'FireAny'],
+    BitDepth=['12 Bit', '16 Bit'],
+    CycleMode=['Fixed', 'Continuous'],
+    ElectronicShutteringMode=['Rolling', 'Global'],
+    FanSpeed=['Off', 'On'],
+    IOSelector=['Fire 1', 'Fire N', 'Aux Out 1', 'Arm', 'External Trigger'],
+    PixelEncoding=_ENCODINGS,
+    PixelReadoutRate=_READOUT_RATES,
+    SimplePreAmpGainControl=_GAINS,
+    TemperatureStatus=['Cooler Off', 'Stabilised', 'Cooling', 'Drift', 'Not Stabilised', 'Fault'],
+    TriggerMode=['Internal', 'External Start', 'External Exposure', 'Software', 'External']
+)
+
+_INTS = dict(AccumulateCount=1, AOIHeight=_SENSOR_HEIGHT, AOILeft=1, AOITop=1, AOIWidth=_SENSOR_WIDTH, FrameCount=1)
+_FLOATS = dict(ExposureTime=0.01, FrameRate=10.0)
+_BOOLS = dict(FullAOIControl=True, IOInvert=False, MetadataEnable=False, MetadataFrame=True, MetadataTimestamp=False,
+    Overlap=False, SensorCooling=False, SpuriousNoiseFilter=True, StaticBlemishCorrection=True, VerticallyCenterAOI=False)
+_STRINGS = dict(CameraModel=None, CameraName='Andor Zyla (simulated)', FirmwareVersion='0.0.0', InterfaceType='USB3',
+    SerialNumber='SIM-00000', SoftwareVersion='0.0.0')
+_DERIVED_INTS = {'AOIStride', 'ImageSizeBytes', 'SensorHeight', 'SensorWidth', 'TimestampClock', 'TimestampClockFrequency'}
+_DERIVED_FLOATS = {'MaxInterfaceTransferRate', 'ReadoutTime', 'SensorTemperature'}
+_DERIVED_BOOLS = {'CameraAcquiring'}
+_READONLY_ENUMS = {'BitDepth', 'TemperatureStatus'}
+# features whose values change continuously, which (as with the real camera) don't trigger callbacks
+_VOLATILE = {'SensorTemperature', 'TimestampClock'}
+_COMMANDS = {'AcquisitionStart', 'AcquisitionStop', 'SoftwareTrigger', 'TimestampClockReset'}
+# features that the camera allows to be changed during an acquisition
+_WRITABLE_WHILE_ACQUIRING = {'ExposureTime', 'FrameRate', 'AuxiliaryOutSource', 'IOSelector', 'IOInvert'}
+
+_BYTES_PER_PIXEL = {'Mono12': 2, 'Mono16': 2, 'Mono32': 4}
+# metadata chunk ids
+_CID_FRAME = 0
+_CID_TICKS = 1
+_CID_FRAME_INFO = 7
+
+class _Frame:
+    def __init__(self, start, ready):
+        self.start = start # exposure start time
+        self.ready = ready # readout completion time
+
+class _SimulatedCamera:
+    def __init__(self, model):
+        self.lock = threading.RLock()
+        self.changed = threading.Condition(self.lock)
+        self.ints = dict(_INTS)
+        self.floats = dict(_FLOATS)
+        self.bools = dict(_BOOLS)
+        self.strings = dict(_STRINGS, CameraModel=model)
+        self.enums = dict(AOIBinning=0, AuxiliaryOutSource=2, CycleMode=0, ElectronicShutteringMode=0, FanSpeed=1,
+            IOSelector=0, PixelEncoding=2, PixelReadoutRate=0, SimplePreAmpGainControl=2, TriggerMode=0)
+        self.io_inverted = {}
+        self.callbacks = collections.defaultdict(list)
+        self.clock_zero = time.monotonic()
+        self.cooling_start = None
+        self.acquiring = False
+        self.queued = collections.deque() # (address, size) of queued buffers
+        self.frames = collections.deque() # frames started but not yet delivered
+        self.overflowed = False
+        self.frames_started = 0
+        self.next_start = None
+        self.last_trigger = None
+        self.interface_free = 0
+        self.templates = None
+        self.stats = collections.Counter()
+
+    # FEATURE VALUES
+    def binning(self):
+        return int(_BINNINGS[self.enums['AOIBinning']][0])
+
+    def encoding(self):
+        return _ENCODINGS[self.enums['PixelEncoding']]
+
+    def row_bytes(self):
+        width = self.ints['AOIWidth']
+        encoding = self.encoding()
+        if encoding == 'Mono12Packed':
+            row = packed12.packed_size(width)
+        else:
+            row = width * _BYTES_PER_PIXEL[encoding]
+        alignment = _config['stride_alignment']
+        return -(-row // alignment) * alignment
+
+    def metadata_bytes(self):
+        if not self.bools['MetadataEnable']:
+            return 0
+        size = 8 # frame chunk trailer
+        if self.bools['MetadataTimestamp']:
+            size += 16
+        if self.bools['MetadataFrame']:
+            size += 16
+        return size
+
+    def image_bytes(self):
+        return self.row_bytes() * self.ints['AOIHeight'] + self.metadata_bytes()
+
+    def readout_time(self):
+        # the sensor is read out from the middle outward, so the readout time depends on
+        # the number of rows above or below the midline, whichever is larger
+        binning = self.binning()
+        top = (self.ints['AOITop'] - 1) * binning
+        bottom = top + self.ints['AOIHeight'] * binning
+        middle = _SENSOR_HEIGHT // 2
+        if bottom <= middle or top >= middle:
+            lines = bottom - top
+        else:
+            lines = max(middle - top, bottom - middle)
+        rate = int(_READOUT_RATES[self.enums['PixelReadoutRate']].split()[0]) * 1e6
+        readout = lines * _SENSOR_WIDTH / rate
+        if self.shutter() == 'Global':
+            readout *= 2
+        return readout
+
+    def shutter(self):
+        return _ENUMS['ElectronicShutteringMode'][self.enums['ElectronicShutteringMode']]
+
+    def trigger_mode(self):
+        return _ENUMS['TriggerMode'][self.enums['TriggerMode']]
+
+    def overlap(self):
+        if self.shutter() == 'Rolling' and self.trigger_mode() == 'Software':
+            return False
+        return self.bools['Overlap']
+
+    def frame_rate_range(self):
+        exposure = self.floats['ExposureTime']
+        readout = self.readout_time()
+        if self.overlap():
+            return 1 / (exposure + readout), 1 / max(exposure, readout)
+        return 0.00005, 1 / (exposure + readout)
+
+    def frame_rate(self):
+        low, high = self.frame_rate_range()
+        return min(max(self.floats['FrameRate'], low), high)
+
+    def sensor_temperature(self):
+        if self.cooling_start is None:
+            return 20.0
+        return 20 * numpy.exp(-(time.monotonic() - self.cooling_start) / 60)
+
+    def get(self, feature):
+        if feature in self.ints:
+            return self.ints[feature]
+        if feature in self.floats:
+            return self.frame_rate() if feature == 'FrameRate' else self.floats[feature]
+        if feature in self.bools:
+            return self.overlap() if feature == 'Overlap' else self.bools[feature]
+        if feature in self.strings:
+            return self.strings[feature]
+        if feature in self.enums:
+            return self.enums[feature]
+        if feature == 'BitDepth':
+            return 0 if _GAINS[self.enums['SimplePreAmpGainControl']].startswith('12') else 1
+        if feature == 'TemperatureStatus':
+            if self.cooling_start is None:
+                return 0
+            return 1 if self.sensor_temperature() < 0.5 else 2
+        return {
+            'AOIStride': self.row_bytes,
+            'ImageSizeBytes': self.image_bytes,
+            'SensorHeight': lambda: _SENSOR_HEIGHT,
+            'SensorWidth': lambda: _SENSOR_WIDTH,
+            'TimestampClock': self.ticks,
+            'TimestampClockFrequency': lambda: _TIMESTAMP_HZ,
+            'MaxInterfaceTransferRate': lambda: _config['interface_bytes_per_sec'] / self.image_bytes(),
+            'ReadoutTime': self.readout_time,
+            'SensorTemperature': self.sensor_temperature,
+            'CameraAcquiring': lambda: self.acquiring
+        }[feature]()
+
+    def ticks(self, t=None):
+        if t is None:
+            t = time.monotonic()
+        return int((t - self.clock_zero) * _TIMESTAMP_HZ)
+
+    def int_range(self, feature):
+        binning = self.binning()
+        max_width = _SENSOR_WIDTH // binning
+        max_height = _SENSOR_HEIGHT // binning
+        return {
+            'AccumulateCount': (1, 2**31 - 1),
+            'AOIWidth': (4, (_SENSOR_WIDTH - self.ints['AOILeft'] + 1) // binning),
+            'AOIHeight': (1, (_SENSOR_HEIGHT - self.ints['AOITop'] + 1) // binning),
+            'AOILeft': (1, _SENSOR_WIDTH - self.ints['AOIWidth'] * binning + 1),
+            'AOITop': (1, _SENSOR_HEIGHT - self.ints['AOIHeight'] * binning + 1),
+            'FrameCount': (1, 2**31 - 1),
+        }.get(feature, (self.get(feature), self.get(feature)))
+
+    def float_range(self, feature):
+        if feature == 'ExposureTime':
+            return 0.00001, 30
+        elif feature == 'FrameRate':
+            return self.frame_rate_range()
+        value = self.get(feature)
+        return value, value
+
+    def is_implemented(self, feature):
+        return (feature in self.ints or feature in self.floats or feature in self.bools or feature in self.strings
+            or feature in _ENUMS or feature in _DERIVED_INTS or feature in _DERIVED_FLOATS or feature in _DERIVED_BOOLS
+            or feature in _COMMANDS)
+
+    def is_writable(self, feature):
+        if not self.is_implemented(feature) or _is_read_only(self, feature) or feature in _COMMANDS:
+            return False
+        if self.acquiring and feature not in _WRITABLE_WHILE_ACQUIRING:
+            return False
+        if feature == 'Overlap':
+            return not (self.shutter() == 'Rolling' and self.trigger_mode() == 'Software')
+        return True
+
+    def is_enum_index_available(self, feature, index):
+        if feature == 'PixelEncoding':
+            twelve_bit = _GAINS[self.enums['SimplePreAmpGainControl']].startswith('12')
+            return twelve_bit or not _ENCODINGS[index].startswith('Mono12')
+        if feature == 'TriggerMode':
+            return _ENUMS[feature][index] != 'External Start' or not self.overlap()
+        return True
+
+    def set(self, feature, value):
+        old_binning = self.binning()
+        if feature in self.ints:
+            self.ints[feature] = value
+        elif feature in self.floats:
+            self.floats[feature] = value
+        elif feature in self.bools:
+            self.bools[feature] = value
+        elif feature in self.enums:
+            self.enums[feature] = value
+        if feature == 'SimplePreAmpGainControl' and not _GAINS[value].startswith('12') and self.encoding().startswith('Mono12'):
+            # 12-bit encodings are unavailable in 16-bit mode
+            self.enums['PixelEncoding'] = _ENCODINGS.index('Mono16')
+        elif feature == 'Overlap' and value and self.shutter() == 'Global' and self.floats['ExposureTime'] < self.readout_time():
+            # in global-shutter overlap mode, the exposure time can't be shorter than the readout
+            self.floats['ExposureTime'] = self.readout_time()
+        elif feature == 'SensorCooling':
+            self.cooling_start = time.monotonic() if value else None
+        elif feature == 'IOInvert':
+            self.io_inverted[self.enums['IOSelector']] = value
+        elif feature == 'IOSelector':
+            self.bools['IOInvert'] = self.io_inverted.get(value, False)
+        elif feature == 'AOIBinning':
+            self._rebin_aoi(old_binning)
+        if self.acquiring and feature in ('ExposureTime', 'FrameRate') and self.next_start is not None and self.last_trigger is not None:
+            # frames not yet started are rescheduled at the new rate
+            self.next_start = max(time.monotonic(), self.last_trigger + 1 / self.frame_rate())
+        self.changed.notify_all()
+
+    def _rebin_aoi(self, old_binning):
+        # AOIWidth and AOIHeight are in binned pixels, and AOILeft and AOITop
+        # in sensor pixels: like the SDK, keep the AOI covering the same area
+        # of the sensor as far as possible, and clamp it to fit the sensor.
+        binning = self.binning()
+        for size, start, sensor_size, min_size in (('AOIWidth', 'AOILeft', _SENSOR_WIDTH, 4), ('AOIHeight', 'AOITop', _SENSOR_HEIGHT, 1)):
+            pixels = self.ints[size] * old_binning
+            self.ints[size] = min(max(pixels // binning, min_size), sensor_size // binning)
+            self.ints[start] = min(self.ints[start], sensor_size - self.ints[size] * binning + 1)
+
+    # ACQUISITION
+    def start(self):
+        now = time.monotonic()
+        self.acquiring = True
+        self.overflowed = False
+        self.frames_started = 0
+        self.interface_free = now
+        self.last_trigger = None
+        self.next_start = now if self.trigger_mode() == 'Internal' else None
+        self.templates = _make_templates(self)
+        self.changed.notify_all()
+
+    def stop(self):
+        self.advance(time.monotonic())
+        self.acquiring = False
+        self.next_start = None
+        # frames still being exposed or read out are lost
+        now = time.monotonic()
+        while self.frames and self.frames[-1].ready > now:
+            self.frames.pop()
+        self.changed.notify_all()
+
+    def frame_limit_reached(self):
+        return _ENUMS['CycleMode'][self.enums['CycleMode']] == 'Fixed' and self.frames_started >= self.ints['FrameCount']
+
+    def start_frame(self, start):
+        self.frames.append(_Frame(start, start + self.floats['ExposureTime'] + self.readout_time()))
+        self.frames_started += 1
+        self.last_trigger = start
+
+    def software_trigger(self):
+        now = time.monotonic()
+        if not self.acquiring or self.trigger_mode() != 'Software' or self.frame_limit_reached():
+            self.stats['triggers_ignored'] += 1
+            return
+        if self.last_trigger is not None and now - self.last_trigger < 1 / self.frame_rate_range()[1]:
+            # triggers faster than the maximum frame rate are ignored: they do not queue up
+            self.stats['triggers_ignored'] += 1
+            return
+        self.start_frame(now)
+        self.changed.notify_all()
+
+    def advance(self, now):
+        """Start any internally-triggered frames due by now, and check for
+        overflow of the camera RAM."""
+        if self.next_start is not None:
+            period = 1 / self.frame_rate()
+            while self.next_start <= now and not self.frame_limit_reached():
+                self.start_frame(self.next_start)
+                self.next_start += period
+        completed = sum(1 for frame in self.frames if frame.ready <= now)
+        capacity = _config['camera_ram_bytes'] // self.image_bytes()
+        if completed > capacity:
+            self.overflowed = True
+            for i in range(completed - capacity):
+                self.frames.popleft()
+                self.stats['frames_lost'] += 1
+
+    def next_event(self, now):
+        """Return the next time at which a frame could be delivered, or None
+        if that depends on a trigger or a buffer being queued."""
+        times = []
+        if self.frames and self.queued:
+            transfer_time = self.image_bytes() / _config['interface_bytes_per_sec']
+            times.append(max(self.frames[0].ready, self.interface_free) + transfer_time)
+        if self.next_start is not None and not self.frame_limit_reached():
+            times.append(self.next_start)
+        return min(times) if times else None
+
+    def wait_buffer(self, timeout):
+        deadline = None if timeout == ANDOR_INFINITE else time.monotonic() + timeout / 1000
+        with self.lock:
+            while True:
+                now = time.monotonic()
+                self.advance(now)
+                if self.overflowed:
+                    self.overflowed = False
+                    self.stats['overflows'] += 1
+                    _raise('HARDWARE_OVERFLOW', 'AT_WaitBuffer', timeout)
+                event = self.next_event(now)
+                if self.frames and self.queued and event <= now:
+                    frame = self.frames.popleft()
+                    address, size = self.queued.popleft()
+                    self.interface_free = event
+                    index = self.stats['frames_delivered']
+                    self.stats['frames_delivered'] += 1
+                    break
+                if deadline is not None and now >= deadline:
+                    _raise('TIMEDOUT', 'AT_WaitBuffer', timeout)
+                wait = [t - now for t in (event, deadline) if t is not None]
+                self.changed.wait(min(wait) if wait else None)
+            templates = self.templates
+            image_bytes = self.image_bytes()
+            metadata = _make_metadata(self, frame, index)
+        _fill_buffer(address, image_bytes, templates[index % len(templates)], metadata)
+        return ctypes.cast(address, ctypes.POINTER(ctypes.c_uint8)), size
+
+
+_template_cache = {}
+
+def _make_templates(camera):
+    """Return a list of synthetic frames, each as the raw bytes of the image
+    data in the current AOI and pixel encoding."""
+    width, height = camera.ints['AOIWidth'], camera.ints['AOIHeight']
+    encoding = camera.encoding()
+    max_value = 4095 if camera.get('BitDepth') == 0 else 65535
+    key = width, height, encoding, camera.row_bytes(), max_value, _config['template_count'], _config['image_source']
+    if key not in _template_cache:
+        # generating the images is slow, so only keep templates for the most recent settings
+        _template_cache.clear()
+        templates = []
+        for i in range(_config['template_count']):
+            image = _config['image_source'](width, height, i)
+            image = numpy.clip(image, 0, max_value).astype(numpy.uint32)
+            templates.append(_encode(image, encoding, camera.row_bytes()))
+        _template_cache[key] = templates
+    return _template_cache[key]
+
+def _default_image_source(width, height, index):
+    """Return a (width, height) image with a smooth background, drifting bright
+    spots, and noise."""
+    rng = numpy.random.RandomState(index)
+    x, y = numpy.ogrid[-1:1:width*1j, -1:1:height*1j]
+    image = 1000 + 500 * numpy.cos(x * 2) * numpy.cos(y * 3)
+    for cx, cy in numpy.random.RandomState(0).uniform(-0.8, 0.8, size=(10, 2)):
+        cx += 0.02 * index
+        # a gaussian is separable, which is much faster than evaluating it at every pixel
+        image += 2000 * numpy.exp(-(x - cx)**2 / 0.002) * numpy.exp(-(y - cy)**2 / 0.002)
+    # tile a patch of noise, rather than generating noise for every pixel
+    noise = rng.normal(scale=20, size=(256, 256))
+    image += numpy.tile(noise, (-(-width // 256), -(-height // 256)))[:width, :height]
+    return image
+
+def _encode(image, encoding, row_bytes):
+    """Encode a (width, height) image as rows of row_bytes bytes each."""
+    width, height = image.shape
+    rows = numpy.zeros((height, row_bytes), dtype=numpy.uint8)
+    if encoding == 'Mono12Packed':
+        # pack each row separately, padding odd-width rows with a zero pixel
+        pixels = numpy.zeros((height, width + width % 2), dtype=numpy.uint16)
+        pixels[:, :width] = image.T
+        packed = packed12.pack(pixels.reshape(-1)).reshape(height, -1)
+    else:
+        dtype = numpy.dtype('<u{}'.format(_BYTES_PER_PIXEL[encoding]))
+        packed = numpy.ascontiguousarray(image.T, dtype=dtype).view(numpy.uint8)
+    rows[:, :packed.shape[1]] = packed
+    return rows.reshape(-1)
+
+def _chunk(data, cid):
+    return numpy.concatenate([numpy.frombuffer(data, dtype=numpy.uint8),
+        numpy.array([cid, len(data) + 4], dtype='<u4').view(numpy.uint8)])
+
+def _make_metadata(camera, frame, index):
+    if not camera.bools['MetadataEnable']:
+        return numpy.zeros(0, dtype=numpy.uint8)
+    image_size = camera.row_bytes() * camera.ints['AOIHeight']
+    # the trailer for the image data chunk, then the other chunks (which are parsed backward from the end)
+    chunks = [numpy.array([_CID_FRAME, image_size + 4], dtype='<u4').view(numpy.uint8)]
+    if camera.bools['MetadataTimestamp']:
+        chunks.append(_chunk(numpy.array([camera.ticks(frame.start)], dtype='<u8').tobytes(), _CID_TICKS))
+    if camera.bools['MetadataFrame']:
+        encoding = _ENCODINGS.index(camera.encoding())
+        info = numpy.array([camera.row_bytes(), encoding, camera.ints['AOIWidth'], camera.ints['AOIHeight']], dtype='<u2')
+        chunks.append(_chunk(info.tobytes(), _CID_FRAME_INFO))
+    return numpy.concatenate(chunks)
+
+def _fill_buffer(address, image_bytes, template, metadata):
+    buffer = numpy.ctypeslib.as_array(ctypes.cast(address, ctypes.POINTER(ctypes.c_uint8)), shape=(image_bytes,))
+    buffer[:len(template)] = template
+    buffer[len(template):len(template) + len(metadata)] = metadata
+
+def _decode(rows, encoding, width):
+    """Decode a (height, stride) array of rows of pixels to a (height, width) array."""
+    height = rows.shape[0]
+    if encoding == 'Mono12Packed':
+        row_bytes = packed12.packed_size(width)
+        packed = numpy.ascontiguousarray(rows[:, :row_bytes]).reshape(-1)
+        even_width = row_bytes // 3 * 2
+        return packed12.unpack(packed, height * even_width).reshape(height, even_width)[:, :width]
+    dtype = numpy.dtype('<u{}'.format(_BYTES_PER_PIXEL[encoding]))
+    return numpy.ascontiguousarray(rows[:, :width * dtype.itemsize]).view(dtype)
+
+_config = dict(
+    interface_bytes_per_sec=360e6,
+    camera_ram_bytes=1 << 30,
+    stride_alignment=8,
+    template_count=4,
+    image_source=_default_image_source
+)
+
+def configure(interface_bytes_per_sec=None, camera_ram_bytes=None, stride_alignment=None, template_count=None,
+        image_source=None):
+    """Change the simulation parameters. Parameters left as None are unchanged.
+
+    Parameters:
+        interface_bytes_per_sec: bandwidth of the simulated camera interface,
+            which limits the rate at which frames are delivered to buffers.
+            The default, 360e6, is roughly that of USB3.
+        camera_ram_bytes: size of the simulated camera RAM, which holds frames
+            that have been acquired but not yet delivered to buffers.
+        stride_alignment: rows of pixel data are padded to a multiple of this
+            many bytes.
+        template_count: number of distinct synthetic frames to cycle through.
+        image_source: function taking (width, height, index) and returning a
+            (width, height) image, which is used to generate the frames
+            (converted to the camera's current bit depth and pixel encoding)
+            at the start of each acquisition.
+    """
+    for key, value in locals().items():
+        if value is not None:
+            _config[key] = value
+
+def get_stats():
+    """Return a dict of counts of frames delivered, frames lost to camera RAM
+    overflow, overflow errors raised, and software triggers ignored."""
+    camera = _get_camera('get_stats')
+    with camera.lock:
+        return dict(frames_delivered=camera.stats['frames_delivered'], frames_lost=camera.stats['frames_lost'],
+            overflows=camera.stats['overflows'], triggers_ignored=camera.stats['triggers_ignored'])
+
+_camera = None
+
+def _raise(error, function, *args):
+    raise AndorError('{} error when calling {}({})'.format(error, function, ' ,'.join(map(str, args))))
+
+def _get_camera(function, *args):
+    if _camera is None:
+        raise AndorError('Andor library not initialized')
+    return _camera
+
+def _check_feature(function, feature, kind):
+    camera = _get_camera(function, feature)
+    if not camera.is_implemented(feature) or kind is not None and not _is_kind(camera, feature, kind):
+        _raise('NOTIMPLEMENTED', function, feature)
+    return camera
+
+def _is_kind(camera, feature, kind):
+    return {
+        'Int': lambda: feature in camera.ints or feature in _DERIVED_INTS,
+        'Float': lambda: feature in camera.floats or feature in _DERIVED_FLOATS,
+        'Bool': lambda: feature in camera.bools or feature in _DERIVED_BOOLS,
+        'Enum': lambda: feature in _ENUMS,
+        'String': lambda: feature in camera.strings,
+        'Command': lambda: feature in _COMMANDS
+    }[kind]()
+
+def _write(function, feature, kind, value, validate=None):
+    camera = _check_feature(function, feature, kind)
+    with camera.lock:
+        if not camera.is_writable(feature):
+            _raise('NOTWRITABLE', function, feature, value)
+        if validate is not None and not validate(camera):
+            _raise('OUTOFRANGE', function, feature, value)
+        before = _snapshot(camera)
+        camera.set(feature, value)
+        after = _snapshot(camera)
+    _notify_changes(camera, before, after)
+
+def _snapshot(camera):
+    """Return the current values of all features with registered callbacks."""
+    values = {}
+    for feature in camera.callbacks:
+        if feature in _VOLATILE:
+            continue
+        try:
+            values[feature] = camera.get(feature)
+        except KeyError:
+            values[feature] = None
+    return values
+
+def _notify_changes(camera, before, after):
+    # call callbacks without holding the lock, as they will generally read feature values
+    for feature, value in after.items():
+        if before.get(feature) != value:
+            _call_callbacks(camera, feature)
+
+def _call_callbacks(camera, feature):
+    for callback, context in list(camera.callbacks.get(feature, ())):
+        callback(0, feature, context)
+
+def initialize(desired_camera):
+    """Initialize the simulated camera, with the desired model name."""
+    global _camera
+    if _camera is None:
+        _camera = _SimulatedCamera(desired_camera)
+
+def RegisterFeatureCallback(Feature, EvCallback, Context):
+    camera = _check_feature('AT_RegisterFeatureCallback', Feature, None)
+    with camera.lock:
+        camera.callbacks[Feature].append((EvCallback, Context))
+    # as with the real SDK, the callback is called once upon registration
+    EvCallback(0, Feature, Context)
+
+def UnregisterFeatureCallback(Feature, EvCallback, Context):
+    camera = _get_camera('AT_UnregisterFeatureCallback', Feature)
+    with camera.lock:
+        callbacks = camera.callbacks.get(Feature, [])
+        for i, (callback, context) in enumerate(callbacks):
+            if callback is EvCallback and context == Context:
+                del callbacks[i]
+                break
+        if not callbacks:
+            camera.callbacks.pop(Feature, None)
+
+def IsImplemented(Feature):
+    return _get_camera('AT_IsImplemented', Feature).is_implemented(Feature)
+
+def IsReadable(Feature):
+    camera = _get_camera('AT_IsReadable', Feature)
+    if Feature == 'FrameCount':
+        return camera.is_implemented(Feature) and _ENUMS['CycleMode'][camera.enums['CycleMode']] == 'Fixed'
+    return camera.is_implemented(Feature) and Feature not in _COMMANDS
+
+def IsWritable(Feature):
+    camera = _get_camera('AT_IsWritable', Feature)
+    with camera.lock:
+        return camera.is_writable(Feature)
+
+def IsReadOnly(Feature):
+    return _is_read_only(_get_camera('AT_IsReadOnly', Feature), Feature)
+
+def _is_read_only(camera, feature):
+    return (feature in _READONLY_ENUMS or feature in camera.strings or feature in _DERIVED_INTS
+        or feature in _DERIVED_FLOATS or feature in _DERIVED_BOOLS)
+
+def _read(function, feature, kind):
+    camera = _check_feature(function, feature, kind)
+    if not IsReadable(feature):
+        _raise('NOTIMPLEMENTED', function, feature)
+    with camera.lock:
+        return camera.get(feature)
+
+def SetInt(Feature, Value):
+    def validate(camera):
+        low, high = camera.int_range(Feature)
+        return low <= Value <= high
+    _write('AT_SetInt', Feature, 'Int', int(Value), validate)
+
+def GetInt(Feature):
+    return _read('AT_GetInt', Feature, 'Int')
+
+def GetIntMax(Feature):
+    camera = _check_feature('AT_GetIntMax', Feature, 'Int')
+    with camera.lock:
+        return camera.int_range(Feature)[1]
+
+def GetIntMin(Feature):
+    camera = _check_feature('AT_GetIntMin', Feature, 'Int')
+    with camera.lock:
+        return camera.int_range(Feature)[0]
+
+def SetFloat(Feature, Value):
+    def validate(camera):
+        low, high = camera.float_range(Feature)
+        return low <= Value <= high
+    _write('AT_SetFloat', Feature, 'Float', float(Value), validate)
+
+def GetFloat(Feature):
+    return _read('AT_GetFloat', Feature, 'Float')
+
+def GetFloatMax(Feature):
+    camera = _check_feature('AT_GetFloatMax', Feature, 'Float')
+    with camera.lock:
+        return camera.float_range(Feature)[1]
+
+def GetFloatMin(Feature):
+    camera = _check_feature('AT_GetFloatMin', Feature, 'Float')
+    with camera.lock:
+        return camera.float_range(Feature)[0]
+
+def SetBool(Feature, Bool):
+    _write('AT_SetBool', Feature, 'Bool', bool(Bool))
+
+def GetBool(Feature):
+    return _read('AT_GetBool', Feature, 'Bool')
+
+def _set_enum(function, feature, index):
+    def validate(camera):
+        return 0 <= index < len(_ENUMS[feature]) and camera.is_enum_index_available(feature, index)
+    _write(function, feature, 'Enum', index, validate)
+
+def SetEnumIndex(Feature, Value):
+    _set_enum('AT_SetEnumIndex', Feature, Value)
+
+def SetEnumString(Feature, String):
+    _check_feature('AT_SetEnumString', Feature, 'Enum')
+    if String not in _ENUMS[Feature]:
+        _raise('STRINGNOTAVAILABLE', 'AT_SetEnumString', Feature, String)
+    _set_enum('AT_SetEnumString', Feature, _ENUMS[Feature].index(String))
+
+def GetEnumIndex(Feature):
+    return _read('AT_GetEnumIndex', Feature, 'Enum')
+
+def GetEnumCount(Feature):
+    _check_feature('AT_GetEnumCount', Feature, 'Enum')
+    return len(_ENUMS[Feature])
+
+def IsEnumIndexAvailable(Feature, Index):
+    camera = _check_feature('AT_IsEnumIndexAvailable', Feature, 'Enum')
+    with camera.lock:
+        return camera.is_enum_index_available(Feature, Index)
+
+def IsEnumIndexImplemented(Feature, Index):
+    _check_feature('AT_IsEnumIndexImplemented', Feature, 'Enum')
+    return 0 <= Index < len(_ENUMS[Feature])
+
+def GetEnumStringByIndex(Feature, Index):
+    _check_feature('AT_GetEnumStringByIndex', Feature, 'Enum')
+    if not 0 <= Index < len(_ENUMS[Feature]):
+        _raise('OUTOFRANGE', 'AT_GetEnumStringByIndex', Feature, Index)
+    return _ENUMS[Feature][Index]
+
+def Command(Feature):
+    camera = _check_feature('AT_Command', Feature, 'Command')
+    with camera.lock:
+        before = _snapshot(camera)
+        if Feature == 'AcquisitionStart':
+            if camera.acquiring:
+                _raise('NOTWRITABLE', 'AT_Command', Feature)
+            camera.start()
+        elif Feature == 'AcquisitionStop':
+            camera.stop()
+        elif Feature == 'SoftwareTrigger':
+            camera.software_trigger()
+        elif Feature == 'TimestampClockReset':
+            camera.clock_zero = time.monotonic()
+        after = _snapshot(camera)
+    _notify_changes(camera, before, after)
+
+def SetString(Feature, String):
+    _check_feature('AT_SetString', Feature, 'String')
+    _raise('NOTWRITABLE', 'AT_SetString', Feature, String)
+
+def GetString(Feature):
+    return _read('AT_GetString', Feature, 'String')
+
+def GetStringMaxLength(Feature):
+    _check_feature('AT_GetStringMaxLength', Feature, 'String')
+    return 255
+
+def QueueBuffer(Ptr, PtrSize):
+    camera = _get_camera('AT_QueueBuffer', Ptr, PtrSize)
+    address = ctypes.cast(Ptr, ctypes.c_void_p).value
+    with camera.lock:
+        if address % 8:
+            _raise('INVALIDALIGNMENT', 'AT_QueueBuffer', Ptr, PtrSize)
+        if PtrSize < camera.image_bytes():
+            _raise('INVALIDSIZE', 'AT_QueueBuffer', Ptr, PtrSize)
+        camera.queued.append((address, PtrSize))
+        camera.changed.notify_all()
+
+def WaitBuffer(Timeout):
+    return _get_camera('AT_WaitBuffer', Timeout).wait_buffer(Timeout)
+
+def Flush():
+    camera = _get_camera('AT_Flush')
+    with camera.lock:
+        camera.queued.clear()
+        camera.frames.clear()
+        camera.overflowed = False
+        camera.changed.notify_all()
+
+def ConvertBuffer(inputBuffer, outputBuffer, width, height, stride, inputPixelEncoding, outputPixelEncoding):
+    if inputPixelEncoding not in _ENCODINGS:
+        _raise('AT_ERR_INVALIDINPUTPIXELENCODING', 'AT_ConvertBuffer', inputPixelEncoding)
+    if outputPixelEncoding not in ('Mono16', 'Mono32'):
+        _raise('AT_ERR_INVALIDOUTPUTPIXELENCODING', 'AT_ConvertBuffer', outputPixelEncoding)
+    rows = numpy.ctypeslib.as_array(inputBuffer, shape=(height * stride,)).reshape(height, stride)
+    out_dtype = numpy.dtype('<u{}'.format(_BYTES_PER_PIXEL[outputPixelEncoding]))
+    out = numpy.ctypeslib.as_array(ctypes.cast(outputBuffer, ctypes.POINTER(ctypes.c_uint8)),
+        shape=(height * width * out_dtype.itemsize,)).view(out_dtype).reshape(height, width)
+    out[:] = _decode(rows, inputPixelEncoding, width)
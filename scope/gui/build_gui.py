@@ -31,12 +31,12 @@ def gui_main(host):
     main_window = scope_widgets.WidgetWindow(scope, WIDGETS, window_title=title)
     app.exec()
 
-def monitor_main(hosts, downsample=None, fps_max=None):
+def monitor_main(hosts, downsample=None, fps_max=None, max_bytes_per_sec=None, delta_threshold=None):
     app = shared_resources.init_qapplication(icon_resource_path=(__name__, 'icon.svg'))
     viewers = []
     for host in hosts:
         scope = scope_client.ScopeClient(host, allow_interrupt=False, auto_connect=False)
         app_prefs_name = 'viewer-{}'.format(host)
-        viewer = scope_viewer_widget.MonitorWidget(scope, host, downsample, fps_max, app_prefs_name)
+        viewer = scope_viewer_widget.MonitorWidget(scope, host, downsample, fps_max, app_prefs_name, max_bytes_per_sec, delta_threshold)
         viewers.append(viewer)
     app.exec()
@@ -111,10 +111,20 @@ class ScopeViewerWidget(ris_widget.RisWidgetQtObject):
             freeimage.write(self.image.data, fn)
 
 class MonitorWidget(ScopeViewerWidget):
-    def __init__(self, scope, window_title='Viewer', downsample=None, fps_max=None, app_prefs_name='scope-viewer', parent=None):
+    def __init__(self, scope, window_title='Viewer', downsample=None, fps_max=None, app_prefs_name='scope-viewer', max_bytes_per_sec=None,
+            delta_threshold=None, parent=None):
+        """If downsample is None, compression and downsampling are chosen
+        automatically to attain fps_max (or 10 fps) within the bandwidth budget
+        given by max_bytes_per_sec (if any). If delta_threshold is not None,
+        only the image tiles that changed by more than that amount since the
+        previous frame are sent. (The threshold must be above the camera's
+        noise level, or nearly every tile will be sent anyway.)"""
         super().__init__(scope, window_title, fps_max, app_prefs_name, parent)
         self.live_streamer.image_ready_callback = None # don't allow image callbacks until scope is connected
         self.downsample = downsample
+        self.target_fps = 10 if fps_max is None else fps_max
+        self.max_bytes_per_sec = max_bytes_per_sec
+        self.delta_threshold = delta_threshold
         self.removeToolBar(self.scope_toolbar)
         self.show_over_exposed_action.setChecked(False)
         self.histogram_dock_widget.hide()
@@ -130,6 +140,8 @@ class MonitorWidget(ScopeViewerWidget):
         status.layout().insertSpacing(0, 5)
         vbox.addWidget(status)
         vbox.addWidget(self.centralWidget())
+        self.transfer_label = Qt.QLabel()
+        vbox.addWidget(self.transfer_label)
         self.setCentralWidget(new_central)
         self.show()
         self.timer = Qt.QBasicTimer()
@@ -143,6 +155,19 @@ class MonitorWidget(ScopeViewerWidget):
             self.scope._connect()
         self.timer.stop()
         if not self.scope._is_local:
-            self.scope._get_data.downsample = self.downsample
+            if self.delta_threshold is not None:
+                self.scope._get_data.set_live_delta(threshold=self.delta_threshold)
+            if self.downsample is None:
+                self.scope._get_data.set_adaptive_compression(self.target_fps, self.max_bytes_per_sec)
+            else:
+                self.scope._get_data.downsample = self.downsample
         self.live_streamer.image_ready_callback = self.post_new_image_event
         self.scope.rebroadcast_properties()
+
+    def event(self, e):
+        handled = super().event(e)
+        if e.type() == self.NEW_IMAGE_EVENT and not self.scope._is_local:
+            adaptive = self.scope._get_data.adaptive
+            if adaptive is not None:
+                self.transfer_label.setText(adaptive.describe())
+        return handled
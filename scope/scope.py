@@ -18,6 +18,7 @@ class Scope(message_device.AsyncDeviceNamespace):
         self._property_server = property_server
         if property_server is not None:
             self.rebroadcast_properties = property_server.rebroadcast_properties
+            self.get_property_update_statistics = property_server.get_update_statistics
 
         self._components = []
 
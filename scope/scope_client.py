@@ -9,15 +9,25 @@ import contextlib
 
 from .simple_rpc import rpc_client, property_client
 from .util import transfer_ism_buffer
+from .util import live_ring
+from .util import frame_push
 from .config import scope_configuration
 
 class ScopeClient:
     _HEARTBEAT_SEC = 3
     _scope = None # set to not none in instances when connected
 
-    def __init__(self, host='127.0.0.1', allow_interrupt=True, auto_connect=True):
+    def __init__(self, host='127.0.0.1', allow_interrupt=True, auto_connect=True, property_broker=None):
+        """Connect to the microscope server on the given host.
+
+        If property_broker is not None, it must be the ZeroMQ address of a
+        property broker (see scope_property_broker) relaying updates from that
+        host, e.g. 'tcp://127.0.0.1:6004'. Property updates will be received
+        from the broker rather than directly from the server.
+        """
         self.host = host
         self._allow_interrupt = allow_interrupt
+        self._property_broker = property_broker
 
         context = zmq.Context()
         addresses = scope_configuration.get_addresses(host)
@@ -26,7 +36,8 @@ class ScopeClient:
         self._rpc_client = rpc_client.ZMQClient(addresses['rpc'], interrupt_addr, **kws)
         self._image_transfer_client = rpc_client.ZMQClient(addresses['image_transfer_rpc'], **kws)
         del kws['timeout_sec'] # no timeout for property_client since it's a receive channel
-        self.properties = property_client.ZMQClient(addresses['property'], **kws)
+        property_addr = addresses['property'] if property_broker is None else property_broker
+        self.properties = property_client.ZMQClient(property_addr, **kws)
 
         self._ping = self._rpc_client.proxy_function('_ping')
         self._sleep = self._rpc_client.proxy_function('_sleep')
@@ -60,6 +71,18 @@ class ScopeClient:
             _patch_camera(scope.camera, get_data, self._image_transfer_client)
             if not is_local:
                 scope.camera.set_network_compression = get_data.set_network_compression
+                scope.camera.set_adaptive_compression = get_data.set_adaptive_compression
+                scope.camera.set_network_transform = get_data.set_transform
+                scope.camera.set_live_delta = get_data.set_live_delta
+                scope.camera.set_network_packed12 = get_data.set_packed12
+            push_address = scope_configuration.get_addresses(self.host)['image_push']
+            def subscribe_frames(credits=2, max_queued=1, **settings):
+                """Return a FramePushClient, from which frames acquired by the
+                camera (in live mode or during a sequence acquisition) can be
+                retrieved with get_frame() as soon as they are acquired, without
+                any RPC calls. See FramePushClient for the parameters."""
+                return frame_push.FramePushClient(push_address, credits, max_queued, **settings)
+            scope.camera.subscribe_frames = subscribe_frames
             if hasattr(scope.camera, 'autofocus'):
                 # set a 45-minute timeout to allow for FFT calculation if necessary
                 scope.camera.autofocus.ensure_fft_ready._timeout_sec = 45*60
@@ -92,7 +115,7 @@ class ScopeClient:
     def _clone(self):
         """Create an identical client with distinct ZMQ sockets, so that it may be safely used
         from a separate thread."""
-        return type(self)(self.host, self._allow_interrupt, auto_connect=self._is_connected())
+        return type(self)(self.host, self._allow_interrupt, auto_connect=self._is_connected(), property_broker=self._property_broker)
 
     def __setattr__(self, name, value):
         if self._scope is not None:
@@ -125,7 +148,7 @@ def _patch_camera(camera, get_data, image_transfer_client):
 
     # define image transfer wrapper functions
     def get_many_data(image_names):
-        return [get_data(name) for name in image_names]
+        return get_data.get_many(image_names)
     def get_data_and_metadata(return_values):
         image_name, timestamp, frame_number = return_values
         return get_data(image_name), timestamp, frame_number
@@ -151,8 +174,9 @@ def _patch_camera(camera, get_data, image_transfer_client):
     # latest image from the camera, even when the main connection to the scope
     # is tied up with a blocking call (like autofocus).
     def latest_image():
-        name, timestamp, frame_number = image_transfer_client('latest_image')
-        return get_data(name), timestamp, frame_number
+        name, timestamp, frame_number = image_transfer_client('latest_image',
+            _release=get_data.take_pending_releases(), _client=transfer_ism_buffer.CLIENT_ID)
+        return get_data.get_live(name), timestamp, frame_number
     latest_image.__doc__ = camera.latest_image.__doc__
     camera.latest_image = latest_image
 
@@ -231,17 +255,22 @@ class LiveStreamer:
         if hasattr(scope, 'camera'):
             self.live = scope.camera.live_mode
             self.bit_depth = scope.camera.bit_depth
+            self._live_ring_name = getattr(scope.camera, 'live_ring_name', None)
         else:
             self.live = False
             self.bit_depth = '16 Bit'
+            self._live_ring_name = None
         self.latest_intervals = collections.deque(maxlen=10)
         self._last_time = time.time()
+        self._live_ring = None
+        self.scope.properties.subscribe('scope.camera.live_ring_name', self._live_ring_change, valueonly=True)
         self.scope.properties.subscribe('scope.camera.live_mode', self._live_change, valueonly=True)
         self.scope.properties.subscribe('scope.camera.frame_number', self._image_update, valueonly=True)
         self.scope.properties.subscribe('scope.camera.bit_depth', self._depth_update, valueonly=True)
 
     def detach(self):
         self.image_ready_callback = None
+        self.scope.properties.unsubscribe('scope.camera.live_ring_name', self._live_ring_change, valueonly=True)
         self.scope.properties.unsubscribe('scope.camera.live_mode', self._live_change, valueonly=True)
         self.scope.properties.unsubscribe('scope.camera.frame_number', self._image_update, valueonly=True)
         self.scope.properties.unsubscribe('scope.camera.bit_depth', self._depth_update, valueonly=True)
@@ -261,7 +290,7 @@ class LiveStreamer:
         self.image_received.wait()
         # get image before re-enabling image-receiving because if this is over the network, it could take a while
         try:
-            image, timestamp, frame_number = self.scope.camera.latest_image()
+            image, timestamp, frame_number = self._get_latest_image()
             t = time.time()
             self.latest_intervals.append(t - self._last_time)
             self._last_time = t
@@ -269,6 +298,18 @@ class LiveStreamer:
             self.image_received.clear()
         return image, timestamp, frame_number
 
+    def _get_latest_image(self):
+        # On the same host as the server, read live frames from the camera's
+        # shared-memory ring if possible, which requires no RPC calls.
+        ring_name = self._live_ring_name
+        if ring_name is not None and getattr(self.scope, '_is_local', False):
+            if self._live_ring is None or self._live_ring.name != ring_name:
+                self._live_ring = live_ring.LiveRingReader(ring_name)
+            latest = self._live_ring.read_latest()
+            if latest is not None:
+                return latest
+        return self.scope.camera.latest_image()
+
     def image_ready(self):
         """Return whether an image is ready to be retrieved. If False, a
         call to get_image() will block until an image is ready."""
@@ -280,6 +321,12 @@ class LiveStreamer:
             return 0
         return 1/numpy.mean(self.latest_intervals)
 
+    def _live_ring_change(self, name):
+        # called in property_client's thread: just note the name, and open the ring on demand
+        self._live_ring_name = name
+        if name is None:
+            self._live_ring = None
+
     def _live_change(self, live):
         # called in property_client's thread: note we can't do RPC calls
         self.live = live
@@ -58,11 +58,18 @@ class ScopeServer(base_daemon.Runner):
         from . import scope
         from .simple_rpc import rpc_server
         from .simple_rpc import property_server
+        from .simple_rpc import property_journal
         from .util import transfer_ism_buffer
+        from .util import frame_push
 
         addresses = scope_configuration.get_addresses(self.host)
         self.context = zmq.Context()
-        self.property_server = property_server.ZMQServer(addresses['property'], context=self.context)
+        journal_dir = self.config.server.get('PROPERTY_JOURNAL_DIR')
+        journal = property_journal.PropertyJournal(journal_dir) if journal_dir else None
+        # configurations from before the binary property encoding was added will lack a setting for it
+        property_encoding = self.config.server.get('PROPERTY_ENCODING', 'json')
+        self.property_server = property_server.ZMQServer(addresses['property'], context=self.context, journal=journal,
+            encoding=property_encoding)
         scope_controller = scope.Scope(self.property_server)
         # Provide some basic RPC calls for testing...
         scope_controller._sleep = time.sleep
@@ -72,7 +79,14 @@ class ScopeServer(base_daemon.Runner):
         # add transfer_ism_buffer as hidden elements of the namespace, which RPC clients can use for seamless buffer sharing
         image_transfer_namespace._transfer_ism_buffer = transfer_ism_buffer
         if hasattr(scope_controller, 'camera'):
-            image_transfer_namespace.latest_image = scope_controller.camera.latest_image
+            # allow local clients to release previous images in the same call
+            image_transfer_namespace.latest_image = transfer_ism_buffer.piggyback_release(scope_controller.camera.latest_image)
+            # push new frames to subscribed clients as soon as they are acquired
+            self.frame_push_server = frame_push.FramePushServer(addresses['image_push'], context=self.context)
+            scope_controller.camera._frame_listeners.append(self.frame_push_server.push_frame)
+            image_transfer_namespace._frame_push = self.frame_push_server
+        else:
+            self.frame_push_server = None
         self.image_transfer_server = rpc_server.BackgroundBaseZMQServer(image_transfer_namespace,
             addresses['image_transfer_rpc'], context=self.context)
         interrupter = rpc_server.ZMQInterrupter(addresses['interrupt'], context=self.context)
@@ -86,6 +100,8 @@ class ScopeServer(base_daemon.Runner):
         finally:
             self.property_server.stop()
             self.image_transfer_server.stop()
+            if self.frame_push_server is not None:
+                self.frame_push_server.stop()
             self.scope_server.interrupter.stop()
             self.context.term()
 
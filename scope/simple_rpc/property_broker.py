@@ -0,0 +1,157 @@
+# This code is licensed under the MIT License (see LICENSE file for details)
+
+import collections
+import threading
+import time
+import zmq
+import zmq.utils.monitor
+
+from . import property_encoding
+from ..util import logging
+logger = logging.get_logger(__name__)
+
+class PropertyBroker(threading.Thread):
+    STATS_PREFIX = 'property_broker.'
+
+    def __init__(self, upstream_addr, local_addr, stats_interval=2, heartbeat_sec=3, context=None, daemon=True):
+        """Relay property updates from a single upstream property server to any
+        number of local PropertyClients.
+
+        The broker holds one subscription to the upstream server, covering the
+        union of all the property names and prefixes that local clients are
+        subscribed to, and fans updates out to the local clients. Thus the
+        server (and the network) only carry each update once per host, rather
+        than once per client.
+
+        Every stats_interval seconds, the broker publishes statistics about
+        itself as properties prefixed by 'property_broker.', which local clients
+        can subscribe to like any other property:
+            property_broker.clients: number of connected local clients
+            property_broker.messages_per_sec, property_broker.bytes_per_sec:
+                recent throughput from upstream
+            property_broker.messages, property_broker.bytes: totals relayed
+            property_broker.subscriptions: dict mapping subscribed property
+                names/prefixes to the number of local subscribers for each.
+        Note that libzmq does not expose the depth of each subscriber's outgoing
+        queue; a subscriber that falls more than the send high-water mark behind
+        has updates dropped.
+
+        Parameters:
+            upstream_addr: ZeroMQ address of the property server, e.g.
+                'tcp://scope-host:6002'
+            local_addr: ZeroMQ address to bind for local clients, e.g.
+                'tcp://127.0.0.1:6004'
+            stats_interval: seconds between publishing broker statistics.
+            heartbeat_sec: heartbeat interval for the upstream connection.
+            context: a ZeroMQ context to share, if one already exists.
+        """
+        self.context = context if context is not None else zmq.Context()
+        self.upstream_addr = upstream_addr
+        self.local_addr = local_addr
+        self.stats_interval = stats_interval
+        self.heartbeat_sec = heartbeat_sec
+        self.subscriptions = collections.Counter()
+        self.clients = 0
+        self.message_count = 0
+        self.byte_count = 0
+        self.ready = threading.Event()
+        super().__init__(name='PropertyBroker', daemon=daemon)
+        self.start()
+        self.ready.wait()
+
+    def stop(self):
+        self.running = False
+        self.join()
+
+    def get_stats(self):
+        """Return a dict of the current broker statistics."""
+        now = time.time()
+        elapsed = now - self._last_stats_time
+        stats = dict(
+            clients=self.clients,
+            messages=self.message_count,
+            bytes=self.byte_count,
+            messages_per_sec=(self.message_count - self._last_message_count) / elapsed if elapsed else 0,
+            bytes_per_sec=(self.byte_count - self._last_byte_count) / elapsed if elapsed else 0,
+            subscriptions=dict(self.subscriptions)
+        )
+        return stats
+
+    def run(self):
+        self.running = True
+        upstream = self.context.socket(zmq.XSUB)
+        upstream.LINGER = 0
+        heartbeat_ms = self.heartbeat_sec * 1000
+        upstream.HEARTBEAT_IVL = heartbeat_ms
+        upstream.HEARTBEAT_TIMEOUT = heartbeat_ms * 2
+        upstream.HEARTBEAT_TTL = heartbeat_ms * 2
+        upstream.connect(self.upstream_addr)
+        local = self.context.socket(zmq.XPUB)
+        local.LINGER = 0
+        # see every subscribe and unsubscribe message, so that we can count
+        # subscribers for each topic ourselves.
+        local.XPUB_VERBOSER = True
+        local.bind(self.local_addr)
+        monitor = local.get_monitor_socket(zmq.EVENT_ACCEPTED | zmq.EVENT_DISCONNECTED)
+        poller = zmq.Poller()
+        for socket in (upstream, local, monitor):
+            poller.register(socket, zmq.POLLIN)
+        self._last_stats_time = time.time()
+        self._last_message_count = self._last_byte_count = 0
+        self.ready.set()
+        try:
+            while self.running:
+                for socket, event in poller.poll(500):
+                    if socket is upstream:
+                        self._relay_update(upstream, local)
+                    elif socket is local:
+                        self._handle_subscription(local, upstream)
+                    else:
+                        self._handle_monitor_event(monitor)
+                if time.time() - self._last_stats_time >= self.stats_interval:
+                    self._publish_stats(local)
+        finally:
+            local.disable_monitor()
+            monitor.close()
+            local.close()
+            upstream.close()
+
+    def _relay_update(self, upstream, local):
+        parts = upstream.recv_multipart(copy=False)
+        local.send_multipart(parts, copy=False)
+        self.message_count += 1
+        self.byte_count += sum(len(part) for part in parts)
+
+    def _handle_subscription(self, local, upstream):
+        message = local.recv()
+        if not message:
+            return
+        subscribe, topic = message[0], message[1:]
+        topic_str = topic.decode('utf8', errors='replace')
+        if subscribe:
+            self.subscriptions[topic_str] += 1
+            first = self.subscriptions[topic_str] == 1
+        else:
+            self.subscriptions[topic_str] -= 1
+            first = self.subscriptions[topic_str] <= 0
+            if first:
+                del self.subscriptions[topic_str]
+        if first and not topic_str.startswith(self.STATS_PREFIX):
+            # Only pass the first subscription / last unsubscription for a given topic upstream.
+            # Broker statistics are published locally, so there's no need to ask upstream for them.
+            upstream.send(message)
+
+    def _handle_monitor_event(self, monitor):
+        event = zmq.utils.monitor.recv_monitor_message(monitor)
+        if event['event'] == zmq.EVENT_ACCEPTED:
+            self.clients += 1
+        elif event['event'] == zmq.EVENT_DISCONNECTED:
+            self.clients -= 1
+
+    def _publish_stats(self, local):
+        stats = self.get_stats()
+        for name, value in stats.items():
+            local.send_multipart([(self.STATS_PREFIX + name).encode('utf8'), property_encoding.encode(value)])
+        self._last_stats_time = time.time()
+        self._last_message_count = self.message_count
+        self._last_byte_count = self.byte_count
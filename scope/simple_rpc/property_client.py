@@ -4,6 +4,7 @@ import collections
 import threading
 import traceback
 import zmq
+from . import property_encoding
 from ..util import trie
 
 class PropertyClient(threading.Thread):
@@ -184,6 +185,6 @@ class ZMQClient(PropertyClient):
         # poll returned true: socket has data to recv
         property_name = self.socket.recv_string()
         assert(self.socket.getsockopt(zmq.RCVMORE))
-        value = self.socket.recv_json()
+        value = property_encoding.decode(self.socket.recv())
         return property_name, value
 
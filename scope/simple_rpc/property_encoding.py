@@ -0,0 +1,88 @@
+# This code is licensed under the MIT License (see LICENSE file for details)
+
+"""Wire encoding for property values.
+
+Most property updates are single numbers or bools (frame numbers, stage
+positions, temperatures, lamp intensities...), for which JSON encoding and
+decoding is needlessly expensive. In the BINARY format, such values (and
+short, homogeneous lists of ints or floats) are packed as a version byte and a
+one-byte type tag, followed by the raw little-endian binary value. All other
+values are sent as JSON text.
+
+Because valid JSON text never begins with an ASCII control character other
+than whitespace, decode() tells the formats apart from the first byte alone,
+and so handles updates in either format. However, clients from before the
+BINARY format was added can only read JSON, so JSON is the default: the
+BINARY format should only be enabled on a server (see the PROPERTY_ENCODING
+server configuration value) once all of its clients can decode it.
+"""
+
+import json
+import struct
+
+from zplib import datafile
+
+JSON = 'json'
+BINARY = 'binary'
+FORMATS = (JSON, BINARY)
+
+# first byte of every value in the BINARY format; later revisions of the format
+# must use other control characters that are not JSON whitespace (\t, \n or \r)
+_BINARY_V1 = 1
+
+_BOOL = 1
+_INT = 2
+_FLOAT = 3
+_INT_LIST = 4
+_FLOAT_LIST = 5
+
+_BOOL_STRUCT = struct.Struct('<BB?')
+_INT_STRUCT = struct.Struct('<BBq')
+_FLOAT_STRUCT = struct.Struct('<BBd')
+_INT_MIN, _INT_MAX = -2**63, 2**63 - 1
+
+MAX_LIST_LENGTH = 64
+
+def encode(value, format=JSON):
+    """Return the bytes encoding the given value. In the BINARY format,
+    scalars and small numeric lists are encoded in binary, and other values
+    as JSON; in the JSON format, all values are encoded as JSON."""
+    if format not in FORMATS:
+        raise ValueError('Unknown property encoding format "{}"'.format(format))
+    if format == BINARY:
+        # NB: bool is a subclass of int, so check it first.
+        if isinstance(value, bool):
+            return _BOOL_STRUCT.pack(_BINARY_V1, _BOOL, value)
+        elif isinstance(value, int):
+            if _INT_MIN <= value <= _INT_MAX:
+                return _INT_STRUCT.pack(_BINARY_V1, _INT, value)
+        elif isinstance(value, float):
+            return _FLOAT_STRUCT.pack(_BINARY_V1, _FLOAT, value)
+        elif isinstance(value, (list, tuple)) and 0 < len(value) <= MAX_LIST_LENGTH:
+            element_type = type(value[0])
+            if element_type in (int, float) and all(type(v) is element_type for v in value):
+                if element_type is float:
+                    return struct.pack('<BB{}d'.format(len(value)), _BINARY_V1, _FLOAT_LIST, *value)
+                elif all(_INT_MIN <= v <= _INT_MAX for v in value):
+                    return struct.pack('<BB{}q'.format(len(value)), _BINARY_V1, _INT_LIST, *value)
+    return datafile.json_encode_compact_to_bytes(value)
+
+def decode(buf):
+    """Decode bytes produced by encode(), in either format."""
+    version = buf[0]
+    if version == _BINARY_V1:
+        tag = buf[1]
+        if tag == _BOOL:
+            return _BOOL_STRUCT.unpack(buf)[2]
+        elif tag == _INT:
+            return _INT_STRUCT.unpack(buf)[2]
+        elif tag == _FLOAT:
+            return _FLOAT_STRUCT.unpack(buf)[2]
+        elif tag == _INT_LIST:
+            return list(struct.unpack_from('<{}q'.format((len(buf) - 2) // 8), buf, 2))
+        elif tag == _FLOAT_LIST:
+            return list(struct.unpack_from('<{}d'.format((len(buf) - 2) // 8), buf, 2))
+        raise ValueError('Unknown binary property value type {}'.format(tag))
+    elif version < 0x20 and version not in b'\t\n\r':
+        raise ValueError('Unsupported property encoding version {}'.format(version))
+    return json.loads(bytes(buf).decode('utf8'))
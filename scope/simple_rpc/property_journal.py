@@ -0,0 +1,352 @@
+# This code is licensed under the MIT License (see LICENSE file for details)
+
+"""Append-only, memory-mapped journal of property updates.
+
+The journal is a directory of segment files, each named by the time of its
+first record (plus a numeric suffix, if an earlier segment started in the
+same microsecond), so that the segment containing a given time can be found without
+opening any files. Each segment is preallocated, memory-mapped, and filled with
+records laid out as:
+    [kind: uint8][timestamp: float64][name id: uint32][payload length: uint32][payload]
+(all little-endian). A zero kind byte marks the end of the valid records.
+
+Property names are interned per segment: the first time a name appears in a
+segment, a NAME record carrying the utf-8 name is written, and subsequent
+records refer to the name by id. VALUE records carry the JSON encoding of a
+published value. Each segment begins with a snapshot: a run of STATE records
+holding the value of every property known when the segment was started. A new
+snapshot is written every few thousand records, so that the state at any time
+can be reconstructed from the last snapshot before that time, plus the records
+following it. Timestamps never decrease from one record to the next: updates
+stamped out of order (e.g. by different threads) are recorded at the time of
+the latest earlier record.
+
+When a segment fills up, sidecar files are written for it: a time index of
+(timestamp, offset) pairs every few records, the (timestamp, offset) of each
+snapshot, and the segment's name table. A new segment is then started. Readers
+use the indices to seek to the right place in a segment rather than scanning
+the whole thing. (The segment currently being written has no sidecar files
+yet, so readers index it on the fly from the record headers.)
+"""
+
+import bisect
+import itertools
+import json
+import mmap
+import pathlib
+import struct
+
+import numpy
+from zplib import datafile
+
+_HEADER = struct.Struct('<BdII')
+_END, _NAME, _VALUE, _STATE = range(4)
+_INDEX_DTYPE = numpy.dtype([('time', '<f8'), ('offset', '<u8')])
+_SEGMENT_SUFFIX = '.journal'
+_INDEX_SUFFIX = '.index'
+_SNAPSHOTS_SUFFIX = '.snapshots'
+_NAMES_SUFFIX = '.names'
+
+def _segment_path(directory, start_time):
+    """Return the path for a new segment starting at the given time. As
+    timestamps never decrease, several segments can start in the same
+    microsecond: these are distinguished by a numeric suffix, which sorts after
+    the unsuffixed name."""
+    stem = '{:020d}'.format(int(start_time * 1e6))
+    path = directory / (stem + _SEGMENT_SUFFIX)
+    for i in itertools.count(1):
+        if not path.exists():
+            return path
+        path = directory / '{}_{:03d}{}'.format(stem, i, _SEGMENT_SUFFIX)
+
+def _segment_start_time(path):
+    return int(path.stem.split('_')[0]) / 1e6
+
+class PropertyJournal:
+    def __init__(self, directory, segment_bytes=64*1024**2, index_interval=64, snapshot_interval=4096):
+        """Append property updates to a directory of memory-mapped journal segments.
+
+        Parameters:
+            directory: path to the directory to write segments into (will be
+                created if necessary).
+            segment_bytes: size of each segment file. When a segment fills up,
+                it is finished and a new segment is started. (Segment files
+                are sparse, so unused space does not occupy the disk.)
+            index_interval: number of records between time-index entries.
+            snapshot_interval: number of records between snapshots of the
+                complete property state.
+        """
+        self.directory = pathlib.Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.segment_bytes = segment_bytes
+        self.index_interval = index_interval
+        self.snapshot_interval = snapshot_interval
+        self._state = {} # map property names to most-recent JSON-encoded values
+        self._mmap = None
+        self._last_timestamp = float('-inf')
+
+    def append(self, timestamp, property_name, value):
+        """Record that the named property took on the given value at the given
+        time (in seconds since the epoch, as from time.time()). If the time is
+        earlier than that of the previous update, the update is recorded at
+        the previous update's time instead, to keep the journal in time order."""
+        timestamp = max(timestamp, self._last_timestamp)
+        self._last_timestamp = timestamp
+        payload = datafile.json_encode_compact_to_bytes(value)
+        if self._mmap is None:
+            self._start_segment(timestamp, property_name, payload)
+        elif self._since_snapshot >= self.snapshot_interval:
+            if not self._write_snapshot(timestamp):
+                self._finish_segment()
+                self._start_segment(timestamp, property_name, payload)
+        if not self._write_record(_VALUE, timestamp, property_name, payload):
+            self._finish_segment()
+            self._start_segment(timestamp, property_name, payload)
+            self._write_record(_VALUE, timestamp, property_name, payload)
+        self._since_snapshot += 1
+        self._state[property_name] = payload
+
+    def close(self):
+        """Finish the current segment and write its time index."""
+        if self._mmap is not None:
+            self._finish_segment()
+
+    def _start_segment(self, timestamp, property_name, payload):
+        # make sure that the carried-over state plus the pending record will fit
+        # in the segment, even if that means making an oversize segment.
+        names = list(self._state) + [property_name]
+        needed = sum(2 * _HEADER.size + len(name.encode('utf8')) for name in names)
+        needed += sum(len(value) for value in self._state.values()) + len(payload) + _HEADER.size
+        size = max(self.segment_bytes, needed)
+        self._path = _segment_path(self.directory, timestamp)
+        with self._path.open('x+b') as f: # never overwrite an existing segment
+            f.truncate(size)
+            self._mmap = mmap.mmap(f.fileno(), size)
+        self._offset = 0
+        self._name_ids = {}
+        self._record_count = 0
+        self._index = []
+        self._snapshots = []
+        self._write_snapshot(timestamp)
+
+    def _write_snapshot(self, timestamp):
+        """Write STATE records for every known property. Return False (having
+        written nothing) if there is not enough space left in the segment."""
+        needed = _HEADER.size + sum(_HEADER.size + len(value) for value in self._state.values())
+        needed += sum(_HEADER.size + len(name.encode('utf8')) for name in self._state if name not in self._name_ids)
+        if self._offset + needed > len(self._mmap):
+            return False
+        offset = self._offset
+        for name, value in self._state.items():
+            self._write_record(_STATE, timestamp, name, value)
+        self._snapshots.append((timestamp, offset))
+        self._since_snapshot = 0
+        return True
+
+    def _write_record(self, kind, timestamp, property_name, payload):
+        """Write a record (preceded by a NAME record, if the name is new to this
+        segment). Return False if there is not enough space left in the segment."""
+        name_id = self._name_ids.get(property_name)
+        needed = 2 * _HEADER.size + len(payload) # leave room for the end marker
+        if name_id is None:
+            encoded_name = property_name.encode('utf8')
+            needed += _HEADER.size + len(encoded_name)
+        if self._offset + needed > len(self._mmap):
+            return False
+        if name_id is None:
+            name_id = len(self._name_ids)
+            self._put(_NAME, timestamp, name_id, encoded_name)
+            self._name_ids[property_name] = name_id
+        if self._record_count % self.index_interval == 0:
+            self._index.append((timestamp, self._offset))
+        self._put(kind, timestamp, name_id, payload)
+        self._record_count += 1
+        return True
+
+    def _put(self, kind, timestamp, name_id, payload):
+        # Write the payload and header fields before the kind byte, so that a
+        # concurrent reader never sees a partially-written record as valid.
+        start = self._offset
+        end = start + _HEADER.size + len(payload)
+        self._mmap[start+_HEADER.size:end] = payload
+        self._mmap[start:start+_HEADER.size] = _HEADER.pack(_END, timestamp, name_id, len(payload))
+        self._mmap[start] = kind
+        self._offset = end
+
+    def _finish_segment(self):
+        # NB: don't truncate the file to its used length: any reader with the
+        # segment mapped would crash with SIGBUS when touching the cut-off pages.
+        self._mmap.flush()
+        self._mmap.close()
+        self._mmap = None
+        names = sorted(self._name_ids, key=self._name_ids.get)
+        self._path.with_suffix(_NAMES_SUFFIX).write_bytes(datafile.json_encode_compact_to_bytes(names))
+        numpy.array(self._snapshots, dtype=_INDEX_DTYPE).tofile(str(self._path.with_suffix(_SNAPSHOTS_SUFFIX)))
+        # write the index last, and atomically: its existence marks the segment as complete
+        index_path = self._path.with_suffix(_INDEX_SUFFIX)
+        temp_path = index_path.with_name(index_path.name + '.tmp')
+        numpy.array(self._index, dtype=_INDEX_DTYPE).tofile(str(temp_path))
+        temp_path.rename(index_path)
+
+
+class _Segment:
+    def __init__(self, path):
+        self.path = path
+        self.start_time = _segment_start_time(path)
+        index_path = path.with_suffix(_INDEX_SUFFIX)
+        self.complete = index_path.exists()
+        with path.open('rb') as f:
+            try:
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError: # zero-length file: segment is just being created
+                self.data = b''
+        if self.complete:
+            names = json.loads(path.with_suffix(_NAMES_SUFFIX).read_text())
+            self.names = dict(enumerate(names))
+            index = numpy.fromfile(str(index_path), dtype=_INDEX_DTYPE)
+            self.index_times = index['time'].tolist()
+            self.index_offsets = index['offset'].tolist()
+            snapshots_path = path.with_suffix(_SNAPSHOTS_SUFFIX)
+            if snapshots_path.exists():
+                snapshots = numpy.fromfile(str(snapshots_path), dtype=_INDEX_DTYPE)
+                self.snapshot_times = snapshots['time'].tolist()
+                self.snapshot_offsets = snapshots['offset'].tolist()
+            else: # only the snapshot at the start of the segment is known
+                self.snapshot_times = [self.start_time]
+                self.snapshot_offsets = [0]
+        else:
+            # segment is still being written: gather names and index every record.
+            self.names = {}
+            self.index_times = []
+            self.index_offsets = []
+            self.snapshot_times = []
+            self.snapshot_offsets = []
+            previous_kind = None
+            for kind, timestamp, name_id, start, end in self._headers(0):
+                if kind == _NAME:
+                    self.names[name_id] = bytes(self.data[start+_HEADER.size:end]).decode('utf8')
+                    continue
+                self.index_times.append(timestamp)
+                self.index_offsets.append(start)
+                if kind == _STATE and previous_kind != _STATE:
+                    self.snapshot_times.append(timestamp)
+                    self.snapshot_offsets.append(start)
+                previous_kind = kind
+
+    def _headers(self, offset):
+        data = self.data
+        size = len(data)
+        while offset + _HEADER.size <= size:
+            kind, timestamp, name_id, length = _HEADER.unpack_from(data, offset)
+            if kind == _END:
+                return
+            end = offset + _HEADER.size + length
+            yield kind, timestamp, name_id, offset, end
+            offset = end
+
+    def offset_before(self, t):
+        """Return the offset of an indexed record before time t (or of the
+        start of the segment), so that every record at time t follows it."""
+        i = bisect.bisect_left(self.index_times, t) - 1
+        return self.index_offsets[i] if i >= 0 else 0
+
+    def snapshot_before(self, t):
+        """Return the offset of the last snapshot at or before time t (or of
+        the start of the segment)."""
+        i = bisect.bisect_right(self.snapshot_times, t) - 1
+        return self.snapshot_offsets[i] if i >= 0 else 0
+
+    def records(self, offset=0):
+        """Yield (kind, timestamp, name_id, payload) starting at the given offset."""
+        for kind, timestamp, name_id, start, end in self._headers(offset):
+            yield kind, timestamp, name_id, self.data[start+_HEADER.size:end]
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+
+def _decode(payload):
+    return json.loads(bytes(payload).decode('utf8'))
+
+class PropertyJournalReader:
+    def __init__(self, directory):
+        """Read property journals written by PropertyJournal.
+
+        Example:
+            reader = PropertyJournalReader('/path/to/journal')
+            state = reader.state_at(time.time() - 3600) # all properties an hour ago
+            z_positions = reader.values_between('scope.stage.z', t1, t2)
+        """
+        self.directory = pathlib.Path(directory)
+        self._segments = {}
+
+    def _segment_paths(self):
+        return sorted(self.directory.glob('*'+_SEGMENT_SUFFIX))
+
+    def _get_segment(self, path):
+        segment = self._segments.get(path)
+        if segment is None or not segment.complete:
+            # (re-)open segments that may have had new records added
+            if segment is not None:
+                segment.close()
+            segment = _Segment(path)
+            self._segments[path] = segment
+        return segment
+
+    def time_range(self):
+        """Return the (start, end) times covered by the journal, or None if
+        the journal is empty."""
+        paths = self._segment_paths()
+        if not paths:
+            return None
+        last = self._get_segment(paths[-1])
+        end = last.start_time
+        for kind, timestamp, name_id, payload in last.records(last.offset_before(float('inf'))):
+            end = max(end, timestamp)
+        return _segment_start_time(paths[0]), end
+
+    def state_at(self, t):
+        """Return a dict mapping property names to their values as of time t."""
+        paths = self._segment_paths()
+        starts = [_segment_start_time(path) for path in paths]
+        i = bisect.bisect_right(starts, t) - 1
+        if i < 0:
+            return {}
+        segment = self._get_segment(paths[i])
+        state = {}
+        for kind, timestamp, name_id, payload in segment.records(segment.snapshot_before(t)):
+            if kind == _NAME:
+                continue
+            if timestamp > t:
+                break
+            state[segment.names[name_id]] = payload
+        return {name: _decode(payload) for name, payload in state.items()}
+
+    def values_between(self, property_name, t1, t2):
+        """Return a list of (timestamp, value) pairs for every update to the
+        named property in the time range [t1, t2]."""
+        paths = self._segment_paths()
+        starts = [_segment_start_time(path) for path in paths]
+        # records at time t1 may end the segment before any others that start
+        # in the same microsecond as t1 (segment names are in microseconds)
+        first = max(bisect.bisect_left(starts, int(t1 * 1e6) / 1e6) - 1, 0)
+        last = bisect.bisect_right(starts, t2)
+        values = []
+        for path in paths[first:last]:
+            segment = self._get_segment(path)
+            name_ids = [name_id for name_id, name in segment.names.items() if name == property_name]
+            if not name_ids:
+                continue
+            name_id = name_ids[0]
+            for kind, timestamp, record_id, payload in segment.records(segment.offset_before(t1)):
+                if timestamp > t2:
+                    break
+                if kind == _VALUE and record_id == name_id and timestamp >= t1:
+                    values.append((timestamp, _decode(payload)))
+        return values
+
+    def close(self):
+        for segment in self._segments.values():
+            segment.close()
+        self._segments.clear()
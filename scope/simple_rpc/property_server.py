@@ -1,11 +1,13 @@
 # This code is licensed under the MIT License (see LICENSE file for details)
 
 import zmq
+import copy
 import threading
 import queue
+import collections
+import time
 
-from zplib import datafile
-
+from . import property_encoding
 from ..util import logging
 logger = logging.get_logger(__name__)
 
@@ -35,21 +37,44 @@ class PropertyServer(threading.Thread):
             def x(self, value):
                 self._x = value
 
+    Updates that exactly repeat the most recently published value of a property
+    are dropped before they are queued. Properties whose updates are meaningful
+    as events (so that a repeated value must still be sent out) can be exempted
+    with set_event_property().
+
+    If a PropertyJournal instance is provided, every published update is also
+    appended to that journal, for post-hoc reconstruction of the property state.
     """
-    def __init__(self):
+    def __init__(self, journal=None):
         super().__init__(daemon=True)
+        self.journal = journal
         self.properties = {}
         self.task_queue = queue.Queue()
+        self._last_published = {}
+        self._update_lock = threading.Lock()
+        self.event_properties = set()
+        self.published_count = 0
+        self.suppressed_counts = collections.Counter()
         self.running = True
         self.start()
 
     def run(self):
-        while self.running:
-            try:
-                property_name, value = self.task_queue.get(timeout=0.5) # wake up if something in queue, or if it's time to check self.running
-                self._publish_update(property_name, value)
-            except queue.Empty:
-                pass
+        try:
+            while self.running:
+                try:
+                    property_name, value, timestamp, publish = self.task_queue.get(timeout=0.5) # wake up if something in queue, or if it's time to check self.running
+                    if publish:
+                        self._publish_update(property_name, value)
+                except queue.Empty:
+                    continue
+                if self.journal is not None and timestamp is not None:
+                    try:
+                        self.journal.append(timestamp, property_name, value)
+                    except:
+                        logger.log_exception('Could not write property journal:')
+        finally:
+            if self.journal is not None:
+                self.journal.close()
 
     def stop(self):
         self.running = False
@@ -60,21 +85,81 @@ class PropertyServer(threading.Thread):
         clients that have just connected and want to learn about the current
         state."""
         for property_name, value in self.properties.items():
-            self.task_queue.put((property_name, value))
+            # timestamp of None: don't re-journal values that are just being re-sent
+            self.task_queue.put((property_name, value, None, True))
 
-    def add_property(self, property_name, value):
+    def add_property(self, property_name, value, is_event=False):
         """Add a named property and provide an initial value.
-        Returns a callback to call when the property's value has changed."""
-        self.properties[property_name] = value
+        Returns a callback to call when the property's value has changed.
+        If is_event is True, every update is published, even if it repeats
+        the previous value. The initial value counts as the previous value
+        for the first update."""
+        published = _snapshot(value)
+        with self._update_lock:
+            self.properties[property_name] = value
+            if published is _UNCOPYABLE:
+                self._last_published.pop(property_name, None)
+            else:
+                self._last_published[property_name] = published
+        if is_event:
+            self.set_event_property(property_name)
+        if self.journal is not None:
+            # journal (but don't publish) the initial value, so that the journal
+            # knows the state of properties that are never updated
+            self.task_queue.put((property_name, value, time.time(), False))
         def change_callback(value):
             self.update_property(property_name, value)
         return change_callback
 
+    def set_event_property(self, property_name, is_event=True):
+        """Set whether every update to the named property should be published,
+        even if the new value is identical to the previous value."""
+        if is_event:
+            self.event_properties.add(property_name)
+        else:
+            self.event_properties.discard(property_name)
+
     def update_property(self, property_name, value):
-        """Inform the server that the property has a new value"""
-        self.properties[property_name] = value
-        logger.debug('updating property: {} to {}', property_name, value)
-        self.task_queue.put((property_name, value))
+        """Inform the server that the property has a new value. If the value
+        is identical to the last value published, and the property is not an
+        event property, the update is dropped.
+
+        A copy of any mutable value is taken, which is both published and kept
+        for comparison with the next update: otherwise, a list or dict that the
+        caller mutates in place and then passes again would always compare
+        equal to the "previous" value, which is the same object."""
+        published = _snapshot(value)
+        with self._update_lock:
+            if property_name not in self.event_properties and property_name in self._last_published:
+                if _is_duplicate(self._last_published[property_name], value):
+                    self.suppressed_counts[property_name] += 1
+                    return
+            self.properties[property_name] = value
+            if published is _UNCOPYABLE:
+                self._last_published.pop(property_name, None)
+                published = value
+            else:
+                self._last_published[property_name] = published
+            logger.debug('updating property: {} to {}', property_name, value)
+            self.published_count += 1
+            self.task_queue.put((property_name, published, time.time(), True))
+
+    def get_update_statistics(self):
+        """Return a dict describing how much property-update traffic was
+        published vs. suppressed as an exact duplicate of the previous value.
+        The 'suppressed_by_property' entry maps property names to the number of
+        updates suppressed for that property."""
+        suppressed = dict(self.suppressed_counts)
+        return dict(
+            published=self.published_count,
+            suppressed=sum(suppressed.values()),
+            suppressed_by_property=suppressed
+        )
+
+    def reset_update_statistics(self):
+        """Reset the counts reported by get_update_statistics()."""
+        self.published_count = 0
+        self.suppressed_counts.clear()
 
     def property_decorator(self, property_name):
         """Return a property decorator that will auto-update the named
@@ -90,17 +175,47 @@ class PropertyServer(threading.Thread):
     def _publish_update(self, property_name, value):
         raise NotImplementedError()
 
+_UNCOPYABLE = object()
+_IMMUTABLE_TYPES = (type(None), bool, int, float, complex, str, bytes)
+
+def _snapshot(value):
+    # most property values are numbers or strings, which can't be changed in
+    # place, so only copy anything else (lists, dicts, arrays...)
+    if isinstance(value, _IMMUTABLE_TYPES):
+        return value
+    try:
+        return copy.deepcopy(value)
+    except Exception:
+        return _UNCOPYABLE # such values are published, but never compared
+
+def _is_duplicate(old_value, new_value):
+    # require identical types so that e.g. an int 1 replacing a bool True,
+    # which compare equal, is still published.
+    if type(old_value) is not type(new_value):
+        return False
+    try:
+        return bool(old_value == new_value)
+    except Exception: # e.g. ambiguous truth value from comparing arrays
+        return False
+
 class ZMQServer(PropertyServer):
-    def __init__(self, port, context=None):
+    def __init__(self, port, context=None, journal=None, encoding=property_encoding.JSON):
         """PropertyServer subclass that uses ZeroMQ PUB/SUB to send out updates.
         Parameters:
             port: a string ZeroMQ port identifier, like 'tcp://127.0.0.1:5555'.
             context: a ZeroMQ context to share, if one already exists.
+            journal: a PropertyJournal to record all updates to, or None.
+            encoding: format in which to send property values (see
+                property_encoding.py). Only use the BINARY format if every
+                client is recent enough to decode it.
         """
+        if encoding not in property_encoding.FORMATS:
+            raise ValueError('Unknown property encoding format "{}"'.format(encoding))
+        self.encoding = encoding
         self.context = context if context is not None else zmq.Context()
         self.socket = self.context.socket(zmq.PUB)
         self.socket.bind(port)
-        super().__init__()
+        super().__init__(journal)
 
     def run(self):
         try:
@@ -109,7 +224,7 @@ class ZMQServer(PropertyServer):
             self.socket.close()
 
     def _publish_update(self, property_name, value):
-        # dump json first to catch "not serializable" errors before sending the first part of a two-part message
-        json = datafile.json_encode_compact_to_bytes(value)
+        # encode first to catch "not serializable" errors before sending the first part of a two-part message
+        encoded = property_encoding.encode(value, self.encoding)
         self.socket.send_string(property_name, flags=zmq.SNDMORE)
-        self.socket.send(json)
+        self.socket.send(encoded)
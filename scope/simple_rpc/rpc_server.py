@@ -109,6 +109,9 @@ class ZMQServerMixin:
             reply_type = 'error'
         elif isinstance(reply, (bytearray, bytes, memoryview)):
             reply_type = 'bindata'
+        elif inspect.isgenerator(reply):
+            self._reply_multipart(reply)
+            return
         else:
             reply_type = 'json'
 
@@ -121,6 +124,22 @@ class ZMQServerMixin:
         self.socket.send_string(reply_type, flags=zmq.SNDMORE)
         self.socket.send(reply) # TODO: profile to see if copy=False improves performance
 
+    def _reply_multipart(self, parts):
+        """Send each bytes-like object yielded by the parts generator as a part
+        of a single 'multipart' reply, as soon as it is produced. The reply
+        ends with a status part: empty if the generator finished normally, or
+        the formatted exception if it raised one partway through, which
+        clients must raise in place of the incomplete reply."""
+        self.socket.send_string('multipart', flags=zmq.SNDMORE)
+        status = b''
+        try:
+            for part in parts:
+                self.socket.send(part, flags=zmq.SNDMORE, copy=False)
+        except (Exception, KeyboardInterrupt) as e:
+            exception_str = ''.join(traceback.format_exception(type(e), e, e.__traceback__))
+            logger.debug('Exception caught producing multipart reply: {}', exception_str)
+            status = exception_str.encode('utf8')
+        self.socket.send(status)
 
 class BaseZMQServer(ZMQServerMixin, BaseRPCServer):
     def __init__(self, namespace, port, context=None):
@@ -0,0 +1,331 @@
+# This code is licensed under the MIT License (see LICENSE file for details)
+
+"""Push newly-acquired camera frames to remote clients as they are produced.
+
+Rather than learning of each new frame from a property update and then
+fetching it by name over RPC, a client may subscribe to have frames sent to it
+as soon as they are acquired, whether in live mode or during a sequence
+acquisition.
+
+Flow control is credit-based: each frame sent to a client uses up one credit,
+and the client grants a new credit after receiving each frame, so the number
+of frames in flight to a client never exceeds the number of credits it
+subscribed with. Frames acquired while a client has no credits are held in a
+short per-client queue; when that queue is full, the oldest frame is dropped
+(and counted), so a slow client only ever sees recent frames and never causes
+unbounded server-side queueing.
+
+Protocol: clients connect a DEALER socket to the server's ROUTER socket and
+send messages of the form [command, JSON argument]:
+    [b'subscribe', {credits, max_queued, compressor, compressor_args,
+        downsample, transform, packing}]: start (or re-start) a subscription,
+        with the given number of credits.
+    [b'credit', n]: grant n more credits.
+    [b'unsubscribe', null]: end the subscription.
+The server sends each frame as [b'frame', JSON header, *parts], where the header
+is a dict with keys frame_number, timestamp and dropped (the total number of
+frames dropped for this client so far), and the parts are as produced by
+transfer_ism_buffer._server_pack_many_data() for the single frame. If a client
+sends credits after its subscription has lapsed (see idle_timeout), the server
+replies [b'resubscribe', b'']. While waiting for frames, clients send a zero
+credit every KEEPALIVE_SEC, to keep their subscriptions from lapsing.
+"""
+
+import collections
+import json
+import os
+import threading
+import time
+
+import zmq
+
+from . import transfer_ism_buffer
+from . import logging
+logger = logging.get_logger(__name__)
+
+KEEPALIVE_SEC = 60
+
+_SUBSCRIPTION_KEYS = {'credits', 'max_queued', 'compressor', 'compressor_args', 'downsample', 'transform', 'packing'}
+
+class _Subscription:
+    def __init__(self, settings):
+        if not isinstance(settings, dict) or set(settings) != _SUBSCRIPTION_KEYS:
+            raise ValueError('Subscription settings must have exactly the keys {}'.format(sorted(_SUBSCRIPTION_KEYS)))
+        if not isinstance(settings['credits'], int) or not isinstance(settings['max_queued'], int):
+            raise ValueError('Subscription credits and max_queued must be integers')
+        if not isinstance(settings['compressor_args'], dict):
+            raise ValueError('Subscription compressor_args must be a dict')
+        self.credits = settings.pop('credits')
+        self.queue = collections.deque(maxlen=settings.pop('max_queued'))
+        self.settings = settings
+        self.settings_key = json.dumps(settings, sort_keys=True)
+        self.sent = 0
+        self.dropped = 0
+        self.last_contact = time.time()
+
+class FramePushServer(threading.Thread):
+    def __init__(self, address, context=None, idle_timeout=600, heartbeat_sec=3, daemon=True):
+        """Send frames passed to push_frame() to subscribed clients.
+
+        Parameters:
+            address: ZeroMQ address to bind, e.g. 'tcp://*:6005'
+            context: a ZeroMQ context to share, if one already exists.
+            idle_timeout: subscriptions are ended if the client has not been
+                heard from (or has disconnected) for this many seconds.
+            heartbeat_sec: heartbeat interval used to detect dead clients.
+        """
+        self.context = context if context is not None else zmq.Context()
+        self.address = address
+        self.idle_timeout = idle_timeout
+        self.heartbeat_sec = heartbeat_sec
+        self._subscriptions = {}
+        self._lock = threading.Lock()
+        # frames handed over from the camera, waiting to be queued for each client
+        self._incoming = collections.deque(maxlen=16)
+        self._incoming_dropped = 0
+        self._wake_read, self._wake_write = os.pipe()
+        os.set_blocking(self._wake_write, False)
+        self.ready = threading.Event()
+        super().__init__(name='FramePushServer', daemon=daemon)
+        self.start()
+        self.ready.wait()
+
+    def push_frame(self, array, timestamp, frame_number):
+        """Queue a new frame to be sent to subscribed clients. This is safe to
+        call from any thread, and returns immediately."""
+        if not self._subscriptions:
+            return
+        if len(self._incoming) == self._incoming.maxlen:
+            self._incoming_dropped += 1
+        self._incoming.append((array, timestamp, frame_number))
+        self._wake()
+
+    def _wake(self):
+        try:
+            os.write(self._wake_write, b'\0')
+        except BlockingIOError:
+            pass # the pipe is full, so the server thread will wake up anyway
+
+    def get_stats(self):
+        """Return a dict mapping client identities (as hex strings) to dicts of
+        their remaining credits, queued frames, and counts of frames sent and
+        dropped."""
+        with self._lock:
+            return {identity.hex(): dict(credits=sub.credits, queued=len(sub.queue), sent=sub.sent, dropped=sub.dropped)
+                for identity, sub in self._subscriptions.items()}
+
+    def stop(self):
+        self.running = False
+        self._wake()
+        self.join()
+
+    def run(self):
+        self.running = True
+        socket = self.context.socket(zmq.ROUTER)
+        socket.LINGER = 0
+        # raise an error on sending to a disconnected client, rather than silently dropping the frame
+        socket.ROUTER_MANDATORY = True
+        heartbeat_ms = self.heartbeat_sec * 1000
+        socket.HEARTBEAT_IVL = heartbeat_ms
+        socket.HEARTBEAT_TIMEOUT = heartbeat_ms * 2
+        socket.bind(self.address)
+        poller = zmq.Poller()
+        poller.register(socket, zmq.POLLIN)
+        poller.register(self._wake_read, zmq.POLLIN)
+        self.ready.set()
+        try:
+            while self.running:
+                for item, event in poller.poll(1000):
+                    if item is socket:
+                        self._handle_message(socket)
+                    else:
+                        os.read(self._wake_read, 4096)
+                        self._queue_incoming()
+                self._send_queued(socket)
+                self._expire_idle()
+        finally:
+            socket.close()
+            os.close(self._wake_read)
+            os.close(self._wake_write)
+
+    def _handle_message(self, socket):
+        parts = socket.recv_multipart()
+        try:
+            self._handle_command(socket, *parts)
+        except Exception:
+            # a bad message from one client must not stop frames going to the others
+            logger.log_exception('Dropping malformed frame push message from client:')
+
+    def _handle_command(self, socket, identity, command, argument):
+        argument = json.loads(argument.decode('utf8'))
+        with self._lock:
+            subscription = self._subscriptions.get(identity)
+            if command == b'subscribe':
+                subscription = self._subscriptions[identity] = _Subscription(argument)
+            elif command == b'unsubscribe':
+                self._subscriptions.pop(identity, None)
+                return
+            elif command == b'credit':
+                if not isinstance(argument, int):
+                    raise ValueError('Credit must be an integer, not {!r}'.format(argument))
+                if subscription is not None:
+                    subscription.credits += argument
+            else:
+                logger.warning('Unknown frame push command from client: {}', command)
+                return
+            if subscription is not None:
+                subscription.last_contact = time.time()
+        if subscription is None:
+            # the subscription has lapsed: ask the client to renew it
+            self._send(socket, identity, [b'resubscribe', b''])
+
+    def _queue_incoming(self):
+        with self._lock:
+            dropped, self._incoming_dropped = self._incoming_dropped, 0
+            for subscription in self._subscriptions.values():
+                subscription.dropped += dropped
+            while self._incoming:
+                frame = self._incoming.popleft()
+                for subscription in self._subscriptions.values():
+                    if len(subscription.queue) == subscription.queue.maxlen:
+                        subscription.dropped += 1
+                    subscription.queue.append(frame)
+
+    def _send_queued(self, socket):
+        # frames for clients with the same settings need only be packed once
+        packed = {}
+        with self._lock:
+            subscriptions = list(self._subscriptions.items())
+        for identity, subscription in subscriptions:
+            while subscription.credits > 0 and subscription.queue:
+                array, timestamp, frame_number = subscription.queue.popleft()
+                key = subscription.settings_key, frame_number
+                if key not in packed:
+                    packed[key] = self._pack(array, subscription.settings)
+                if packed[key] is None:
+                    subscription.dropped += 1
+                    continue
+                header = dict(frame_number=frame_number, timestamp=None if timestamp is None else int(timestamp),
+                    dropped=subscription.dropped)
+                if self._send(socket, identity, [b'frame', json.dumps(header).encode('ascii')] + packed[key]):
+                    subscription.credits -= 1
+                    subscription.sent += 1
+                else:
+                    subscription.dropped += 1
+                    if identity not in self._subscriptions:
+                        break
+
+    def _pack(self, array, settings):
+        settings = dict(settings)
+        compressor_args = settings.pop('compressor_args')
+        try:
+            return list(transfer_ism_buffer._pack_arrays([array], chunk_bytes=1<<20, **settings, **compressor_args))
+        except Exception:
+            logger.log_exception('Could not pack frame for pushing to client:')
+            return None
+
+    def _send(self, socket, identity, parts):
+        """Return whether the message was sent."""
+        try:
+            socket.send_multipart([identity] + parts, flags=zmq.NOBLOCK, copy=False)
+            return True
+        except zmq.Again:
+            # the client's receive queue is full, despite flow control
+            return False
+        except zmq.ZMQError as e:
+            if e.errno != zmq.EHOSTUNREACH:
+                raise
+            # the client has gone away
+            with self._lock:
+                self._subscriptions.pop(identity, None)
+            return False
+
+    def _expire_idle(self):
+        cutoff = time.time() - self.idle_timeout
+        with self._lock:
+            for identity, subscription in list(self._subscriptions.items()):
+                if subscription.last_contact < cutoff:
+                    del self._subscriptions[identity]
+
+
+class FramePushClient:
+    class Timeout(RuntimeError):
+        pass
+
+    def __init__(self, address, credits=2, max_queued=1, compressor='auto', downsample=None, transform=None,
+            packing=None, context=None, **compressor_args):
+        """Subscribe to frames pushed by a FramePushServer.
+
+        Parameters:
+            address: ZeroMQ address of the server, e.g. 'tcp://scope-host:6005'
+            credits: maximum number of frames that may be in flight to this
+                client at once. Two credits allow one frame to be sent while
+                the previous one is being processed.
+            max_queued: number of frames the server holds for this client while
+                it has no credits; older frames are dropped. Use 1 for live
+                viewing, where only the most recent frame matters.
+            compressor, downsample, compressor_args: as for
+                transfer_ism_buffer's set_network_compression(). The default
+                compressor, 'auto', uses blosc if it is installed, and
+                otherwise zlib.
+            transform: dict of crop, bin, display_range and gamma parameters
+                (see transfer_ism_buffer's set_transform()), or None.
+            packing: None, or 'mono12' to send 12-bit images packed.
+            context: a ZeroMQ context to share, if one already exists.
+
+        Attributes:
+            dropped: number of frames the server has dropped for this client.
+            received: number of frames received.
+        """
+        self.context = context if context is not None else zmq.Context()
+        self.address = address
+        if compressor == 'auto':
+            try:
+                import blosc
+                compressor, compressor_args = 'blosc', dict(cname='lz4')
+            except ImportError:
+                compressor, compressor_args = 'zlib', dict(level=2)
+        self.compressor = compressor
+        self._subscription = dict(credits=credits, max_queued=max_queued, compressor=compressor,
+            compressor_args=compressor_args, downsample=downsample, transform=transform, packing=packing)
+        self.dropped = 0
+        self.received = 0
+        self.socket = self.context.socket(zmq.DEALER)
+        self.socket.LINGER = 0
+        self.socket.connect(address)
+        self._send(b'subscribe', self._subscription)
+
+    def _send(self, command, argument):
+        self.socket.send_multipart([command, json.dumps(argument).encode('utf8')])
+
+    def get_frame(self, timeout=None):
+        """Return the next frame pushed by the server, as a tuple of (image,
+        timestamp, frame_number). If no frame arrives within the timeout (in
+        seconds), a Timeout is raised; if the timeout is None, wait forever."""
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            wait = KEEPALIVE_SEC if deadline is None else min(KEEPALIVE_SEC, max(0, deadline - time.time()))
+            if not self.socket.poll(int(1000 * wait)):
+                if deadline is not None and time.time() >= deadline:
+                    raise self.Timeout('No frame received in {} seconds.'.format(timeout))
+                self._send(b'credit', 0)
+                continue
+            command, *parts = self.socket.recv_multipart(copy=False)
+            if command.bytes == b'frame':
+                break
+            elif command.bytes == b'resubscribe':
+                self._send(b'subscribe', self._subscription)
+        # grant a new credit right away, so the next frame can be sent while this one is unpacked
+        self._send(b'credit', 1)
+        header = json.loads(parts[0].bytes.decode('ascii'))
+        image, = transfer_ism_buffer._client_unpack_many_data([part.buffer for part in parts[1:]], self.compressor)
+        self.dropped = header['dropped']
+        self.received += 1
+        return image, header['timestamp'], header['frame_number']
+
+    def close(self):
+        """End the subscription."""
+        try:
+            self._send(b'unsubscribe', None)
+        finally:
+            self.socket.close()
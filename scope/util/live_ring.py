@@ -0,0 +1,96 @@
+# This code is licensed under the MIT License (see LICENSE file for details)
+
+"""Shared-memory ring of live-mode frames, for zero-RPC local live viewing.
+
+The ring consists of two named ISM_Buffers: '<name>-frames', a Fortran-ordered
+array of shape (width, height, slots) holding the most recent frames, and
+'<name>-header', an array of uint64 values:
+    [slot count, frames written, then for each slot: sequence, frame number, timestamp]
+
+Each slot's sequence number acts as a seqlock: it is odd while the slot is
+being written and even once the write is complete, and it changes with every
+write. A reader notes the sequence number of the newest slot, copies the frame
+out, and then checks that the sequence number is unchanged (and even); if not,
+the frame was overwritten while being copied, and the read is retried.
+
+NB: this relies on aligned 8-byte stores being atomic, and on stores becoming
+visible to other processes in program order, as is the case on x86-64.
+"""
+
+import numpy
+
+import ism_buffer
+
+from . import transfer_ism_buffer
+
+_SLOTS, _WRITTEN = 0, 1
+_HEADER_FIELDS = 2
+_SLOT_FIELDS = 3
+_SEQUENCE, _FRAME_NUMBER, _TIMESTAMP = range(_SLOT_FIELDS)
+_NO_TIMESTAMP = 2**64 - 1
+
+def _slot_field(slot, field):
+    return _HEADER_FIELDS + slot * _SLOT_FIELDS + field
+
+class LiveRing:
+    def __init__(self, name, shape, dtype=numpy.uint16, slots=4):
+        """Create a ring of the given number of frame slots, with each frame
+        of the given shape and dtype."""
+        self.name = name
+        self.slots = slots
+        self.header = transfer_ism_buffer.create_array(name + '-header',
+            shape=(_HEADER_FIELDS + slots * _SLOT_FIELDS,), dtype=numpy.uint64, order='C')
+        self.header[:] = 0
+        self.frames = transfer_ism_buffer.create_array(name + '-frames',
+            shape=tuple(shape) + (slots,), dtype=dtype, order='Fortran')
+        self.header[_SLOTS] = slots
+        self._written = 0
+
+    def write(self, image, frame_number, timestamp):
+        """Copy an image into the next slot of the ring."""
+        slot = self._written % self.slots
+        sequence = _slot_field(slot, _SEQUENCE)
+        self.header[sequence] = 2 * self._written + 1 # odd: write in progress
+        self.frames[..., slot] = image
+        self.header[_slot_field(slot, _FRAME_NUMBER)] = frame_number
+        self.header[_slot_field(slot, _TIMESTAMP)] = _NO_TIMESTAMP if timestamp is None else timestamp
+        self.header[sequence] = 2 * self._written + 2 # even: write complete
+        self._written += 1
+        self.header[_WRITTEN] = self._written
+
+
+class LiveRingReader:
+    class Retry(RuntimeError):
+        pass
+
+    def __init__(self, name):
+        """Open the named LiveRing, which must have been created on the same
+        host."""
+        self.name = name
+        self.header = ism_buffer.open(name + '-header').asarray()
+        self.frames = ism_buffer.open(name + '-frames').asarray()
+        self.slots = int(self.header[_SLOTS])
+
+    def frames_written(self):
+        return int(self.header[_WRITTEN])
+
+    def read_latest(self, attempts=10):
+        """Return a copy of the newest complete frame in the ring, along with
+        its timestamp and frame number, or None if no frames have been written
+        yet. Raises LiveRingReader.Retry if the writer repeatedly overwrote the
+        frame while it was being copied."""
+        header = self.header
+        for _ in range(attempts):
+            written = int(header[_WRITTEN])
+            if written == 0:
+                return None
+            slot = (written - 1) % self.slots
+            sequence = int(header[_slot_field(slot, _SEQUENCE)])
+            if sequence % 2:
+                continue
+            image = self.frames[..., slot].copy(order='F')
+            frame_number = int(header[_slot_field(slot, _FRAME_NUMBER)])
+            timestamp = int(header[_slot_field(slot, _TIMESTAMP)])
+            if int(header[_slot_field(slot, _SEQUENCE)]) == sequence:
+                return image, None if timestamp == _NO_TIMESTAMP else timestamp, frame_number
+        raise self.Retry('Live frame was overwritten {} times while being read.'.format(attempts))
@@ -0,0 +1,67 @@
+# This code is licensed under the MIT License (see LICENSE file for details)
+
+"""Pack and unpack 12-bit pixel values, two pixels to three bytes.
+
+The layout is that of the Andor Mono12Packed pixel encoding: for consecutive
+pixels A and B, the bytes are
+    [A bits 11-4], [B bits 3-0 << 4 | A bits 3-0], [B bits 11-4]
+"""
+
+import numpy
+
+def packed_size(count):
+    """Return the number of bytes needed to pack count pixels."""
+    return (count + 1) // 2 * 3
+
+def pack(values):
+    """Pack a 1-d array of integers (all less than 4096) into a uint8 array."""
+    if len(values) % 2:
+        values = numpy.append(values, values.dtype.type(0))
+    pairs = values.reshape(-1, 2)
+    a = pairs[:, 0]
+    b = pairs[:, 1]
+    packed = numpy.empty((len(pairs), 3), dtype=numpy.uint8)
+    packed[:, 0] = a >> 4
+    packed[:, 1] = (a & 0xF) | ((b & 0xF) << 4)
+    packed[:, 2] = b >> 4
+    return packed.reshape(-1)
+
+def _unpack_pairs(triples, pairs):
+    """Unpack a (..., 3) uint8 array of byte triples into a (..., 2) uint16
+    array of pixel pairs."""
+    a = pairs[..., 0]
+    b = pairs[..., 1]
+    middle = triples[..., 1]
+    numpy.left_shift(triples[..., 0], 4, out=a, dtype=numpy.uint16)
+    a |= middle & 0xF
+    numpy.left_shift(triples[..., 2], 4, out=b, dtype=numpy.uint16)
+    b |= middle >> 4
+
+def unpack(packed, count, out=None):
+    """Unpack count pixels from a 1-d uint8 array into a 1-d uint16 array (out,
+    if provided, which must be a contiguous array of at least count elements)."""
+    triples = numpy.frombuffer(packed, dtype=numpy.uint8, count=packed_size(count)).reshape(-1, 3)
+    pairs = numpy.empty((len(triples), 2), dtype=numpy.uint16)
+    _unpack_pairs(triples, pairs)
+    values = pairs.reshape(-1)[:count]
+    if out is None:
+        return values
+    out[:count] = values
+    return out
+
+def unpack_rows(rows, width, out=None):
+    """Unpack a (height, stride) uint8 array, each row of which holds width
+    packed pixels (padded to an even number of pixels) and then possibly some
+    padding bytes, into a (height, width) uint16 array (out, if provided)."""
+    height = rows.shape[0]
+    triples = rows[:, :packed_size(width)].reshape(height, -1, 3)
+    if out is None:
+        out = numpy.empty((height, width), dtype=numpy.uint16)
+    if width % 2 == 0 and out.flags.c_contiguous:
+        # unpack straight into the output
+        _unpack_pairs(triples, out.reshape(height, -1, 2))
+    else:
+        pairs = numpy.empty(triples.shape[:2] + (2,), dtype=numpy.uint16)
+        _unpack_pairs(triples, pairs)
+        out[:] = pairs.reshape(height, -1)[:, :width]
+    return out
@@ -17,17 +17,26 @@ class PropertyDevice(state_stack.StateStackDevice):
 
     def _update_property(self, name, value):
         """If a non-None property_server was provided, update the named property
-        on the server to a given value."""
+        on the server to a given value. Updates that exactly repeat the previous
+        value are dropped by the server, unless the property was marked as an
+        event property with _set_event_property()."""
         if self._property_server:
             self._property_server.update_property(self._property_prefix+name, value)
 
-    def _add_property(self, name, initial_value):
+    def _add_property(self, name, initial_value, is_event=False):
         """Return a function that will update the named property with new values.
         The returned update function need only be called as update(new_value), as
         the property name is stored within the update function.
+        If is_event is True, repeated identical values will still be published.
         If no property server was provided, return a function that can be called
         but has no effect."""
         if self._property_server:
-            return self._property_server.add_property(self._property_prefix+name, initial_value)
+            return self._property_server.add_property(self._property_prefix+name, initial_value, is_event)
         else:
             return lambda value: None
+
+    def _set_event_property(self, name, is_event=True):
+        """Mark the named property as one where every update is meaningful, so
+        that updates are published even if they repeat the previous value."""
+        if self._property_server:
+            self._property_server.set_event_property(self._property_prefix+name, is_event)
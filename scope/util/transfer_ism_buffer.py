@@ -1,18 +1,34 @@
 # This code is licensed under the MIT License (see LICENSE file for details)
 
+import atexit
 import json
 import numpy
 import struct
 import zlib
 import platform
 import collections
+import concurrent.futures
+import functools
+import itertools
+import os
 import threading
+import time
+import weakref
 
 import ism_buffer
 
+from . import logging
+from . import packed12
+logger = logging.get_logger(__name__)
+
 _ism_buffer_registry = collections.defaultdict(list)
 _registry_lock = threading.Lock()
 
+# When an ISM_Buffer from the pool is re-used for a new image, the name used to
+# transfer that image is the buffer's name, followed by this separator and the
+# image's own unique name.
+_POOL_NAME_SEPARATOR = '#'
+
 def create_array(name, shape, dtype, order):
     """Create a numpy array view onto an ISM_Buffer shared memory region
     identified by the given name.
@@ -25,12 +41,197 @@ def create_array(name, shape, dtype, order):
     """
     return ism_buffer.new(name, shape, dtype, order).asarray()
 
-def register_array_for_transfer(name, array):
+class _PooledBuffer:
+    def __init__(self, name, key, array):
+        self.name = name
+        self.key = key
+        self.array = array
+        self.exports = 0 # registrations for transfer not yet consumed within this process
+
+class _ArrayHandle:
+    def __init__(self, array):
+        """Expose a pooled array through the array interface, so that the
+        array numpy makes from this object has it, rather than the pooled
+        array, as its base. Numpy collapses chains of views onto the first
+        base that is not an ndarray, so every view or slice of the handed-out
+        array then keeps the handed-out array itself alive."""
+        self.array = array
+        self.__array_interface__ = array.__array_interface__
+
+class ArrayPool:
+    def __init__(self, max_idle_per_shape=8, max_exported=64):
+        """Pool of ISM_Buffer-backed arrays that can be recycled for new images
+        of the same shape, avoiding the cost of creating, mapping, faulting-in
+        and later unlinking a new shared-memory region for every image.
+
+        Arrays returned from create_array() are views onto a pooled buffer.
+        When the view (and every view or slice taken from it) is no longer
+        referenced anywhere in this process, the buffer is returned to the
+        pool, unless the buffer may have been opened by another process (see
+        mark_exported()). Such buffers may still be in use elsewhere, so they
+        are set aside until every other process that opened the buffer reports
+        that it has closed it again (see unmark_exported()). Only the most
+        recent max_exported of these are kept: older ones (e.g. opened by
+        clients that never report closing them) are simply released and torn
+        down by the ISM_Buffer refcounting as usual.
+
+        Parameters:
+            max_idle_per_shape: maximum number of unused buffers of a given
+                shape, dtype, and order to keep around for re-use.
+            max_exported: maximum number of buffers no longer used in this
+                process to keep while waiting for other processes to close them.
+        """
+        self.max_idle_per_shape = max_idle_per_shape
+        self.max_exported = max_exported
+        self._idle = collections.defaultdict(list)
+        self._in_use = {}
+        self._exported = collections.OrderedDict() # buffers awaiting close reports, oldest first
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def create_array(self, name, shape, dtype, order):
+        """Return (transfer_name, array), where array is backed by a pooled
+        ISM_Buffer. If a new buffer was created, transfer_name is the given
+        name; otherwise the name of the re-used buffer is prepended, so that
+        the transfer name remains unique for each image."""
+        dtype = numpy.dtype(dtype)
+        key = tuple(shape), dtype.str, order
+        with self._lock:
+            idle = self._idle[key]
+            buffer = idle.pop() if idle else None
+            if buffer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if buffer is None:
+            buffer = _PooledBuffer(name, key, create_array(name, shape, dtype, order))
+            transfer_name = name
+        else:
+            transfer_name = buffer.name + _POOL_NAME_SEPARATOR + name
+        view = numpy.asarray(_ArrayHandle(buffer.array))
+        with self._lock:
+            self._in_use[buffer.name] = buffer
+        finalizer = weakref.finalize(view, self._recycle, buffer)
+        finalizer.atexit = False
+        return transfer_name, view
+
+    def mark_exported(self, transfer_name):
+        """Note that the named image has been registered for transfer, so that
+        another process may open its buffer. Unless the registration is later
+        consumed within this process (see unmark_exported()), the buffer will
+        not be recycled."""
+        with self._lock:
+            buffer = self._in_use.get(_segment_name(transfer_name))
+            if buffer is not None:
+                buffer.exports += 1
+
+    def unmark_exported(self, transfer_name):
+        """Note that a registration of the named image was consumed within this
+        process (e.g. the image was packed and sent over the network), so the
+        buffer was not opened by another process on its account; or that the
+        process that opened the buffer on its account has closed it again."""
+        name = _segment_name(transfer_name)
+        with self._lock:
+            buffer = self._in_use.get(name) or self._exported.get(name)
+            if buffer is None or buffer.exports == 0:
+                return
+            buffer.exports -= 1
+            if buffer.exports == 0 and name in self._exported:
+                del self._exported[name]
+                self._add_idle(buffer)
+
+    def _recycle(self, buffer):
+        with self._lock:
+            del self._in_use[buffer.name]
+            if buffer.exports == 0:
+                self._add_idle(buffer)
+            else:
+                self._exported[buffer.name] = buffer
+                if len(self._exported) > self.max_exported:
+                    self._exported.popitem(last=False)
+
+    def _add_idle(self, buffer):
+        # must be called with self._lock held
+        idle = self._idle[buffer.key]
+        if len(idle) < self.max_idle_per_shape:
+            idle.append(buffer)
+
+    def clear(self):
+        """Release all idle buffers."""
+        with self._lock:
+            self._idle.clear()
+
+    def get_stats(self):
+        """Return a dict with the pool's hit count and rate, the number and
+        total size of idle buffers, the number and total size of buffers
+        currently in use (the outstanding bytes), and the number of buffers
+        waiting for other processes to close them."""
+        with self._lock:
+            idle = [buffer for buffers in self._idle.values() for buffer in buffers]
+            in_use = list(self._in_use.values())
+            awaiting_close = len(self._exported)
+        requests = self.hits + self.misses
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            hit_rate=self.hits / requests if requests else 0,
+            idle_buffers=len(idle),
+            idle_bytes=sum(buffer.array.nbytes for buffer in idle),
+            outstanding_buffers=len(in_use),
+            outstanding_bytes=sum(buffer.array.nbytes for buffer in in_use),
+            awaiting_close_buffers=awaiting_close
+        )
+
+_pool = ArrayPool()
+
+def create_pooled_array(name, shape, dtype, order):
+    """Like create_array(), but use a recycled ISM_Buffer if one of the right
+    shape is available. Returns (transfer_name, array): transfer_name must be
+    used in place of name when registering the array for transfer."""
+    return _pool.create_array(name, shape, dtype, order)
+
+def get_pool_stats():
+    """Return statistics about the pool of recycled ISM_Buffers."""
+    return _pool.get_stats()
+
+def _segment_name(name):
+    """Return the name of the ISM_Buffer that backs the named image."""
+    return name.split(_POOL_NAME_SEPARATOR, 1)[0]
+
+class _Lease:
+    __slots__ = ('array', 'created', 'expires', 'client')
+    def __init__(self, array, lease_sec, client):
+        self.array = array
+        self.created = time.time()
+        self.expires = self.created + lease_sec
+        self.client = client
+
+# If a client doesn't release a registered array within this many seconds
+# (e.g. because it crashed), the array is released anyway.
+DEFAULT_LEASE_SEC = 120
+_SWEEP_INTERVAL = 5
+_next_sweep = 0
+_current_client = threading.local()
+_client_stats = collections.defaultdict(collections.Counter)
+
+def register_array_for_transfer(name, array, lease_sec=DEFAULT_LEASE_SEC):
     """Register a named, ISM_Buffer-backed array with the server that is going
     to be transfered to another process. Once the other process obtains the
     ISM_Buffer, it must call the appropriate get_data() function (provided by
     client_get_data_getter()), which will ensure that the _release_array()
-    function gets called."""
+    function gets called. If that does not happen within lease_sec seconds,
+    the array will be released anyway, so that a crashed client cannot pin
+    shared memory forever.
+
+    If the array came from create_pooled_array(), its buffer will not be
+    recycled unless the registration is consumed by release_array() within
+    this process, or a local client that opened the buffer reports that it has
+    closed it again: otherwise, a local client may have it open."""
+    global _next_sweep
+    client = getattr(_current_client, 'name', None)
+    lease = _Lease(array, lease_sec, client)
+    _pool.mark_exported(name)
     # A single image can get queued for transfer several times (i.e. if several
     # clients all want to grab the same live image). Appending it to a list
     # makes sure we can track the count of outgoing requests, so we don't free
@@ -40,42 +241,154 @@ def register_array_for_transfer(name, array):
     # thread; or this function and _release_array might get called simultaneously.
     # Thus we protect mutating access to the registry.
     with _registry_lock:
-        # the below is sufficiently atomic that simultaneous calls to this function
-        # won't cause a problem (the default will only get created once),
-        # but we don't want to be appending to an array that's simultaneously
-        # getting deleted by _release_array.
-        _ism_buffer_registry[name].append(array)
+        _ism_buffer_registry[name].append(lease)
+        _client_stats[client]['registered'] += 1
+    if lease.created > _next_sweep:
+        _next_sweep = lease.created + _SWEEP_INTERVAL
+        expire_leases()
+
+def expire_leases():
+    """Release all arrays whose leases have expired. Return the number released."""
+    now = time.time()
+    expired = []
+    with _registry_lock:
+        for name, leases in list(_ism_buffer_registry.items()):
+            live = [lease for lease in leases if lease.expires > now]
+            if len(live) < len(leases):
+                expired.extend((name, lease) for lease in leases if lease.expires <= now)
+                if live:
+                    leases[:] = live
+                else:
+                    del _ism_buffer_registry[name]
+        for name, lease in expired:
+            _client_stats[lease.client]['expired'] += 1
+    # NB: expired leases leave the arrays' buffers marked as exported (see
+    # register_array_for_transfer()): the client may still be using them, even
+    # if it never released them, so they are only recycled if it reports that
+    # it has closed them (see _server_release_arrays()).
+    if expired:
+        logger.warning('Released {} image buffers whose transfer leases expired (e.g. {})', len(expired), expired[0][0])
+    return len(expired)
+
+def _pop_lease(name):
+    with _registry_lock:
+        leases = _ism_buffer_registry.get(name)
+        if not leases:
+            raise KeyError('No image named "{}" is registered for transfer (its lease may have expired).'.format(name))
+        lease = leases.pop()
+        if not leases:
+            del _ism_buffer_registry[name]
+    return lease
 
 def release_array(name):
     """Remove the named, ISM_Buffer-backed array from the transfer registry,
     allowing it to be deallocated if nobody else on the server process is
-    retaining any references. Return the named array."""
-    arrays = _ism_buffer_registry[name]
-    array = arrays.pop()
+    retaining any references. Return the named array, which is to be used
+    within this process (e.g. packed for sending over the network)."""
+    lease = _pop_lease(name)
+    _pool.unmark_exported(name)
+    return lease.array
+
+def release_arrays(names):
+    """Release all the named arrays, as for release_array(), and return a list
+    of them. If any name is not registered, a KeyError is raised and none of
+    the arrays are released."""
     with _registry_lock:
-        # don't want another thread to register the same name after we here
-        # decide that arrays is empty, but before we delete it, so synchronize
-        # this section only.
-        if not arrays:
-            del _ism_buffer_registry[name]
-    return array
+        for name, count in collections.Counter(names).items():
+            if len(_ism_buffer_registry.get(name, ())) < count:
+                raise KeyError('No image named "{}" is registered for transfer (its lease may have expired).'.format(name))
+        leases = []
+        for name in names:
+            registered = _ism_buffer_registry[name]
+            leases.append(registered.pop())
+            if not registered:
+                del _ism_buffer_registry[name]
+    for name in names:
+        _pool.unmark_exported(name)
+    return [lease.array for lease in leases]
 
 def borrow_array(name):
     """Return the named array, while still keeping a reference in the registry
     for future transfer to a client."""
-    return _ism_buffer_registry[name][-1]
+    return _ism_buffer_registry[name][-1].array
 
-def _server_release_array(name):
+def get_transfer_stats():
+    """Return a dict describing the arrays currently registered for transfer:
+        outstanding: number of registrations not yet released
+        outstanding_bytes: total size of the distinct outstanding arrays
+        oldest_age, mean_age: ages, in seconds, of the outstanding registrations
+        clients: dict mapping client ids (or None for registrations not made on
+            behalf of an identified client) to counts of 'registered',
+            'released', 'expired', and currently 'outstanding' arrays.
+    """
+    now = time.time()
+    with _registry_lock:
+        leases = [lease for leases in _ism_buffer_registry.values() for lease in leases]
+        clients = {client: dict(counts) for client, counts in _client_stats.items()}
+    arrays = {id(lease.array): lease.array for lease in leases}
+    ages = [now - lease.created for lease in leases]
+    for lease in leases:
+        counts = clients.setdefault(lease.client, {})
+        counts['outstanding'] = counts.get('outstanding', 0) + 1
+    return dict(
+        outstanding=len(leases),
+        outstanding_bytes=sum(array.nbytes for array in arrays.values()),
+        oldest_age=max(ages, default=0),
+        mean_age=sum(ages) / len(ages) if ages else 0,
+        clients=clients
+    )
+
+def _server_release_array(name, client=None):
     """Remove the named, ISM_Buffer-backed array from the transfer registry,
     allowing it to be deallocated if nobody else on the server process is
     retaining any references. Does not return the named array, so this function
-    is safe to call over RPC (which does not know how to send numpy arrays)."""
-    release_array(name)
+    is safe to call over RPC (which does not know how to send numpy arrays).
+
+    This is called by local clients after they have opened the ISM_Buffer, so
+    the buffer remains marked as in use by another process (see
+    register_array_for_transfer()), and will not be recycled until the client
+    reports that it has closed it (see _server_release_arrays()). Names whose
+    leases have already expired are ignored."""
+    _server_release_arrays([name], client)
 
-def _server_pack_data(name, compressor='blosc', downsample=None, **compressor_args):
+def _server_release_arrays(names, client=None, closed=()):
+    """Release all the named arrays, as for _server_release_array(). The
+    closed parameter lists the names of images that the client had opened
+    (and released) and has since closed, so that their buffers may be
+    recycled (see ArrayPool.unmark_exported())."""
+    for name in closed:
+        _pool.unmark_exported(name)
+    released = 0
+    for name in names:
+        try:
+            _pop_lease(name)
+            released += 1
+        except KeyError:
+            logger.debug('Release of unregistered image "{}" requested by {}', name, client)
+    with _registry_lock:
+        _client_stats[client]['released'] += released
+
+def piggyback_release(function):
+    """Wrap a function to be served over RPC so that clients can release
+    arrays in the same call, by passing a list of names in the _release keyword
+    argument (and their client id in _client). Arrays registered for transfer
+    during the call are attributed to that client in get_transfer_stats()."""
+    @functools.wraps(function)
+    def wrapper(*args, _release=(), _client=None, **kwargs):
+        if _release:
+            _server_release_arrays(_release, _client)
+        _current_client.name = _client
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _current_client.name = None
+    return wrapper
+
+def _server_pack_data(name, compressor='blosc', downsample=None, transform=None, **compressor_args):
     """Pack the data in the named ISM_Buffer into bytes for transfer over
     the network (or other serialization).
     Downsample parameter: int / None. If not None, only return every nth pixel.
+    If transform is not None, it is applied first, as for _server_pack_data_chunked().
     Valid compressor values are:
       - None: pack raw image bytes
       - 'blosc': use the fast, modern BLOSC compression library
@@ -83,9 +396,20 @@ def _server_pack_data(name, compressor='blosc', downsample=None, **compressor_ar
     compressor_args are passed to zlib.compress() or blosc.compress() directly."""
 
     array = release_array(name) # get the array and release it from the list of to-be-transfered arrays
+    if transform:
+        array = _transform(array, **transform)
+    array, order = _prepare_for_packing(array, downsample)
+    descr = json.dumps((numpy.lib.format.dtype_to_descr(array.dtype), array.shape, order)).encode('ascii')
+    output = bytearray(struct.pack('<H', len(descr))) # put the len of the descr in a 2-byte uint16
+    output += descr
+    output += _compress(array, compressor, compressor_args)
+    return output
+
+def _prepare_for_packing(array, downsample):
+    """Downsample the array if requested, and make sure it is contiguous.
+    Return the array and its memory order ('C' or 'F')."""
     if downsample:
         array = array[::downsample, ::downsample]
-    dtype_str = numpy.lib.format.dtype_to_descr(array.dtype)
     if array.flags.f_contiguous:
         order = 'F'
     elif array.flags.c_contiguous:
@@ -93,24 +417,301 @@ def _server_pack_data(name, compressor='blosc', downsample=None, **compressor_ar
     else:
         array = numpy.asfortranarray(array)
         order = 'F'
-    descr = json.dumps((dtype_str, array.shape, order)).encode('ascii')
-    output = bytearray(struct.pack('<H', len(descr))) # put the len of the descr in a 2-byte uint16
-    output += descr
+    return array, order
+
+def _transform(array, crop=None, bin=None, display_range=None, gamma=1):
+    """Reduce an image for transfer, as specified by a transform dict:
+        crop: (x0, y0, x1, y1) rectangle to crop the image to, in array index
+            coordinates, or None.
+        bin: integer factor by which to mean-bin the image (rows and columns
+            left over that don't fill a bin are discarded), or None.
+        display_range: (min, max) values to scale to 0-255 for an 8-bit display
+            preview, or 'auto' to use the image's own min and max. If None, the
+            image retains its original dtype.
+        gamma: gamma to apply when scaling to 8 bits.
+    """
+    if crop is not None:
+        x0, y0, x1, y1 = crop
+        array = array[x0:x1, y0:y1]
+    if bin and bin > 1:
+        x, y = (size // bin for size in array.shape[:2])
+        array = array[:x*bin, :y*bin]
+        # sum each bin in a wider integer type, then round back to the original dtype
+        sum_dtype = numpy.uint32 if array.dtype.kind in 'bu' else None
+        summed = array.reshape((bin, x, bin, y), order='F').sum(axis=(0, 2), dtype=sum_dtype)
+        binned = (summed + bin**2 // 2) // bin**2 if sum_dtype else summed / bin**2
+        array = binned.astype(array.dtype, order='F')
+    if display_range is not None:
+        if display_range == 'auto':
+            low, high = int(array.min()), int(array.max())
+        else:
+            low, high = display_range
+        if array.dtype.kind in 'bu' and array.dtype.itemsize <= 2:
+            # a lookup table is much faster than arithmetic for 8- and 16-bit images
+            values = numpy.arange(2**(8*array.dtype.itemsize), dtype=numpy.float32)
+            array = _scale_to_uint8(values, low, high, gamma)[array]
+        else:
+            array = _scale_to_uint8(array.astype(numpy.float32), low, high, gamma)
+    return array
+
+def _binned_transform(transform, downsample):
+    """Return the transform dict with a downsampling factor folded into its
+    binning, so that clients downsample by mean-binning (rather than taking
+    every nth pixel, which aliases) whichever way an image is fetched."""
+    if not downsample:
+        return transform
+    transform = dict(transform or {})
+    transform['bin'] = downsample * (transform.get('bin') or 1)
+    return transform
+
+def _scale_to_uint8(values, low, high, gamma):
+    scaled = (values - low) / max(high - low, 1e-6)
+    numpy.clip(scaled, 0, 1, out=scaled)
+    if gamma != 1:
+        scaled **= gamma
+    return (scaled * 255 + 0.5).astype(numpy.uint8)
+
+def _compress(array, compressor, compressor_args):
+    """Compress a contiguous array, returning a bytes-like object."""
     if compressor is None:
-        output += memoryview(array.flatten(order=order))
+        return memoryview(array.reshape(-1, order='A'))
     elif compressor == 'zlib':
         has_level_arg = 'level' in compressor_args
         if len(compressor_args) - has_level_arg > 0:
             raise RuntimeError('"level" is the only valid valid zlib compression option.')
         zlib_compressor_args = [compressor_args['level']] if has_level_arg else []
-        output += zlib.compress(array.flatten(order=order), *zlib_compressor_args)
+        return zlib.compress(array.reshape(-1, order='A'), *zlib_compressor_args)
     elif compressor == 'blosc':
         import blosc
         # because blosc.compress can't handle a memoryview, we need to use blosc.compress_ptr
-        output += blosc.compress_ptr(array.ctypes.data, array.size, typesize=array.dtype.itemsize, **compressor_args)
+        return blosc.compress_ptr(array.ctypes.data, array.size, typesize=array.dtype.itemsize, **compressor_args)
     else:
         raise RuntimeError('un-recognized compressor')
-    return output
+
+def _decompress_into(buf, out, compressor):
+    """Decompress data produced by _compress() into the contiguous array out."""
+    if compressor == 'blosc':
+        import blosc
+        try:
+            blosc.decompress_ptr(buf, out.ctypes.data)
+        except TypeError: # older pyblosc can't handle memoryviews; see _client_unpack_data()
+            blosc.decompress_ptr(bytes(buf), out.ctypes.data)
+        return
+    if compressor is None:
+        data = buf
+    elif compressor == 'zlib':
+        data = zlib.decompress(buf)
+    else:
+        raise RuntimeError('un-recognized compressor')
+    out.reshape(-1, order='A')[:] = numpy.frombuffer(data, dtype=out.dtype)
+
+_executor = None
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count(),
+            thread_name_prefix='transfer_ism_buffer')
+    return _executor
+
+def _chunk_bounds(array, order, chunk_bytes):
+    """Return a list of (start, stop) bounds along the slowest-varying axis of
+    the array that divide it into contiguous chunks of about chunk_bytes each."""
+    axis = -1 if order == 'F' else 0
+    length = array.shape[axis] if array.ndim else 1
+    if length == 0:
+        return []
+    slice_bytes = max(array.nbytes // length, 1)
+    step = max(chunk_bytes // slice_bytes, 1)
+    return [(start, min(start + step, length)) for start in range(0, length, step)]
+
+def _chunk(array, order, bounds):
+    if array.ndim == 0:
+        return array
+    start, stop = bounds
+    return array[..., start:stop] if order == 'F' else array[start:stop]
+
+def _server_pack_data_chunked(name, compressor='blosc', downsample=None, chunk_bytes=1<<20, transform=None,
+        packing=None, **compressor_args):
+    """Pack the data in the named ISM_Buffer for transfer over the network in
+    several independently-compressed chunks, for use as a multipart RPC reply.
+
+    The array is split into contiguous chunks of about chunk_bytes along its
+    slowest-varying axis, and the chunks are compressed in parallel on a thread
+    pool. This function returns a generator that yields a JSON header first, and
+    then each compressed chunk in order as soon as its compression has finished,
+    so that sending the reply overlaps with compressing the rest of the chunks.
+    If transform is not None, it is a dict specifying a crop, binning, and/or
+    8-bit display scaling to apply before compression (see _transform()).
+    For packing, see _server_pack_many_data(). Other parameters are as for
+    _server_pack_data()."""
+    return _server_pack_many_data([name], compressor, downsample, chunk_bytes, transform, packing, **compressor_args)
+
+def _server_pack_many_data(names, compressor='blosc', downsample=None, chunk_bytes=1<<20, transform=None,
+        packing=None, **compressor_args):
+    """Pack the data in all the named ISM_Buffers, with the same compression
+    settings, for transfer in a single multipart RPC reply. Each array is
+    released from the transfer registry, so no further RPC call is needed to
+    release them. The reply consists of a JSON header describing every array
+    and its chunks, followed by all the compressed chunks of every array, in
+    order. If packing is 'mono12', uint16 images with no values above 4095 are
+    sent packed two pixels to three bytes (see packed12.py) before compression.
+    Other parameters are as for _server_pack_data_chunked()."""
+    arrays = release_arrays(names)
+    return _pack_arrays(arrays, compressor, downsample, chunk_bytes, transform, packing, **compressor_args)
+
+def _pack_arrays(arrays, compressor='blosc', downsample=None, chunk_bytes=1<<20, transform=None,
+        packing=None, **compressor_args):
+    """Return a generator of the parts produced by _server_pack_many_data(),
+    for the given arrays rather than named ISM_Buffers."""
+    descriptions, futures = _start_packing(arrays, compressor, downsample, chunk_bytes, transform, packing, compressor_args)
+    header = json.dumps(descriptions).encode('ascii')
+    def parts():
+        yield header
+        for future in futures:
+            yield future.result()
+    return parts()
+
+def _start_packing(arrays, compressor, downsample, chunk_bytes, transform, packing, compressor_args):
+    """Start compressing the chunks of the given arrays on the thread pool.
+    Return a list describing each array and its chunks, and a list of futures
+    for the compressed chunks of every array, in order."""
+    executor = _get_executor()
+    descriptions = []
+    futures = []
+    for array in arrays:
+        if transform:
+            array = _transform(array, **transform)
+        array, order = _prepare_for_packing(array, downsample)
+        encoding = None
+        data, data_order = array, order
+        if packing == 'mono12' and array.dtype == numpy.uint16 and array.size and array.max() < 4096:
+            encoding = packing
+            # chunk the packed data in whole triples of bytes, so that chunks can be unpacked independently
+            data = packed12.pack(array.reshape(-1, order=order)).reshape(-1, 3)
+            data_order = 'C'
+        bounds = _chunk_bounds(data, data_order, chunk_bytes)
+        descriptions.append((numpy.lib.format.dtype_to_descr(array.dtype), array.shape, order, bounds, encoding))
+        # submit the work now, so that compression starts even before the RPC server starts consuming the generator
+        futures.extend(executor.submit(_compress, _chunk(data, data_order, b), compressor, compressor_args) for b in bounds)
+    return descriptions, futures
+
+class _Stream:
+    __slots__ = ('futures', 'expires')
+    def __init__(self, futures):
+        self.futures = collections.deque(futures)
+        self.expires = time.time() + STREAM_TIMEOUT_SEC
+
+# If a client stops fetching the chunks of a stream (e.g. because it crashed)
+# for this many seconds, the stream is discarded.
+STREAM_TIMEOUT_SEC = 60
+_streams = {}
+_streams_lock = threading.Lock()
+# ids of recently-completed streams, for which further chunk requests get None
+_finished_streams = collections.deque(maxlen=256)
+
+def _server_start_stream(stream_id, names, compressor='blosc', downsample=None, chunk_bytes=1<<20, transform=None,
+        packing=None, **compressor_args):
+    """Start packing the named arrays as for _server_pack_many_data(), but
+    rather than sending every chunk in a single reply, return the list of
+    array descriptions from the header. The client then fetches each
+    compressed chunk in order with _server_next_chunk(stream_id), where
+    stream_id is a string chosen by the client to be unique.
+
+    ZeroMQ only delivers a multipart message once all of its parts have
+    arrived, so a client receiving a multipart reply cannot start on the first
+    chunk before the last has been received. Fetching the chunks one at a time
+    lets the client decompress each chunk while the next is being received.
+    As the client chooses the stream id, it can send the chunk requests along
+    with this call, without waiting for any replies (see rpc_client.ZMQPipeline)."""
+    arrays = release_arrays(names)
+    descriptions, futures = _start_packing(arrays, compressor, downsample, chunk_bytes, transform, packing, compressor_args)
+    now = time.time()
+    with _streams_lock:
+        for old_id, stream in list(_streams.items()):
+            if stream.expires <= now:
+                _discard_stream(old_id)
+        if futures:
+            _streams[stream_id] = _Stream(futures)
+        else:
+            _finished_streams.append(stream_id)
+    return descriptions
+
+def _discard_stream(stream_id):
+    # must be called with _streams_lock held
+    for future in _streams.pop(stream_id).futures:
+        future.cancel()
+
+def _server_next_chunk(stream_id):
+    """Return the next compressed chunk of a stream started with
+    _server_start_stream(), or None if all its chunks have been returned.
+    If compressing the chunk failed, the error is raised and the rest of the
+    stream is discarded."""
+    with _streams_lock:
+        stream = _streams.get(stream_id)
+        if stream is None:
+            if stream_id in _finished_streams:
+                return None
+            raise KeyError('No image stream with id {} (it may have timed out).'.format(stream_id))
+        future = stream.futures.popleft()
+        if stream.futures:
+            stream.expires = time.time() + STREAM_TIMEOUT_SEC
+        else:
+            del _streams[stream_id]
+            _finished_streams.append(stream_id)
+    try:
+        return future.result()
+    except:
+        with _streams_lock:
+            if stream_id in _streams:
+                _discard_stream(stream_id)
+        raise
+
+def _client_unpack_data_chunked(parts, compressor='blosc'):
+    """Unpack (on the client side) the parts produced by _server_pack_data_chunked(),
+    decompressing the chunks in parallel directly into the output array."""
+    array, = _client_unpack_many_data(parts, compressor)
+    return array
+
+def _decompress_packed12_into(buf, out, start, stop, compressor):
+    """Decompress a chunk of packed 12-bit data holding byte-triples start to
+    stop, and unpack it into the appropriate pixels of the flat array out."""
+    triples = numpy.empty((stop - start, 3), dtype=numpy.uint8)
+    _decompress_into(buf, triples, compressor)
+    pixels = out[2*start:2*stop]
+    packed12.unpack(triples.reshape(-1), len(pixels), out=pixels)
+
+def _client_unpack_many_data(parts, compressor='blosc'):
+    """Unpack (on the client side) the parts produced by _server_pack_many_data(),
+    decompressing the chunks in parallel directly into the output arrays.
+    Return a list of arrays."""
+    descriptions = json.loads(bytes(parts[0]).decode('ascii'))
+    if len(parts) != 1 + _chunk_count(descriptions):
+        raise RuntimeError('Incomplete image data received from server.')
+    return _unpack_chunks(descriptions, iter(parts[1:]), compressor)
+
+def _chunk_count(descriptions):
+    return sum(len(description[3]) for description in descriptions)
+
+def _unpack_chunks(descriptions, chunks, compressor):
+    """Decompress the chunks described by the header from _server_pack_many_data()
+    in parallel into new arrays, and return a list of the arrays. The chunks
+    are taken from the chunks iterator one at a time, and each is handed to the
+    thread pool before the next is requested."""
+    executor = _get_executor()
+    arrays = []
+    futures = []
+    for dtype, shape, order, bounds, encoding in descriptions:
+        array = numpy.empty(shape, dtype=dtype, order=order)
+        arrays.append(array)
+        if encoding == 'mono12':
+            flat = array.reshape(-1, order=order)
+            futures.extend(executor.submit(_decompress_packed12_into, next(chunks), flat, start, stop, compressor)
+                for start, stop in bounds)
+        else:
+            futures.extend(executor.submit(_decompress_into, next(chunks), _chunk(array, order, b), compressor) for b in bounds)
+    for future in futures:
+        future.result() # raise any exceptions
+    return arrays
 
 def _client_unpack_data(buf, compressor='blosc'):
     """Unpack (on the client side) data packed (on the server side) by _server_pack_data().
@@ -137,21 +738,362 @@ def _client_unpack_data(buf, compressor='blosc'):
             # to a temporary intermediate buffer
             data = blosc.decompress(bytes(array_buf))
     array = numpy.ndarray(shape, dtype=dtype, order=order, buffer=data)
-    array.flags.writeable = True
+    try:
+        array.flags.writeable = True
+    except ValueError:
+        # newer numpy versions refuse to make arrays backed by immutable bytes writeable
+        array = array.copy(order='A')
     return array
 
+class _DeltaState:
+    def __init__(self, reference):
+        self.reference = reference
+        self.sequence = 0
+        self.since_keyframe = 0
+        self.last_used = time.time()
+
+# map client ids to the state of their tile-delta live streams
+_delta_states = {}
+_delta_lock = threading.Lock()
+MAX_DELTA_CLIENTS = 8
+
+def _tile_starts(shape, tile_size):
+    return [list(range(0, size, tile_size)) for size in shape[:2]]
+
+def _tile_slices(shape, tile_size, tiles):
+    """Yield the (x, y) slices of the given (i, j) tiles."""
+    for i, j in tiles:
+        x0, y0 = i * tile_size, j * tile_size
+        yield slice(x0, min(x0 + tile_size, shape[0])), slice(y0, min(y0 + tile_size, shape[1]))
+
+def _server_pack_live_delta(name, client, sequence, compressor='blosc', chunk_bytes=1<<20, transform=None,
+        tile_size=64, threshold=0, keyframe_interval=50, **compressor_args):
+    """Pack the named live image for a client that already holds the previous
+    frame sent to it, sending only the tiles that have changed.
+
+    The image is divided into tile_size x tile_size tiles, and only tiles in
+    which some pixel differs by more than threshold from the frame as last
+    reconstructed by the client are sent. (Thus the client's image never
+    differs from the true image by more than threshold.) Every
+    keyframe_interval frames, or if the client's sequence number shows it is
+    not in sync with the server (e.g. a new client, or a lost reply), the
+    whole frame is sent. The reply is as for _server_pack_many_data(), except
+    that the header also gives the tiling, and the compressed data are the
+    changed tiles, concatenated.
+    """
+    array = release_array(name)
+    if transform:
+        array = _transform(array, **transform)
+    with _delta_lock:
+        state = _delta_states.get(client)
+    keyframe = (state is None or state.sequence != sequence or state.since_keyframe >= keyframe_interval
+        or state.reference.shape != array.shape or state.reference.dtype != array.dtype)
+    xs, ys = _tile_starts(array.shape, tile_size)
+    if keyframe:
+        state = _DeltaState(numpy.array(array, order='F'))
+        tiles = [(i, j) for i in range(len(xs)) for j in range(len(ys))]
+    else:
+        state.since_keyframe += 1
+        diff = numpy.abs(array.astype(numpy.int32) - state.reference)
+        tile_max = numpy.maximum.reduceat(numpy.maximum.reduceat(diff, xs, axis=0), ys, axis=1)
+        tiles = numpy.argwhere(tile_max > threshold).tolist()
+        for xslice, yslice in _tile_slices(array.shape, tile_size, tiles):
+            state.reference[xslice, yslice] = array[xslice, yslice]
+    state.sequence += 1
+    state.last_used = time.time()
+    with _delta_lock:
+        _delta_states[client] = state
+        if len(_delta_states) > MAX_DELTA_CLIENTS:
+            stalest = min(_delta_states, key=lambda c: _delta_states[c].last_used)
+            del _delta_states[stalest]
+    if tiles:
+        data = numpy.concatenate([array[xslice, yslice].ravel(order='F')
+            for xslice, yslice in _tile_slices(array.shape, tile_size, tiles)])
+    else:
+        data = numpy.empty(0, dtype=array.dtype)
+    bounds = _chunk_bounds(data, 'C', chunk_bytes)
+    executor = _get_executor()
+    futures = [executor.submit(_compress, _chunk(data, 'C', b), compressor, compressor_args) for b in bounds]
+    header = dict(dtype=numpy.lib.format.dtype_to_descr(array.dtype), shape=array.shape, tile_size=tile_size,
+        keyframe=keyframe, sequence=state.sequence, tiles=tiles, bounds=bounds)
+    def parts():
+        yield json.dumps(header).encode('ascii')
+        for future in futures:
+            yield future.result()
+    return parts()
+
+class _DeltaDecoder:
+    def __init__(self):
+        """Reconstruct full frames on the client from the replies of
+        _server_pack_live_delta()."""
+        self.image = None
+        self.sequence = 0
+        # identify this stream uniquely, even if a process has several
+        self.client_id = '{}/{}'.format(CLIENT_ID, id(self))
+
+    def decode(self, parts, compressor):
+        header = json.loads(bytes(parts[0]).decode('ascii'))
+        bounds = header['bounds']
+        if len(parts) != len(bounds) + 1:
+            self.sequence = 0 # force a keyframe next time
+            raise RuntimeError('Incomplete image data received from server.')
+        dtype = numpy.dtype(header['dtype'])
+        shape = tuple(header['shape'])
+        data = numpy.empty(sum(stop - start for start, stop in bounds), dtype=dtype)
+        futures = [_get_executor().submit(_decompress_into, part, _chunk(data, 'C', b), compressor)
+            for part, b in zip(parts[1:], bounds)]
+        for future in futures:
+            future.result()
+        if header['keyframe']:
+            self.image = numpy.empty(shape, dtype=dtype, order='F')
+        offset = 0
+        for xslice, yslice in _tile_slices(shape, header['tile_size'], header['tiles']):
+            tile = self.image[xslice, yslice]
+            tile[:] = data[offset:offset+tile.size].reshape(tile.shape, order='F')
+            offset += tile.size
+        self.sequence = header['sequence']
+        # return a copy, since the next delta will be applied to self.image in place
+        return self.image.copy(order='F')
+
+class AdaptiveCompression:
+    def __init__(self, target_fps=10, max_bytes_per_sec=None, settle_time=2, memory_time=30, smoothing=0.3):
+        """Choose compression and downsampling for remote live viewing, so as to
+        meet a target display rate within an optional bandwidth budget.
+
+        The available settings are arranged in a ladder, from sending raw
+        full-resolution images (most bytes, least CPU) to heavily compressed
+        and downsampled images (fewest bytes). After each transfer, update()
+        is called with the time taken and bytes received. If the transfers are
+        too slow for the target rate, or use too much bandwidth, the next step
+        up the ladder is chosen. If there is plenty of headroom, the next step
+        down is chosen, unless that setting was recently found to be too slow.
+
+        Parameters:
+            target_fps: desired display frame rate.
+            max_bytes_per_sec: bandwidth budget at the target frame rate, or
+                None for no limit.
+            settle_time: minimum seconds between changes of setting.
+            memory_time: how long, in seconds, to avoid returning to a setting
+                that was found to be too slow or too large.
+            smoothing: weight of each new measurement in the running averages.
+        """
+        self.target_fps = target_fps
+        self.max_bytes_per_sec = max_bytes_per_sec
+        self.settle_time = settle_time
+        self.memory_time = memory_time
+        self.smoothing = smoothing
+        self.levels = self._make_levels()
+        self.level = 1 # start with fast compression, but no downsampling
+        self._rejected = {} # map levels to the time they were last found wanting
+        self._last_call = None
+        self.frame_interval = None
+        self._reset()
+
+    @staticmethod
+    def _make_levels():
+        try:
+            import blosc
+            fast = 'blosc', dict(cname='lz4', clevel=5)
+            strong = 'blosc', dict(cname='zstd', clevel=3)
+        except ImportError:
+            fast = 'zlib', dict(level=1)
+            strong = 'zlib', dict(level=6)
+        levels = [(None, {}, None), fast + (None,), strong + (None,)]
+        for downsample in (2, 3, 4, 6):
+            levels += [fast + (downsample,), strong + (downsample,)]
+        return levels
+
+    def _reset(self):
+        self.transfer_time = None
+        self.bytes_per_frame = None
+        self._level_start = time.time()
+
+    def settings(self):
+        """Return the current (compressor, compressor_args, downsample) choice."""
+        return self.levels[self.level]
+
+    def _average(self, old, new):
+        return new if old is None else old + self.smoothing * (new - old)
+
+    def update(self, transfer_time, nbytes):
+        """Record the time taken for a transfer and the number of bytes sent,
+        and choose new settings if required."""
+        now = time.time()
+        if self._last_call is not None:
+            self.frame_interval = self._average(self.frame_interval, now - self._last_call)
+        self._last_call = now
+        self.transfer_time = self._average(self.transfer_time, transfer_time)
+        self.bytes_per_frame = self._average(self.bytes_per_frame, nbytes)
+        if now - self._level_start < self.settle_time:
+            return
+        frame_budget = 1 / self.target_fps
+        bytes_per_sec = self.bytes_per_frame * self.target_fps
+        too_slow = self.transfer_time > frame_budget
+        too_big = self.max_bytes_per_sec is not None and bytes_per_sec > self.max_bytes_per_sec
+        if too_slow or too_big:
+            self._rejected[self.level] = now
+            if self.level < len(self.levels) - 1:
+                self.level += 1
+                self._reset()
+        elif self.level > 0:
+            headroom = self.transfer_time < frame_budget / 2
+            if self.max_bytes_per_sec is not None:
+                headroom = headroom and bytes_per_sec < self.max_bytes_per_sec / 2
+            if headroom and now - self._rejected.get(self.level - 1, 0) > self.memory_time:
+                self.level -= 1
+                self._reset()
+
+    def get_state(self):
+        """Return a dict describing the current settings and measurements."""
+        compressor, compressor_args, downsample = self.settings()
+        return dict(
+            compressor=compressor,
+            compressor_args=compressor_args,
+            downsample=downsample,
+            transfer_time=self.transfer_time,
+            frame_interval=self.frame_interval,
+            bytes_per_sec=None if self.bytes_per_frame is None or not self.frame_interval else self.bytes_per_frame / self.frame_interval
+        )
+
+    def describe(self):
+        """Return a short human-readable description of the current state."""
+        state = self.get_state()
+        compressor = state['compressor'] or 'raw'
+        if state['compressor_args']:
+            compressor += ' ' + ','.join(str(v) for v in state['compressor_args'].values())
+        description = '{}, downsample {}'.format(compressor, state['downsample'] or 1)
+        if state['frame_interval']:
+            description += ', {:.1f} fps'.format(1 / state['frame_interval'])
+        if state['bytes_per_sec'] is not None:
+            description += ', {:.1f} MB/s'.format(state['bytes_per_sec'] / 1e6)
+        return description
+
 def _server_get_node():
     return platform.node()
 
+def _server_get_pool_stats():
+    """Return get_pool_stats() for the server process."""
+    return get_pool_stats()
+
+CLIENT_ID = '{}:{}'.format(platform.node(), os.getpid())
+
+class _ReleaseBatcher:
+    def __init__(self, rpc_client, batch_size=8, max_delay=1):
+        """Collect the names of arrays that a local client has opened, and
+        release them on the server in batches: either explicitly via flush(),
+        once batch_size names are pending or max_delay seconds after the
+        oldest was added (whether or not the client makes any further calls),
+        or by passing the names returned by take() along with another RPC call
+        to a function wrapped with piggyback_release(). Anything still pending
+        is released by close(), or at interpreter exit.
+
+        The names of opened images that have since been closed are passed to
+        add_closed(), and reported to the server by the next flush() (at the
+        latest once batch_size are pending), so that it may recycle their
+        buffers.
+
+        As releases may be sent from a timer thread, they are sent over a
+        separate connection to the server at rpc_client.rpc_addr, rather than
+        through rpc_client, which must not be used from several threads."""
+        self.rpc_client = rpc_client
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.pending = []
+        # add_closed() is called from finalizers, which may run in the middle of
+        # any code in any thread, so it must not take locks: deque appends and
+        # pops are atomic.
+        self.closed = collections.deque()
+        self.lock = threading.Lock()
+        self._timer = None
+        self._release_client = None
+        self._release_lock = threading.Lock()
+        _release_batchers.add(self)
+
+    def add(self, names):
+        with self.lock:
+            self.pending.extend(names)
+            # closed names are only sent by flush(), so make sure it happens
+            # even if take() is used to send all the releases
+            flush = len(self.pending) >= self.batch_size or len(self.closed) >= self.batch_size
+            if not flush and self._timer is None:
+                self._timer = threading.Timer(self.max_delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if flush:
+            self.flush()
+
+    def add_closed(self, name):
+        """Note that the named image, having been opened, is now closed."""
+        self.closed.append(name)
+
+    def _take_closed(self):
+        closed = []
+        while self.closed:
+            closed.append(self.closed.popleft())
+        return closed
+
+    def take(self):
+        """Return the list of names pending release, which the caller is
+        responsible for releasing."""
+        with self.lock:
+            names = self.pending
+            self.pending = []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        return names
+
+    def flush(self):
+        """Release all pending names on the server, and report the names
+        of images closed since the last flush."""
+        names = self.take()
+        closed = self._take_closed()
+        if not names and not closed:
+            return
+        with self._release_lock:
+            if self._release_client is None:
+                from ..simple_rpc import rpc_client
+                self._release_client = rpc_client.ZMQClient(self.rpc_client.rpc_addr, context=self.rpc_client.context)
+            try:
+                self._release_client('_transfer_ism_buffer._server_release_arrays', names, CLIENT_ID, closed)
+            except Exception:
+                # the server will release the arrays anyway when their leases expire
+                logger.log_exception('Could not release {} images on the server:'.format(len(names)))
+
+    def close(self):
+        """Release all pending names, and close the connection used to do so."""
+        self.flush()
+        with self._release_lock:
+            if self._release_client is not None:
+                self._release_client.socket.close()
+                self._release_client = None
+
+_release_batchers = weakref.WeakSet()
+
+@atexit.register
+def _flush_release_batchers():
+    for batcher in list(_release_batchers):
+        batcher.close()
+
 def client_get_data_getter(rpc_client, force_remote=False):
     """Return a callable, get_data(), which given an ISM_Buffer name, returns
     a numpy array containing the data from that buffer. If the server and client
     are on the same host (as determined by comparing platform.node() on both),
     then get_data() will give an array that is a view onto the ISM_Buffer. This
     is a fast, zero-copy operation. If the server and client are on different
-    hosts, then the data will be packed and serialized over RPC. In this case,
-    get_data() will have a method, 'set_network_compression()' to allow the
-    amount of compression applied to the packed data to be tuned."""
+    hosts, then the data will be packed and serialized over RPC, with the
+    requests pipelined so that each fetch costs about one network round trip.
+    In either case, get_data.get_many() takes a list of names and returns a
+    list of arrays, and get_data.get_live() is used to retrieve live-view
+    images. Local clients release images on the server in batches:
+    names from get_data.take_pending_releases() should be passed along with the
+    next call to a function wrapped with piggyback_release(), and any others
+    will be released in a single RPC call when enough are pending (or when
+    get_data.flush_releases() or get_data.close() is called, or shortly after the
+    last image is opened). In the remote case, get_data() will have a method,
+    'set_network_compression()' to allow the amount of compression applied to
+    the packed data to be tuned, and 'set_adaptive_compression()' to let the
+    compression of live-view images adapt to the network link."""
 
     if force_remote:
         is_local = False
@@ -159,14 +1101,44 @@ def client_get_data_getter(rpc_client, force_remote=False):
         is_local = rpc_client('_transfer_ism_buffer._server_get_node') == platform.node()
 
     if is_local: # on same machine -- use ISM buffer directly
+        releaser = _ReleaseBatcher(rpc_client)
+        def open_array(name):
+            # As for ArrayPool.create_array(), hand out the array through an
+            # _ArrayHandle, so that it and all its views share a single base
+            # array: once that is gone, the buffer is no longer mapped here,
+            # and the server may recycle it.
+            array = numpy.asarray(_ArrayHandle(ism_buffer.open(_segment_name(name)).asarray()))
+            finalizer = weakref.finalize(array, releaser.add_closed, name)
+            finalizer.atexit = False
+            return array
         def get_data(name):
-            array = ism_buffer.open(name).asarray()
-            rpc_client('_transfer_ism_buffer._server_release_array', name)
+            array = open_array(name)
+            releaser.add([name])
             return array
+        def get_many(names):
+            """Return a list of arrays for the named ISM_Buffers."""
+            arrays = [open_array(name) for name in names]
+            releaser.add(names)
+            return arrays
+        get_data.get_many = get_many
+        get_data.get_live = get_data
+        get_data.take_pending_releases = releaser.take
+        get_data.flush_releases = releaser.flush
+        get_data.close = releaser.close
+        get_data.get_pool_stats = lambda: rpc_client('_transfer_ism_buffer._server_get_pool_stats')
     else: # pipe data over network
         class GetData:
             def __init__(self):
                 self.downsample = None
+                self.chunk_bytes = 1<<20
+                self.pipeline_depth = 4
+                self._pipeline = None
+                self._stream_prefix = '{}/{}'.format(CLIENT_ID, id(self))
+                self._stream_count = itertools.count()
+                self.transform = None
+                self.packing = None
+                self.adaptive = None
+                self.delta = None
                 self.compressor_args = {}
                 try:
                     import blosc
@@ -185,14 +1157,173 @@ def client_get_data_getter(rpc_client, force_remote=False):
                       - None: pack raw image bytes
                       - 'blosc': use the fast, modern BLOSC compression library
                       - 'zlib': use older, more widely supported zlib compression
-                    downsample: int / None. If not None, return every nth pixel.
+                    downsample: int / None. If not None, mean-bin images by this
+                        factor (in addition to any binning from set_transform()).
                     compressor_args: passed to zlib.compress() or blosc.compress() directly."""
                 self.compressor = compressor
                 self.compressor_args = compressor_args
                 self.downsample = downsample
+                self.adaptive = None
+
+            def set_packed12(self, enabled=True):
+                """If enabled, images with no values above 4095 (e.g. from the
+                camera in 11- or 12-bit mode) are sent packed two pixels to
+                three bytes before compression, and unpacked on receipt."""
+                self.packing = 'mono12' if enabled else None
+
+            def set_transform(self, crop=None, bin=None, display_range=None, gamma=1):
+                """Reduce images on the server before they are compressed and
+                sent over the network.
+
+                Parameters:
+                    crop: (x0, y0, x1, y1) rectangle to crop images to, or None.
+                    bin: integer factor by which to mean-bin images, or None.
+                    display_range: (min, max) values to scale to 0-255 to send
+                        an 8-bit display preview, 'auto' to scale each image's
+                        own min and max to 0-255, or None to send images with
+                        their original bit depth.
+                    gamma: gamma to apply when scaling to 8 bits.
+                If all parameters are left at their defaults, images are sent
+                unmodified."""
+                transform = dict(crop=crop, bin=bin, display_range=display_range, gamma=gamma)
+                if crop is None and bin is None and display_range is None:
+                    transform = None
+                self.transform = transform
+
+            def set_adaptive_compression(self, target_fps=10, max_bytes_per_sec=None):
+                """Automatically choose the compression and downsampling for
+                images retrieved with get_live(), based on measured transfer
+                times, to meet the target display rate within the given
+                bandwidth budget (if any). The current choices are available
+                from the 'adaptive' attribute (see AdaptiveCompression).
+                Calling set_network_compression() disables the adaptation."""
+                self.adaptive = AdaptiveCompression(target_fps, max_bytes_per_sec)
+
+            def set_live_delta(self, tile_size=64, threshold=0, keyframe_interval=50):
+                """Send live-view images retrieved with get_live() as the tiles
+                that changed since the previous live image, rather than as
+                full frames.
+
+                Parameters:
+                    tile_size: width and height of the tiles, in pixels.
+                    threshold: tiles are only sent if some pixel has changed
+                        by more than this amount. Live images will thus differ
+                        from the true image by at most this amount.
+                    keyframe_interval: send the full frame every this many frames.
+                Call with tile_size=None to send full frames again."""
+                if tile_size is None:
+                    self.delta = None
+                else:
+                    self.delta = dict(tile_size=tile_size, threshold=threshold, keyframe_interval=keyframe_interval)
+                    self._delta_decoder = _DeltaDecoder()
+
+            def get_live(self, name):
+                """Retrieve a live-view image, using the adaptively-chosen
+                compression settings if set_adaptive_compression() has been
+                called, or the fixed settings otherwise, and sending only the
+                changes from the previous live image if set_live_delta() has
+                been called."""
+                if self.adaptive is None and self.delta is None:
+                    return self(name)
+                transform = self.transform
+                if self.adaptive is None:
+                    compressor, compressor_args, downsample = self.compressor, self.compressor_args, self.downsample
+                else:
+                    compressor, compressor_args, downsample = self.adaptive.settings()
+                transform = _binned_transform(transform, downsample)
+                t0 = time.perf_counter()
+                if self.delta is None:
+                    (array,), nbytes = self._fetch([name], compressor, transform, compressor_args)
+                else:
+                    decoder = self._delta_decoder
+                    kws = dict(self.delta, **compressor_args)
+                    parts = rpc_client('_transfer_ism_buffer._server_pack_live_delta', name, decoder.client_id,
+                        decoder.sequence, compressor, self.chunk_bytes, transform, **kws)
+                    array = decoder.decode(parts, compressor)
+                    nbytes = sum(len(part) for part in parts)
+                if self.adaptive is not None:
+                    self.adaptive.update(time.perf_counter() - t0, nbytes)
+                return array
+
+            def _fetch(self, names, compressor, transform, compressor_args):
+                """Stream the named images from the server, decompressing each
+                chunk while the next is received. Return the list of arrays
+                and the number of compressed bytes received.
+
+                The request to start the stream and the requests for its
+                chunks are pipelined, with up to pipeline_depth chunk requests
+                outstanding at once, so that the whole transfer costs about a
+                single network round trip. (Until the stream's header arrives,
+                the number of chunks is unknown, so requests beyond the last
+                chunk may be sent: the server replies None to those.)"""
+                if self._pipeline is None:
+                    from ..simple_rpc import rpc_client as rpc_client_module
+                    self._pipeline = rpc_client_module.ZMQPipeline(rpc_client.rpc_addr, context=rpc_client.context)
+                pipeline = self._pipeline
+                stream_id = '{}/{}'.format(self._stream_prefix, next(self._stream_count))
+                try:
+                    pipeline.send('_transfer_ism_buffer._server_start_stream', stream_id, names, compressor,
+                        None, self.chunk_bytes, transform, self.packing, **compressor_args)
+                    for i in range(self.pipeline_depth):
+                        pipeline.send('_transfer_ism_buffer._server_next_chunk', stream_id)
+                    requested = self.pipeline_depth
+                    descriptions = pipeline.receive()
+                    total = _chunk_count(descriptions)
+                    nbytes = 0
+                    def chunks():
+                        nonlocal requested, nbytes
+                        for i in range(total):
+                            chunk = pipeline.receive()
+                            if requested < total:
+                                pipeline.send('_transfer_ism_buffer._server_next_chunk', stream_id)
+                                requested += 1
+                            nbytes += len(chunk)
+                            yield chunk
+                    arrays = _unpack_chunks(descriptions, chunks(), compressor)
+                    for i in range(requested - total):
+                        pipeline.receive() # None, for requests past the last chunk
+                except:
+                    pipeline.reset()
+                    raise
+                return arrays, nbytes
 
             def __call__(self, name):
-                data = rpc_client('_transfer_ism_buffer._server_pack_data', name, self.compressor, self.downsample, **self.compressor_args)
+                return self.get_many([name])[0]
+
+            def get_many(self, names):
+                """Return a list of arrays for the named images, all fetched
+                (and released on the server) in a single pipelined exchange
+                with the server, costing about one network round trip."""
+                if not names:
+                    return []
+                transform = _binned_transform(self.transform, self.downsample)
+                arrays, nbytes = self._fetch(names, self.compressor, transform, self.compressor_args)
+                return arrays
+
+            def get_pool_stats(self):
+                """Return the statistics of the server's pool of recycled
+                image buffers (see ArrayPool.get_stats())."""
+                return rpc_client('_transfer_ism_buffer._server_get_pool_stats')
+
+            def take_pending_releases(self):
+                """Remote transfers are released as they are sent, so there
+                is never anything to release."""
+                return []
+
+            def flush_releases(self):
+                pass
+
+            def close(self):
+                if self._pipeline is not None:
+                    self._pipeline.close()
+                    self._pipeline = None
+
+            def get_unchunked(self, name):
+                """Fetch the named image compressed as a single piece, rather
+                than as chunks compressed in parallel (e.g. for benchmarking)."""
+                transform = _binned_transform(self.transform, self.downsample)
+                data = rpc_client('_transfer_ism_buffer._server_pack_data', name, self.compressor, transform=transform,
+                    **self.compressor_args)
                 return _client_unpack_data(data, self.compressor)
         get_data = GetData()
     return is_local, get_data